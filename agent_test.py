@@ -1,5 +1,12 @@
+from reverie.backend_server import tracing
 from reverie.backend_server.persona.Agent import Agent
 from reverie.backend_server.persona.AgentFactory import AgentBuilder
+from reverie.backend_server.persona.models.ConnectionPool import ConnectionPool
+from reverie.backend_server.persona.models.EmbeddingModel import EmbeddingModel
+from reverie.backend_server.persona.models.FakeOllama import FakeOllama
+from reverie.backend_server.persona.models.Llama3Instruct import LLama3Instruct
+from reverie.backend_server.persona.models.ResponseCache import ResponseCache
+from reverie.backend_server.simulation.SimulationRunner import SimulationRunner
 from reverie.backend_server.world.World import World
 from reverie.backend_server.world.WorldFactory import WorldFactory
 import sys
@@ -22,20 +29,18 @@ def action_tick_test(agent: Agent, world: World):
       world._tick()
     agent.tick()
 
+def runner_test(agent: Agent, world: World, concurrency: int):
+  '''Same as action_tick_test, but the runner owns the clock'''
+  for _ in range(60 * 7):
+    world._tick()
+  SimulationRunner(world, [agent], concurrency).run_ticks(100)
+
+def event_test(agent: Agent, world: World, concurrency: int):
+  '''A week with the runner, skipping the minutes in which the agent has nothing to do'''
+  SimulationRunner(world, [agent], concurrency).run_minutes(60 * 24 * 7)
+
 def save(name, agent):
-  os.makedirs(name, exist_ok=True)
-  state = agent.state()
-  print(state)
-  with open(f'{name}/daily_planner.json', 'w') as file:
-    json.dump(state['daily_planner'], file, indent=2)
-  with open(f'{name}/eyes.json', 'w') as file:
-    json.dump(state['eyes'], file, indent=2)
-  with open(f'{name}/personality.json', 'w') as file:
-    json.dump(state['personality'], file, indent=2)
-  with open(f'{name}/short_term_memory.json', 'w') as file:
-    json.dump(state['short_term_memory'], file, indent=2)
-  with open(f'{name}/spatial_memory.json', 'w') as file:
-    json.dump(state['spatial_memory'], file, indent=2)
+  agent.save(name)
 
 if __name__ == '__main__':
   # Setting up argument parsing
@@ -46,12 +51,41 @@ if __name__ == '__main__':
                       help='Path to the world assets.')
   parser.add_argument('--personality_path', type=str, required=True, 
                       help='Path to the personality assets.')
+  parser.add_argument('--llm_cache', type=str, default=None,
+                      help='Path to a response cache file, LLM responses are stored and reused from here.')
+  parser.add_argument('--llm_cache_mode', type=str, default='record', choices=ResponseCache.modes,
+                      help='record: reuse and store responses, replay: only reuse responses, bypass: ignore the cache.')
+  parser.add_argument('--llm_cache_size', type=int, default=50000,
+                      help='Maximum amount of cached responses before the least recently used are evicted.')
+  parser.add_argument('--concurrency', type=int, default=4,
+                      help='Amount of agent ticks that run concurrently with the runner test, match it to OLLAMA_NUM_PARALLEL.')
+  parser.add_argument('--ollama_host', type=str, default='http://localhost:11434',
+                      help='Address of the Ollama server.')
+  parser.add_argument('--request_timeout', type=float, default=600.0,
+                      help='Seconds a single model request may take.')
+  parser.add_argument('--fake_llm', type=float, default=None, metavar='LATENCY',
+                      help='Use a deterministic stand in for Ollama (see FakeOllama.py) that answers after LATENCY seconds, instead of --ollama_host.')
+  parser.add_argument('--trace', type=str, default=None,
+                      help='Write spans to this file, a Chrome trace if it ends in .json, json lines otherwise (see tracing.py).')
   args = parser.parse_args()
+  if args.trace is not None:
+    tracing.export_to(args.trace)
 
   # Initializing world and agent
   world_factory = WorldFactory()
   world = world_factory.produce_world(f'./assets/world/{args.world_path}')
-  agent_factory = AgentBuilder(world)
+  fake_llm = None
+  if args.fake_llm is not None:
+    fake_llm = FakeOllama(latency=args.fake_llm).start()
+    args.ollama_host = fake_llm.host
+  cache = None
+  if args.llm_cache is not None:
+    cache = ResponseCache(args.llm_cache, args.llm_cache_size, args.llm_cache_mode)
+  pool = ConnectionPool(timeout=args.request_timeout, limit_per_host=args.concurrency)
+  agent_factory = AgentBuilder(world,
+                               LLama3Instruct(cache=cache, host=args.ollama_host, pool=pool),
+                               EmbeddingModel(host=args.ollama_host, pool=pool),
+                               pool)
   agent = agent_factory.initialize_agent(f'./assets/personalities/{args.personality_path}')
 
   # Testing world time with agent time synchronization
@@ -70,6 +104,12 @@ if __name__ == '__main__':
     elif test_type == 'action_test':
       print("Running action test...")
       action_tick_test(agent, world)
+    elif test_type == 'runner':
+      print("Running runner test...")
+      runner_test(agent, world, args.concurrency)
+    elif test_type == 'events':
+      print("Running event driven week test...")
+      event_test(agent, world, args.concurrency)
     elif test_type == 'save':
       print("Running save test...")
       save('./assets/personalities/save_test', agent)  # You can customize the output directory name if needed
@@ -77,4 +117,14 @@ if __name__ == '__main__':
     else:
       print(f"Unknown test type: {test_type}. Skipping.")
 
+  if cache is not None:
+    print(f"LLM cache: {cache.stats}")
+    cache.close()
+  pool.close()
+  if fake_llm is not None:
+    print(f"Fake LLM requests: {fake_llm.counts}")
+    fake_llm.stop()
+  if args.trace is not None:
+    tracing.stop_export()
+    print(f"Metrics: {json.dumps(tracing.registry.snapshot(), indent=2)}")
   print("All tests completed.")
@@ -0,0 +1,115 @@
+'''
+End to end benchmarks of the simulation, against a FakeOllama model server.
+
+Run from the root of the repository:
+  python -m benchmarks.benchmark --out results.json
+  python -m benchmarks.benchmark --scenarios retrieval_10k pathfinding --baseline results.json
+
+Every scenario (see benchmarks/scenarios.py) runs in its own process and
+reports its wall time, the latency percentiles of everything it timed
+(including every model request), the spans and model call accounting of
+tracing.py, the requests the model server received and
+its peak RSS. The results are written as JSON with sorted keys, so that two
+runs can be diffed. With --baseline, wall times are compared to an earlier
+run and the exit code is 1 if any scenario got slower than --tolerance allows.
+'''
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+
+from benchmarks.scenarios import SCENARIOS, run_scenario
+
+
+def _commit()->str:
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return 'unknown'
+
+def _compare(results:dict, baseline:dict, tolerance:float)->bool:
+  '''
+  Prints the change in wall time per scenario, returns False if a scenario regressed.
+  '''
+  passed = True
+  for name, result in results['scenarios'].items():
+    previous = baseline.get('scenarios', {}).get(name)
+    if previous is None:
+      print(f'{name:<20} {result["wall_time"]:10.3f}s  (new)')
+      continue
+    change = result['wall_time'] / previous['wall_time'] - 1 if previous['wall_time'] > 0 else 0.0
+    regressed = change > tolerance
+    passed = passed and not regressed
+    print(f'{name:<20} {result["wall_time"]:10.3f}s  {change:+8.1%}{"  REGRESSION" if regressed else ""}')
+  return passed
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the simulation against a stand in model server.')
+  parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS),
+                      help='Scenarios to run, all by default.')
+  parser.add_argument('--out', type=str, default=None,
+                      help='Write the results to this file, otherwise they are printed.')
+  parser.add_argument('--baseline', type=str, default=None,
+                      help='Results of an earlier run to compare wall times with.')
+  parser.add_argument('--tolerance', type=float, default=0.2,
+                      help='Allowed relative slow down compared to the baseline.')
+  parser.add_argument('--world', type=str, default='testing',
+                      help='World under assets/world.')
+  parser.add_argument('--scale', type=str, default='3x3',
+                      help='Copies of the world along x and y in the _scaled scenarios, see benchmarks/worlds.py.')
+  parser.add_argument('--personality', type=str, default='continuation_test',
+                      help='Agent under assets/personalities.')
+  parser.add_argument('--latency', type=float, default=0.0,
+                      help='Seconds the fake model takes per request, 0 measures the engine alone.')
+  parser.add_argument('--token_latency', type=float, default=0.0,
+                      help='Seconds the fake model takes per generated token.')
+  parser.add_argument('--dimensions', type=int, default=768,
+                      help='Size of the embeddings.')
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='Times the world is constructed in world_construction.')
+  parser.add_argument('--ticks', type=int, default=1000,
+                      help='Agent ticks in action_ticks.')
+  parser.add_argument('--agents', type=int, default=20,
+                      help='Agents in many_agents and spatial_queries.')
+  parser.add_argument('--runner_ticks', type=int, default=30,
+                      help='Ticks in many_agents, starting at midnight so the first one plans the day.')
+  parser.add_argument('--concurrency', type=int, default=4,
+                      help='max_concurrency of the SimulationRunner in many_agents.')
+  parser.add_argument('--days', type=int, default=7,
+                      help='Simulated days in skipped_days.')
+  parser.add_argument('--queries', type=int, default=200,
+                      help='Retrievals in the retrieval scenarios.')
+  parser.add_argument('--paths', type=int, default=200,
+                      help='Paths found in pathfinding.')
+  parser.add_argument('--neighbours', type=int, default=1000,
+                      help='Moves and queries in spatial_queries.')
+  args = parser.parse_args()
+
+  results = {
+      'commit' : _commit(),
+      'python' : platform.python_version(),
+      'options' : {key : value for key, value in vars(args).items() if key not in ('scenarios', 'out', 'baseline', 'tolerance')},
+      'scenarios' : {},
+    }
+  context = multiprocessing.get_context('spawn')
+  for name in args.scenarios:
+    print(f'Running {name}...', file=sys.stderr)
+    # a fresh process per scenario, so that peak RSS is the scenario's own
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+      results['scenarios'][name] = executor.submit(run_scenario, name, args).result()
+
+  encoded = json.dumps(results, indent=2, sort_keys=True)
+  if args.out is not None:
+    with open(args.out, 'w') as file:
+      file.write(encoded + '\n')
+  else:
+    print(encoded)
+
+  if args.baseline is not None:
+    with open(args.baseline, 'r') as file:
+      baseline = json.load(file)
+    if not _compare(results, baseline, args.tolerance):
+      sys.exit(1)
@@ -0,0 +1,315 @@
+'''
+The benchmark scenarios, see benchmarks/benchmark.py for how they are run.
+
+Every scenario runs in a fresh process against a FakeOllama server, so that
+peak RSS belongs to that scenario alone and only the simulation engine (and
+the artificial model latency, if any) is measured.
+A scenario takes the Recorder and the command line options, and times what it
+measures with recorder.time.
+'''
+import argparse
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+import functools
+import os
+import resource
+import tempfile
+import time
+from typing import Callable, Iterator
+
+import numpy as np
+
+from reverie.backend_server import tracing
+from reverie.backend_server.persona.AgentFactory import AgentBuilder
+from reverie.backend_server.persona.core.ConceptStore import digest
+from reverie.backend_server.persona.core.Personality import Personality
+from reverie.backend_server.persona.core.ShortTermMemory import ShortTermMemory
+from reverie.backend_server.persona.core.SpatialMemory import SpatialMemory
+from reverie.backend_server.persona.models.ConnectionPool import ConnectionPool
+from reverie.backend_server.persona.models.EmbeddingModel import EmbeddingModel
+from reverie.backend_server.persona.models.FakeOllama import FakeOllama
+from reverie.backend_server.persona.models.Llama3Instruct import LLama3Instruct
+from reverie.backend_server.simulation.SimulationRunner import SimulationRunner
+from reverie.backend_server.world.NavigationGraph import NavigationGraph
+from reverie.backend_server.world.Pathfinder import Pathfinder
+from reverie.backend_server.world.World import World
+from reverie.backend_server.world.WorldFactory import WorldFactory
+
+from benchmarks.worlds import tiled_world
+
+
+class Recorder:
+  '''
+  Collects the duration of every call of everything that is timed.
+  '''
+  def __init__(self) -> None:
+    self.__timings:dict[str,list[float]] = {}
+
+  @contextmanager
+  def time(self, name:str)->Iterator[None]:
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.__timings.setdefault(name, []).append(time.perf_counter() - start)
+
+  def summary(self)->dict[str,dict[str,float]]:
+    '''
+    Per name: the amount of calls, their total, and latency percentiles, in seconds.
+    '''
+    summary = {}
+    for name, timings in sorted(self.__timings.items()):
+      values = np.asarray(timings)
+      summary[name] = {
+          'calls' : len(timings),
+          'total' : float(values.sum()),
+          'mean' : float(values.mean()),
+          'p50' : float(np.percentile(values, 50)),
+          'p90' : float(np.percentile(values, 90)),
+          'p99' : float(np.percentile(values, 99)),
+          'max' : float(values.max()),
+        }
+    return summary
+
+
+class TimedLLama3Instruct(LLama3Instruct):
+  '''
+  Records the latency of every request to the model as 'llm'.
+  '''
+  def __init__(self, recorder:Recorder, **kwargs) -> None:
+    self.__recorder = recorder
+    super().__init__(**kwargs)
+
+  def _call_model(self, prompt_arguments:dict)->str:
+    with self.__recorder.time('llm'):
+      return super()._call_model(prompt_arguments)
+
+  def _call_model_with_context(self, prompt_arguments:dict)->dict:
+    with self.__recorder.time('llm'):
+      return super()._call_model_with_context(prompt_arguments)
+
+  def _stream_model(self, prompt_arguments:dict, prefix_validate:Callable[[str],bool])->str:
+    with self.__recorder.time('llm'):
+      return super()._stream_model(prompt_arguments, prefix_validate)
+
+
+class TimedEmbeddingModel(EmbeddingModel):
+  '''
+  Records the latency of every embedding request as 'embedding'.
+  '''
+  def __init__(self, recorder:Recorder, **kwargs) -> None:
+    self.__recorder = recorder
+    super().__init__(**kwargs)
+
+  def _request_batch(self, phrases:list[str])->list[list[float]]:
+    with self.__recorder.time('embedding'):
+      return super()._request_batch(phrases)
+
+
+# Helpers
+
+def _builder(recorder:Recorder, server:FakeOllama, world:World)->AgentBuilder:
+  pool = ConnectionPool()
+  return AgentBuilder(world,
+                      TimedLLama3Instruct(recorder, host=server.host, pool=pool),
+                      TimedEmbeddingModel(recorder, host=server.host, pool=pool),
+                      pool)
+
+def _world_location(options, scaled:bool)->str:
+  '''
+  The directory of options.world, or of options.scale copies of it (see benchmarks/worlds.py),
+  which is generated in options.worlds once per scenario, outside of any timing.
+  '''
+  if not scaled:
+    return f'./assets/world/{options.world}'
+  copies = tuple(int(count) for count in options.scale.split('x'))
+  target = os.path.join(options.worlds, f'{options.world}_{options.scale}')
+  if not os.path.exists(os.path.join(target, 'world_meta_info.json')):
+    tiled_world(f'./assets/world/{options.world}', target, copies)
+  return target
+
+def _world(options, scaled:bool=False)->World:
+  return WorldFactory().produce_world(_world_location(options, scaled))
+
+def _advance_to_midnight(world:World):
+  while (world.current_time.hour, world.current_time.minute) != (0, 0):
+    world._tick()
+
+# Scenarios
+
+def world_construction(recorder:Recorder, server:FakeOllama, options, scaled:bool=False):
+  _world_location(options, scaled)
+  for _ in range(options.repeat):
+    with recorder.time('produce_world'):
+      _world(options, scaled)
+
+def day_planning(recorder:Recorder, server:FakeOllama, options):
+  world = _world(options)
+  builder = _builder(recorder, server, world)
+  with recorder.time('initialize_agent'):
+    agent = builder.initialize_agent(f'./assets/personalities/{options.personality}')
+  _advance_to_midnight(world)
+  with recorder.time('plan_day'):
+    agent.tick()
+
+def action_ticks(recorder:Recorder, server:FakeOllama, options):
+  world = _world(options)
+  builder = _builder(recorder, server, world)
+  agent = builder.initialize_agent(f'./assets/personalities/{options.personality}')
+  _advance_to_midnight(world)
+  agent.tick()
+  # same start as agent_test.py, the morning is when things happen
+  for _ in range(60 * 7):
+    world._tick()
+  for _ in range(options.ticks):
+    world._tick()
+    with recorder.time('tick'):
+      agent.tick()
+
+def many_agents(recorder:Recorder, server:FakeOllama, options, scaled:bool=False):
+  '''
+  options.agents copies of the same agent, ticked by the SimulationRunner from midnight on.
+  '''
+  world = _world(options, scaled)
+  builder = _builder(recorder, server, world)
+  _advance_to_midnight(world)
+  world._tick_back()
+  with recorder.time('initialize_agents'):
+    agents = [builder.initialize_agent(f'./assets/personalities/{options.personality}') for _ in range(options.agents)]
+  runner = SimulationRunner(world, agents, options.concurrency)
+  for _ in range(options.runner_ticks):
+    with recorder.time('step'):
+      runner.run_ticks(1)
+
+def skipped_days(recorder:Recorder, server:FakeOllama, options):
+  '''
+  options.days with one agent, skipping the minutes in which it has nothing to do.
+  '''
+  world = _world(options)
+  builder = _builder(recorder, server, world)
+  _advance_to_midnight(world)
+  world._tick_back()
+  agent = builder.initialize_agent(f'./assets/personalities/{options.personality}')
+  runner = SimulationRunner(world, [agent], options.concurrency)
+  for _ in range(options.days):
+    with recorder.time('day'):
+      runner.run_minutes(60 * 24)
+
+def retrieval(recorder:Recorder, server:FakeOllama, options, concepts:int):
+  '''
+  Retrieval from a synthetic short term memory of the given size, loaded the way Agent.save stores it.
+  '''
+  rng = np.random.default_rng(0)
+  now = datetime(2024, 10, 25, 8)
+  records = [{
+      'type' : ('event', 'thought', 'chat')[i % 3],
+      'created' : str(now - timedelta(minutes=int(minutes))),
+      'last_accessed' : str(now - timedelta(minutes=int(minutes) // 2)),
+      'description' : f'synthetic concept {i}',
+      'impact' : int(impact),
+    } for i, (minutes, impact) in enumerate(zip(rng.integers(1, 60 * 24 * 30, concepts),
+                                                rng.integers(1, 11, concepts)))]
+  embeddings = rng.standard_normal((concepts, options.dimensions), dtype=np.float32)
+  norms = np.linalg.norm(embeddings, axis=1).astype(np.float32)
+  embeddings /= norms[:, None]
+  personality = Personality({'first_name' : 'Synthetic', 'last_name' : 'Agent', 'age' : 30,
+                             'innate_traits' : '', 'lifestyle' : '', 'learned_traits' : ''})
+  with recorder.time('load_memory'):
+    memory = ShortTermMemory({'concepts' : records, 'currently' : '', 'attention_span' : 15},
+                             lambda: now, None, personality,
+                             EmbeddingModel(host=server.host),
+                             snapshot_embeddings=(embeddings, norms, digest(embeddings)))
+  queries = rng.standard_normal((options.queries, 2, options.dimensions))
+  for query in queries:
+    with recorder.time('retrieve'):
+      memory.retrieve_relevant_concepts(list(query))
+
+def pathfinding(recorder:Recorder, server:FakeOllama, options, scaled:bool=False):
+  world = _world(options, scaled)
+  # AgentBuilder does this for agents
+  Pathfinder.warm_up()
+  NavigationGraph.warm_up()
+  with recorder.time('navigation_graph'):
+    world.navigation_graph
+  walkable = np.argwhere(world.collision_map > 0)
+  rng = np.random.default_rng(0)
+  pairs = rng.integers(0, len(walkable), (options.paths, 2))
+  # the second time around every path is in the cache of the world
+  for name in ('path', 'cached_path'):
+    for start, goal in pairs:
+      spatial_memory = SpatialMemory({'current_location' : world.get_tile(tuple(walkable[start])),
+                                      'object_locations' : {},
+                                      'agents' : {}}, world)
+      with recorder.time(name):
+        spatial_memory._path_finding(world.get_tile(tuple(walkable[goal])))
+  # opt in, see World.find_path
+  for start, goal in pairs:
+    with recorder.time('hierarchical_path'):
+      world.find_path(tuple(walkable[start]), tuple(walkable[goal]), hierarchical=True)
+  for location in walkable[rng.integers(0, len(walkable), 20)]:
+    world.set_collision(tuple(location), True)
+    with recorder.time('navigation_graph_update'):
+      world.navigation_graph
+
+def spatial_queries(recorder:Recorder, server:FakeOllama, options):
+  world = _world(options)
+  walkable = np.argwhere(world.collision_map > 0)
+  rng = np.random.default_rng(0)
+  # only the index is measured, so anything can stand in for an agent
+  agents = [object() for _ in range(options.agents)]
+  for agent, location in zip(agents, rng.integers(0, len(walkable), options.agents)):
+    world.get_tile(tuple(walkable[location]))._add_agent(agent)
+  index = world.spatial_index
+  for agent, location in zip(rng.integers(0, options.agents, options.neighbours),
+                             rng.integers(0, len(walkable), options.neighbours)):
+    center = tuple(walkable[location])
+    with recorder.time('move'):
+      index.agent_tile(agents[agent])._remove_agent(agents[agent])
+      world.get_tile(center)._add_agent(agents[agent])
+    with recorder.time('agents_within'):
+      index.agents_within(center, 8)
+    with recorder.time('tiles_within'):
+      index.tiles_within(center, 8)
+    with recorder.time('nearest_object'):
+      index.nearest_object(center, 'bed')
+
+SCENARIOS:dict[str,Callable] = {
+    'world_construction' : world_construction,
+    'world_construction_scaled' : functools.partial(world_construction, scaled=True),
+    'day_planning' : day_planning,
+    'action_ticks' : action_ticks,
+    'many_agents' : many_agents,
+    'many_agents_scaled' : functools.partial(many_agents, scaled=True),
+    'skipped_days' : skipped_days,
+    'retrieval_1k' : functools.partial(retrieval, concepts=1000),
+    'retrieval_10k' : functools.partial(retrieval, concepts=10000),
+    'retrieval_100k' : functools.partial(retrieval, concepts=100000),
+    'pathfinding' : pathfinding,
+    'pathfinding_scaled' : functools.partial(pathfinding, scaled=True),
+    'spatial_queries' : spatial_queries,
+  }
+
+def run_scenario(name:str, options)->dict:
+  '''
+  Runs one scenario in this process, meant to be called in a fresh process.
+  '''
+  recorder = Recorder()
+  # scaled worlds are generated in here, see _world_location
+  with tempfile.TemporaryDirectory() as worlds:
+    options = argparse.Namespace(**vars(options), worlds=worlds)
+    with FakeOllama(latency=options.latency,
+                    token_latency=options.token_latency,
+                    dimensions=options.dimensions) as server:
+      with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        SCENARIOS[name](recorder, server, options)
+        wall_time = time.perf_counter() - start
+      requests = server.counts
+  return {
+      'wall_time' : wall_time,
+      # kilobytes on linux
+      'peak_rss_mb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+      'timings' : recorder.summary(),
+      'requests' : requests,
+      'metrics' : tracing.registry.snapshot(),
+    }
@@ -0,0 +1,69 @@
+'''
+Synthetic worlds that are larger than the ones in assets/world, for the benchmarks.
+
+A world is scaled up by tiling copies of an asset world next to each other.
+Every copy but the first gets sectors of its own (the sector names get the
+position of the copy appended), so that the arenas of the copies are distinct
+like the arenas of a real map are. The first copy is the asset world unchanged,
+so the agents under assets/personalities spawn and find their way around it
+as usual. Game objects and arenas keep their ids, like repeated objects in the
+asset worlds.
+'''
+import json
+import os
+import shutil
+
+
+def _read_maze(path:str)->list[list[str]]:
+  with open(path, 'r') as file:
+    return [line.strip().split(',') for line in file if line.strip()]
+
+def _write_maze(path:str, maze:list[list[str]]):
+  with open(path, 'w') as file:
+    for row in maze:
+      file.write(','.join(row) + '\n')
+
+def _tile(maze:list[list[str]], copies:tuple[int,int], rename=lambda cell, copy: cell)->list[list[str]]:
+  '''
+  copies[0] copies along x (the rows of a maze) by copies[1] along y.
+  '''
+  return [[rename(cell, (copy_x, copy_y)) for copy_y in range(copies[1]) for cell in row]
+          for copy_x in range(copies[0]) for row in maze]
+
+def _sector_id(sector_id:str, copy:tuple[int,int])->str:
+  if copy == (0, 0) or sector_id == '0':
+    return sector_id
+  return f'{sector_id}.{copy[0]}.{copy[1]}'
+
+def tiled_world(source:str, target:str, copies:tuple[int,int])->str:
+  '''
+  Writes copies[0] by copies[1] copies of the world in the source directory to the
+  target directory, in the format WorldFactory.produce_world reads. Returns target.
+  '''
+  if copies[0] < 1 or copies[1] < 1:
+    raise ValueError(f"A world needs at least one copy in each direction, got {copies}")
+  os.makedirs(os.path.join(target, 'maze'), exist_ok=True)
+  shutil.copytree(os.path.join(source, 'blocks'), os.path.join(target, 'blocks'), dirs_exist_ok=True)
+
+  with open(os.path.join(source, 'world_meta_info.json'), 'r') as file:
+    meta_info = json.load(file)
+  meta_info['name'] = f"{meta_info['name']} {copies[0]}x{copies[1]}"
+  meta_info['map_width'] = int(meta_info['map_width']) * copies[0]
+  meta_info['map_length'] = int(meta_info['map_length']) * copies[1]
+  with open(os.path.join(target, 'world_meta_info.json'), 'w') as file:
+    json.dump(meta_info, file, indent=1)
+
+  with open(os.path.join(source, 'blocks', 'sectors.json'), 'r') as file:
+    sectors = json.load(file)
+  tiled_sectors = {_sector_id(sector_id, (copy_x, copy_y)) : name if (copy_x, copy_y) == (0, 0) else f'{name} ({copy_x},{copy_y})'
+                   for copy_x in range(copies[0]) for copy_y in range(copies[1]) for sector_id, name in sectors.items()}
+  with open(os.path.join(target, 'blocks', 'sectors.json'), 'w') as file:
+    json.dump(tiled_sectors, file, indent=1)
+
+  for maze_file in os.listdir(os.path.join(source, 'maze')):
+    if not maze_file.endswith('.csv'):
+      continue
+    maze = _read_maze(os.path.join(source, 'maze', maze_file))
+    rename = _sector_id if maze_file == 'sector_maze.csv' else (lambda cell, copy: cell)
+    _write_maze(os.path.join(target, 'maze', maze_file), _tile(maze, copies, rename))
+  return target
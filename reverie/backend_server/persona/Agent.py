@@ -8,12 +8,17 @@ Note (May 1, 2023) -- this is effectively GenerativeAgent class. Persona was
 the term we used internally back in 2022, taking from our Social Simulacra 
 paper.
 """
+import json
 import math
+import os
 import sys
 import datetime
 import random
 from typing import Union
 
+import numpy as np
+
+from reverie.backend_server import tracing
 from reverie.backend_server.persona.core.Personality import Personality
 from reverie.backend_server.persona.core.ShortTermMemory import ShortTermMemory
 from reverie.backend_server.persona.core.SpatialMemory import SpatialMemory
@@ -47,17 +52,38 @@ class Agent:
     self.__default_interactor = DefaultInteractor(self.__daily_planner,self.__personality,model,time_func)
     self.__availible_interactors:list[Interactor] = [ComputerInteractor(self.__daily_planner,self.__personality,model,time_func)]
     self.__current_interactor:Union[Interactor,None] = None
+    # whether _component_states may have changed since _drain_component_states
+    self.__components_changed = True
 
   def save(self, save_folder): 
     """
     Save persona's current state (i.e., memory). 
+    The same files as state() are written, except that the embeddings of short term
+    memory are written to short_term_memory.npy (normalised float32 rows), and the
+    manifest in short_term_memory.json refers to it under the 'embeddings' key.
+    AgentBuilder.initialize_agent loads either format.
 
     INPUT: 
       save_folder: The folder where we wil be saving our persona's state. 
     OUTPUT: 
       None
     """
-    raise NotImplementedError()
+    os.makedirs(save_folder, exist_ok=True)
+    short_term_memory, (embeddings, norms, digests) = self.__short_term_memory.snapshot()
+    # The matrix is written first so that a manifest never refers to a missing matrix.
+    np.save(os.path.join(save_folder, 'short_term_memory.npy'), embeddings)
+    short_term_memory['embeddings'] = {
+        'file' : 'short_term_memory.npy',
+        'norms' : norms.tolist(),
+        'digests' : digests.tolist()
+      }
+    state = {
+        **self._component_states(),
+        "short_term_memory" : short_term_memory
+      }
+    for name, component in state.items():
+      with open(os.path.join(save_folder, f'{name}.json'), 'w') as file:
+        json.dump(component, file)
 
   def _plan_day(self):
     if self.__simulated:
@@ -82,11 +108,13 @@ class Agent:
         self.__current_interactor = None
     elif object is not None and self.__current_interactor is None:
       self.__current_interactor = object
+  @tracing.traced()
   def tick(self):
       """
       This is the main cognitive function where our main sequence is called. 
       Each tick is 1 minute.
       """
+      self.__components_changed = True
       current_time = self.__short_term_memory.get_current_time()
       if current_time.minute + current_time.hour + current_time.second == 0:
         self._plan_day()
@@ -138,6 +166,37 @@ class Agent:
   def name(self)->str:
     return self.__personality.full_name
 
+  @property
+  def current_target(self)->Union[WorldObject,None]:
+    '''
+    The object that the current task is performed with, if any.
+    '''
+    current_task = self.__daily_planner.current_task
+    if current_task is None:
+      return None
+    task,_ = current_task
+    return task.target
+
+  def next_event_time(self)->datetime.datetime:
+    '''
+    The earliest time at which tick can do something different from the last tick.
+    With a target, the interactor is driven every minute. Without one, a tick only
+    changes something when a task in the schedule starts or ends, or at midnight when
+    the next day is planned, so the minutes in between can be skipped (see SimulationRunner).
+    Skipping stops as soon as another agent could be in view, the events around it are
+    then seen minute by minute.
+    '''
+    current_time = self.__short_term_memory.get_current_time()
+    next_minute = current_time + datetime.timedelta(minutes=1)
+    if not self.__simulated or self.current_target is not None:
+      return next_minute
+    midnight = current_time.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+    boundary = self.__daily_planner.next_boundary(current_time)
+    event = midnight if boundary is None else max(min(boundary, midnight), next_minute)
+    horizon = math.ceil((event - current_time) / datetime.timedelta(minutes=1))
+    sighting = current_time + datetime.timedelta(minutes=self.__eyes.minutes_until_sighting(self, horizon))
+    return max(min(event, sighting), next_minute)
+
   @property
   def status(self)->str:
     raise NotImplementedError()
@@ -147,10 +206,38 @@ class Agent:
     return current_time
 
   def state(self):
+    return {
+        **self._component_states(),
+        "short_term_memory" : self.__short_term_memory.state()
+      }
+
+  def _component_states(self)->dict:
+    '''
+    The state of everything except memory, these are all small.
+    Memory is large, so it is checkpointed through its change feed instead.
+    '''
     return {
         "daily_planner" : self.__daily_planner.state(),
         "eyes" : self.__eyes.state(),
         "personality" : self.__personality.state(),
-        "short_term_memory" : self.__short_term_memory.state(),
         "spatial_memory" : self.__spatial_memory.state()
       }
+
+  def _drain_component_states(self)->Union[dict,None]:
+    '''
+    The same as _component_states, or None when the agent has not ticked since the last
+    drain, in which case nothing in them changed. Used for checkpointing.
+    '''
+    if not self.__components_changed:
+      return None
+    self.__components_changed = False
+    return self._component_states()
+
+  def _track_memory_changes(self):
+    self.__short_term_memory._track_changes()
+
+  def _drain_memory_changes(self)->list[dict]:
+    return self.__short_term_memory._drain_changes()
+
+  def _apply_memory_changes(self,changes:list[dict]):
+    self.__short_term_memory._apply_changes(changes)
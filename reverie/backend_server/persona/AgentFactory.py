@@ -1,6 +1,10 @@
 from collections.abc import Callable
 from datetime import datetime
 import json
+import os
+from typing import Union
+
+import numpy as np
 from reverie.backend_server.persona.Agent import Agent
 from reverie.backend_server.persona.core.Cognition import Cognition
 from reverie.backend_server.persona.core.Personality import Personality
@@ -8,25 +12,56 @@ from reverie.backend_server.persona.core.ShortTermMemory import ShortTermMemory
 from reverie.backend_server.persona.core.SpatialMemory import SpatialMemory
 from reverie.backend_server.persona.core.environment.Eyes import Eyes
 from reverie.backend_server.persona.core.environment.Legs import Legs
+from reverie.backend_server.persona.core import kernels
 from reverie.backend_server.persona.core.planning.DailyPlanning import DailyPlanning, DailyPlanningData, Task, TimePeriod
 from reverie.backend_server.persona.core.social.EmotionRegulator import EmotionalRegulator
+from reverie.backend_server.persona.models.ConnectionPool import ConnectionPool
+from reverie.backend_server.persona.models.EmbeddingModel import EmbeddingModel
 from reverie.backend_server.persona.models.Llama3Instruct import LLama3Instruct
+from reverie.backend_server.persona.models.ModelSession import ModelSession
 from reverie.backend_server.persona.models.model import Model
+from reverie.backend_server.world.NavigationGraph import NavigationGraph
+from reverie.backend_server.world.Pathfinder import Pathfinder
 from reverie.backend_server.world.World import World
 from reverie.backend_server.world.world_objects.WorldObject import WorldObject
 
 
 class AgentBuilder:
-  def __init__(self, world:World) -> None:
+  def __init__(self,
+               world:World,
+               llm:Union[Model,None]=None,
+               embedding_model:Union[EmbeddingModel,None]=None,
+               pool:Union[ConnectionPool,None]=None,
+               num_ctx:int=8192,
+               keep_alive:str='24h') -> None:
+    '''
+    The llm and embedding model are shared by every agent built by this builder.
+    If none are provided, a default LLama3Instruct and EmbeddingModel are used,
+    which share the connection pool (a default ConnectionPool if none is provided).
+    Every agent talks to the llm through its own ModelSession with num_ctx and keep_alive.
+    '''
     self.__world = world
-    self.__llm = LLama3Instruct()
+    self.__pool = pool if pool is not None else ConnectionPool()
+    self.__llm = llm if llm is not None else LLama3Instruct(pool=self.__pool)
+    self.__embedder = embedding_model if embedding_model is not None else EmbeddingModel(pool=self.__pool)
+    self.__num_ctx = num_ctx
+    self.__keep_alive = keep_alive
+    # Compile the retrieval and path finding kernels once, before any agent needs them.
+    kernels.warm_up()
+    Pathfinder.warm_up()
+    NavigationGraph.warm_up()
+
+  @property
+  def pool(self)->ConnectionPool:
+    return self.__pool
 
   def initialize_agent(self,target:str)->Agent:
     # TODO: test this
     time_func = lambda : self.__world.current_time
     personality = self.__create_personality(
         f'{target}/personality.json')
-    emotional_regulator = EmotionalRegulator(personality,self.__llm)
+    llm = ModelSession(self.__llm, personality, self.__num_ctx, self.__keep_alive)
+    emotional_regulator = EmotionalRegulator(personality,llm)
     short_term_memory = self.__create_memory(
         f'{target}/short_term_memory.json',
         time_func,
@@ -38,7 +73,8 @@ class AgentBuilder:
         personality,
         short_term_memory,
         spatial_memory,
-        self.__world._objects())
+        self.__world._objects(),
+        llm)
     eyes = self.__create_eyes(
         f'{target}/eyes.json',
         spatial_memory,
@@ -47,7 +83,7 @@ class AgentBuilder:
 
     # Make agent
 
-    agent = Agent(personality,emotional_regulator,short_term_memory,spatial_memory,daily_planner,eyes,self.__llm,time_func)
+    agent = Agent(personality,emotional_regulator,short_term_memory,spatial_memory,daily_planner,eyes,llm,time_func)
 
     # Attach other objects to agent
     legs = Legs(self.__world,spatial_memory,agent)
@@ -66,7 +102,16 @@ class AgentBuilder:
                       personality:Personality,
                       )->ShortTermMemory:
     short_term_data = json.load(open(target,'r'))
-    return ShortTermMemory(short_term_data,time_func,emotional_regulator,personality)
+    snapshot_embeddings = None
+    # Saved by Agent.save, the embeddings are memory mapped so they are only read when used.
+    if 'embeddings' in short_term_data:
+      manifest = short_term_data['embeddings']
+      embeddings = np.load(os.path.join(os.path.dirname(target), manifest['file']), mmap_mode='r')
+      snapshot_embeddings = (embeddings,
+                             np.asarray(manifest['norms'],dtype=np.float32),
+                             np.asarray(manifest['digests'],dtype=np.uint64))
+    return ShortTermMemory(short_term_data,time_func,emotional_regulator,personality,self.__embedder,
+                           snapshot_embeddings=snapshot_embeddings)
 
   def __create_spatial_memory(self,target:str):
     raw_data = json.load(open(target,'r'))
@@ -93,6 +138,7 @@ class AgentBuilder:
                              short_term_memory:ShortTermMemory,
                              spatial_memory:SpatialMemory,
                              world_objects:dict[str,WorldObject],
+                             llm:Model,
                              )->DailyPlanning:
     def create_daily_planning_data_object(data:dict):
       time_format = "%Y-%m-%d %H:%M:%S"
@@ -125,7 +171,7 @@ class AgentBuilder:
     current_daily_plan = create_daily_planning_data_object(daily_planning_data['data'])
     previous_daily_plan = create_daily_planning_data_object(daily_planning_data['previous'])
     current_steps = daily_planning_data['steps']
-    return DailyPlanning(self.__llm,personality,short_term_memory,spatial_memory,standard_tasks,current_daily_plan,previous_daily_plan,current_steps)
+    return DailyPlanning(llm,personality,short_term_memory,spatial_memory,standard_tasks,current_daily_plan,previous_daily_plan,current_steps)
 
   def __create_eyes(self,
                     target:str,
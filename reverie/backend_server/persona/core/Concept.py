@@ -1,61 +1,68 @@
+from __future__ import annotations
 from datetime import datetime
-from typing import Literal
+from typing import TYPE_CHECKING, Literal
 import numpy as np
 
+if TYPE_CHECKING:
+  from reverie.backend_server.persona.core.ConceptStore import ConceptStore
 
-class Concept: 
-  def __init__(self,
-               node_id:str,
-               node_type:Literal["chat","event","thought"],
-               created:datetime, 
-               last_accessed:datetime,
-               description:str, 
-               embedding:np.ndarray,
-               impact:int,
-               ): 
-    self._id = node_id
-    self._type_of_concept = node_type # thought / event / chat
-
-    self._created = created
-    self._last_accessed = last_accessed
-    self._description = description
-    # Maybe change to just the embedding per concept?
-    self._embedding = np.array(embedding)
-    self._impact = impact
-
-    # TODO: determine how to handle keywords
-    self._keywords = list(set())
+
+class Concept:
+  '''
+  A view of one concept in a ConceptStore.
+  All of the data lives in the store's columns, so that a concept only costs
+  two references. Concepts are created by ConceptStore.add, not directly.
+  '''
+  __slots__ = ('_store', '_slot')
+
+  def __init__(self, store:ConceptStore, slot:int):
+    self._store = store
+    self._slot = slot
 
   def __eq__(self, value: object, /) -> bool:
     if isinstance(value, Concept):
-      if value._created == self._created and self._description == value._description:
+      if value.created == self.created and self.description == value.description:
         return True
     return False
-  
+
+  def __hash__(self) -> int:
+    return hash((self.created, self.description))
+
+  @property
+  def keywords(self)->list[str]:
+    return self._store.keywords(self._slot)
+
+  @property
+  def node_type(self)->Literal["chat","event","thought"]:
+    return self._store.node_type(self._slot)
+
   @property
-  def keywords(self):
-    return self._keywords
+  def created(self)->datetime:
+    return self._store.created_at(self._slot)
 
   @property
-  def created(self):
-    return self._created
+  def id(self)->str:
+    return self._store.node_id(self._slot)
 
   @property
-  def id(self):
-    return self._id
+  def last_accessed(self)->datetime:
+    return self._store.last_accessed_at(self._slot)
 
   @property
-  def last_accessed(self):
-    return self._last_accessed
+  def description(self)->str:
+    return self._store.description(self._slot)
 
   @property
-  def description(self): 
-    return self._description
+  def embedding(self)->np.ndarray:
+    return self._store.embedding(self._slot)
 
   @property
-  def embedding(self):
-    return self._embedding
+  def impact(self)->int:
+    return self._store.impact_of(self._slot)
 
   @property
-  def impact(self):
-    return self._impact
+  def slot(self)->int:
+    '''
+    Row of this concept in its store.
+    '''
+    return self._slot
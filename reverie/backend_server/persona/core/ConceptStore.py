@@ -0,0 +1,351 @@
+'''
+Columnar storage for every concept in a memory.
+
+Instead of every Concept carrying its own python objects (a __dict__, a pair of
+datetimes, a string id and its own copy of the embedding), all of the data is
+kept here in parallel arrays, and Concept is a lightweight view over a row.
+This keeps the memory footprint per agent small, and means that bulk
+operations such as scoring and serialization are vector operations.
+'''
+from datetime import datetime, timedelta
+from typing import Literal, Union
+
+import numpy as np
+
+from reverie.backend_server.persona.core.Concept import Concept
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_seconds(time:datetime)->int:
+  '''
+  Timestamps are naive datetimes, so they are converted without any timezone.
+  '''
+  return int((time - _EPOCH).total_seconds())
+
+
+def from_epoch_seconds(seconds:int)->datetime:
+  return _EPOCH + timedelta(seconds=int(seconds))
+
+
+_digest_weights:dict[int,np.ndarray] = {}
+
+
+def digest(rows:np.ndarray)->Union[np.ndarray,np.uint64]:
+  '''
+  Deterministic hash of float32 rows (or a single row).
+  Unlike hash() this is the same in every process, so digests can be saved in a snapshot.
+  '''
+  dimensions = rows.shape[-1]
+  if dimensions not in _digest_weights:
+    _digest_weights[dimensions] = np.random.default_rng(dimensions).integers(
+        1, 2**63, size=dimensions, dtype=np.uint64) | np.uint64(1)
+  # integer overflow wraps around, which is what we want here
+  return np.ascontiguousarray(rows, dtype=np.float32).view(np.uint32).astype(np.uint64) @ _digest_weights[dimensions]
+
+
+class ConceptStore:
+  '''
+  Each stored concept occupies a slot (row) in:
+  - embeddings: float32 matrix of unit length embeddings
+  - norms: float32, the length of the original embedding
+  - created, last_accessed: int64 seconds since the epoch
+  - impact: int8
+  - type_codes: int8, index into ConceptStore.types
+  - node_numbers: int64, the number in the node id
+  - live: bool, False for slots that are free
+
+  A slot belongs to a concept for as long as it is stored, so slots can be
+  used as stable handles. Freed slots are reused by later concepts, and
+  any arrays returned by this class cover every slot up to the highest one
+  used so far, so the live mask must be applied by the caller.
+
+  The embeddings of a snapshot can be attached (see attach), in which case
+  the matrix may be a read only memory map that is only paged in as rows are used.
+  '''
+  types:tuple[str,...] = ('event', 'thought', 'chat')
+  __codes = {node_type : code for code, node_type in enumerate(types)}
+
+  def __init__(self, capacity:int=64) -> None:
+    self.__capacity = capacity
+    self.__used = 0
+    self.__free:list[int] = []
+    self.__embeddings:Union[np.ndarray,None] = None
+    # Amount of leading rows of the embeddings that were attached from a snapshot.
+    self.__attached = 0
+    self.__norms = np.zeros(capacity, dtype=np.float32)
+    self.__created = np.zeros(capacity, dtype=np.int64)
+    self.__last_accessed = np.zeros(capacity, dtype=np.int64)
+    self.__impact = np.zeros(capacity, dtype=np.int8)
+    self.__type_codes = np.zeros(capacity, dtype=np.int8)
+    self.__node_numbers = np.zeros(capacity, dtype=np.int64)
+    self.__live = np.zeros(capacity, dtype=bool)
+    # digest of each normalised row, used to find exact duplicates of a query without comparing every row.
+    self.__digests = np.zeros(capacity, dtype=np.uint64)
+    self.__descriptions:list[Union[str,None]] = []
+    self.__keywords:list[Union[list[str],None]] = []
+    self.__concepts:list[Union[Concept,None]] = []
+
+  @staticmethod
+  def normalize(embedding:np.ndarray)->np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+      return vector.copy()
+    return vector / norm
+
+  def attach(self, embeddings:np.ndarray, norms:np.ndarray, digests:np.ndarray):
+    '''
+    Uses a matrix of unit length rows as the embeddings of the next len(embeddings)
+    concepts that are added (in order, with embedding=None). Only allowed on an empty store.
+
+    The matrix is not read or copied here, so it can be a read only memory map.
+    It is copied into memory the first time the store has to grow, or the slot of a
+    removed concept is reused.
+    '''
+    if self.__used != 0:
+      raise ValueError("Embeddings can only be attached to an empty store")
+    if not (len(embeddings) == len(norms) == len(digests)):
+      raise ValueError("Attached embeddings, norms and digests must have the same length")
+    self.__embeddings = None
+    self.__grow(max(len(embeddings), 1))
+    self.__embeddings = embeddings
+    self.__norms[:len(norms)] = norms
+    self.__digests[:len(digests)] = digests
+    self.__attached = len(embeddings)
+
+  def __grow(self, capacity:int):
+    def resize(array:np.ndarray)->np.ndarray:
+      grown = np.zeros((capacity, *array.shape[1:]), dtype=array.dtype)
+      grown[:self.__used] = array[:self.__used]
+      return grown
+    if self.__embeddings is not None:
+      self.__embeddings = resize(self.__embeddings)
+    self.__norms = resize(self.__norms)
+    self.__created = resize(self.__created)
+    self.__last_accessed = resize(self.__last_accessed)
+    self.__impact = resize(self.__impact)
+    self.__type_codes = resize(self.__type_codes)
+    self.__node_numbers = resize(self.__node_numbers)
+    self.__live = resize(self.__live)
+    self.__digests = resize(self.__digests)
+    self.__capacity = capacity
+
+  def add(self,
+          node_number:int,
+          node_type:Literal["chat","event","thought"],
+          created:datetime,
+          last_accessed:datetime,
+          description:str,
+          embedding:Union[np.ndarray,None],
+          impact:int,
+          keywords:Union[list[str],None]=None)->Concept:
+    '''
+    Stores the concept and returns a view of it.
+    embedding may only be None while the attached embeddings are being used up.
+    '''
+    if node_type not in self.__codes:
+      raise ValueError(f"Unknown concept type: '{node_type}', expected one of {self.types}")
+    if embedding is None:
+      if not self.attaching:
+        raise ValueError("No attached embedding left for a concept without an embedding")
+      return self.__add_attached(node_number, node_type, created, last_accessed, description, impact, keywords)
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    row = vector / norm if norm != 0 else vector
+    if self.__embeddings is None:
+      self.__embeddings = np.zeros((self.__capacity, row.shape[0]), dtype=np.float32)
+    elif row.shape[0] != self.__embeddings.shape[1]:
+      raise ValueError(f"Embedding has dimension {row.shape[0]}, memory stores embeddings of dimension {self.__embeddings.shape[1]}")
+    if self.attaching:
+      raise ValueError("Attached embeddings must be used up before other concepts are added")
+
+    if self.__free:
+      slot = self.__free.pop()
+    else:
+      slot = self.__new_slot()
+
+    if slot < self.__attached and not self.__embeddings.flags.writeable:
+      # the slot is a row of the attached memory map
+      self.__embeddings = np.array(self.__embeddings)
+    self.__embeddings[slot] = row
+    self.__norms[slot] = norm
+    self.__digests[slot] = digest(row)
+    return self.__fill(slot, node_number, node_type, created, last_accessed, description, impact, keywords)
+
+  def __add_attached(self, node_number, node_type, created, last_accessed, description, impact, keywords)->Concept:
+    # norm and digest were attached with the row
+    slot = self.__new_slot()
+    return self.__fill(slot, node_number, node_type, created, last_accessed, description, impact, keywords)
+
+  def __new_slot(self)->int:
+    if self.__used == self.__capacity:
+      self.__grow(self.__capacity * 2)
+    slot = self.__used
+    self.__used += 1
+    self.__descriptions.append(None)
+    self.__keywords.append(None)
+    self.__concepts.append(None)
+    return slot
+
+  def __fill(self, slot, node_number, node_type, created, last_accessed, description, impact, keywords)->Concept:
+    self.__created[slot] = to_epoch_seconds(created)
+    self.__last_accessed[slot] = to_epoch_seconds(last_accessed)
+    self.__impact[slot] = impact
+    self.__type_codes[slot] = self.__codes[node_type]
+    self.__node_numbers[slot] = node_number
+    self.__live[slot] = True
+    self.__descriptions[slot] = description
+    self.__keywords[slot] = keywords if keywords is not None else []
+    concept = Concept(self, slot)
+    self.__concepts[slot] = concept
+    return concept
+
+  def remove(self, slot:int):
+    if not self.__live[slot]:
+      raise ValueError(f"Slot {slot} does not contain a concept")
+    self.__live[slot] = False
+    self.__descriptions[slot] = None
+    self.__keywords[slot] = None
+    self.__concepts[slot] = None
+    self.__free.append(slot)
+
+  def touch(self, slot:int, last_accessed:datetime):
+    self.__last_accessed[slot] = to_epoch_seconds(last_accessed)
+
+  def concept(self, slot:int)->Concept:
+    concept = self.__concepts[slot]
+    if concept is None:
+      raise ValueError(f"Slot {slot} does not contain a concept")
+    return concept
+
+  def identical(self, embedding:np.ndarray, slots:Union[np.ndarray,slice])->np.ndarray:
+    '''
+    Mask of the given slots that store exactly the (normalised) embedding.
+    '''
+    row = self.normalize(embedding)
+    mask = self.__digests[slots] == digest(row)
+    if mask.any():
+      # hashes can collide, so confirm the few matches.
+      candidates = np.arange(self.__used)[slots][mask]
+      mask[mask] = np.all(self.embeddings[candidates] == row, axis=1)
+    return mask
+
+  def records(self, slots:np.ndarray, embeddings:bool=True)->list[dict]:
+    '''
+    Serializes the concepts in the given slots, in the format that Memory loads.
+    Without embeddings, use snapshot_embeddings to save them in the same order.
+    '''
+    types = [self.types[code] for code in self.__type_codes[slots].tolist()]
+    impacts = self.__impact[slots].tolist()
+    numbers = self.__node_numbers[slots].tolist()
+    records = [
+        {
+          "id": f"node_{numbers[i]}",
+          "type": types[i],
+          "created": str(from_epoch_seconds(self.__created[slot])),
+          "last_accessed": str(from_epoch_seconds(self.__last_accessed[slot])),
+          "description": self.__descriptions[slot],
+          "keywords": self.__keywords[slot],
+          "impact" : impacts[i]
+        } for i, slot in enumerate(slots.tolist())
+      ]
+    if embeddings:
+      raw_embeddings = (self.embeddings[slots] * self.__norms[slots, None]).tolist()
+      for record, embedding in zip(records, raw_embeddings):
+        record["embedding"] = embedding
+    return records
+
+  def snapshot_embeddings(self, slots:np.ndarray)->tuple[np.ndarray,np.ndarray,np.ndarray]:
+    '''
+    The normalised embeddings, norms and digests of the given slots, which can be attached to a new store.
+    '''
+    return (np.ascontiguousarray(self.embeddings[slots], dtype=np.float32),
+            self.__norms[slots].copy(),
+            self.__digests[slots].copy())
+
+  # Per slot access, used by Concept
+  def node_id(self, slot:int)->str:
+    return f"node_{self.__node_numbers[slot]}"
+
+  def node_type(self, slot:int)->str:
+    return self.types[self.__type_codes[slot]]
+
+  def created_at(self, slot:int)->datetime:
+    return from_epoch_seconds(self.__created[slot])
+
+  def last_accessed_at(self, slot:int)->datetime:
+    return from_epoch_seconds(self.__last_accessed[slot])
+
+  def description(self, slot:int)->str:
+    description = self.__descriptions[slot]
+    if description is None:
+      raise ValueError(f"Slot {slot} does not contain a concept")
+    return description
+
+  def keywords(self, slot:int)->list[str]:
+    keywords = self.__keywords[slot]
+    if keywords is None:
+      raise ValueError(f"Slot {slot} does not contain a concept")
+    return keywords
+
+  def embedding(self, slot:int)->np.ndarray:
+    '''
+    The embedding as it was provided (up to float32 precision), as float64 like it was loaded.
+    '''
+    return self.embeddings[slot].astype(np.float64) * self.__norms[slot]
+
+  def impact_of(self, slot:int)->int:
+    return int(self.__impact[slot])
+
+  # Columns
+  @property
+  def embeddings(self)->np.ndarray:
+    if self.__embeddings is None:
+      return np.zeros((0, 0), dtype=np.float32)
+    return self.__embeddings[:self.__used]
+
+  @property
+  def norms(self)->np.ndarray:
+    return self.__norms[:self.__used]
+
+  @property
+  def created(self)->np.ndarray:
+    return self.__created[:self.__used]
+
+  @property
+  def last_accessed(self)->np.ndarray:
+    return self.__last_accessed[:self.__used]
+
+  @property
+  def impact(self)->np.ndarray:
+    return self.__impact[:self.__used]
+
+  @property
+  def type_codes(self)->np.ndarray:
+    return self.__type_codes[:self.__used]
+
+  @property
+  def node_numbers(self)->np.ndarray:
+    return self.__node_numbers[:self.__used]
+
+  @property
+  def live(self)->np.ndarray:
+    return self.__live[:self.__used]
+
+  @property
+  def attaching(self)->bool:
+    '''
+    True while there are attached embeddings that no concept has been added for yet.
+    '''
+    return self.__used < self.__attached
+
+  @property
+  def used(self)->int:
+    '''
+    Amount of slots that the returned arrays cover, including free slots.
+    '''
+    return self.__used
+
+  def __len__(self):
+    return self.__used - len(self.__free)
@@ -1,8 +1,10 @@
 from datetime import datetime
-from typing import Callable, Dict
+from typing import Callable, Dict, Union
 from reverie.backend_server.persona.core.Concept import Concept
 from reverie.backend_server.persona.core.Memory import Memory
+from reverie.backend_server.persona.core.VectorIndex import VectorIndex
 from reverie.backend_server.persona.core.social.EmotionRegulator import EmotionalRegulator
+from reverie.backend_server.persona.models.EmbeddingModel import EmbeddingModel
 from reverie.backend_server.persona.models.model import Model
 
 
@@ -11,10 +13,17 @@ class LongTermMemory(Memory):
                concepts:dict, 
                emotion_regulator:EmotionalRegulator,
                time_func:Callable[[],datetime],
-               long_term_memory:dict
+               long_term_memory:dict,
+               embedding_model:Union[EmbeddingModel,None]=None,
+               vector_index:Union[VectorIndex,None]=None
                ) -> None:
+    '''
+    Retrieval scores every concept unless a vector_index is provided. Long term memory
+    grows without bound, so an IVFIndex can be provided to only score a shortlist,
+    at the cost of retrieval no longer being exact.
+    '''
     try: 
-      super().__init__(concepts,emotion_regulator,time_func)
+      super().__init__(concepts,emotion_regulator,time_func,embedding_model,vector_index)
       self.__learned_traits:str = long_term_memory['learned_traits']
     except:
       raise ValueError("Dictionary does not contain expect value")
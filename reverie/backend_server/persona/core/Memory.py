@@ -3,58 +3,99 @@ After speaking with a colegue, this memory abstract class may become the single
 memory class. For now, it will remain as is till the project is working.
 '''
 from abc import ABC, abstractmethod
+import base64
 from datetime import datetime 
 from typing import Callable, Dict, Literal, Tuple, Union
 
+from reverie.backend_server import tracing
 from reverie.backend_server.persona.core.Concept import Concept
+from reverie.backend_server.persona.core.ConceptStore import ConceptStore
+from reverie.backend_server.persona.core.VectorIndex import VectorIndex
+from reverie.backend_server.persona.core.kernels import cosine_similarity
 from reverie.backend_server.persona.core.social.EmotionRegulator import EmotionalRegulator
+from reverie.backend_server.persona.models.EmbeddingModel import EmbeddingModel
 
-from numba import njit
 import numpy as np
-import requests
 
 
 class Memory(ABC):
+  # Amount of candidates taken from the vector index per query, see _candidate_slots
+  _shortlist_size = 256
+
   def __init__(self,
                concepts:dict,
                emotion_regulator:EmotionalRegulator,
-               current_time_func:Callable[[],datetime]) -> None:
+               current_time_func:Callable[[],datetime],
+               embedding_model:Union[EmbeddingModel,None]=None,
+               vector_index:Union[VectorIndex,None]=None,
+               snapshot_embeddings:Union[Tuple[np.ndarray,np.ndarray,np.ndarray],None]=None) -> None:
+    '''
+    If a vector_index is provided, retrieval only scores a relevance shortlist
+    taken from the index. Otherwise every concept is scored (exact).
+
+    snapshot_embeddings are the (embeddings, norms, digests) saved by
+    ConceptStore.snapshot_embeddings for the concepts, in which case the concepts
+    don't contain their embeddings. The embeddings may be a read only memory map.
+    '''
     super().__init__()
+    # Should be shared between agents so that the memoized embeddings are shared aswell.
+    self._embedder = embedding_model if embedding_model is not None else EmbeddingModel()
     self._id_to_node:Dict[str,Concept] = dict()
+    # All concept data lives in the store's columns, concepts are views of a row (slot).
+    self._store = ConceptStore()
+    if snapshot_embeddings is not None:
+      if len(snapshot_embeddings[0]) != len(concepts):
+        raise ValueError(f"Snapshot has {len(snapshot_embeddings[0])} embeddings for {len(concepts)} concepts")
+      self._store.attach(*snapshot_embeddings)
+    self._index = vector_index
 
-    self._seq_event:list[Concept] = []
-    self._seq_thought:list[Concept] = []
-    self._seq_chat:list[Concept] = []
+    # Node ids come from a counter so that they stay unique after a removal.
+    self._next_node_id = 1
 
-    self._kw_to_event:Dict[str,list[Concept]] = dict()
-    self._kw_to_thought:Dict[str,list[Concept]] = dict()
-    self._kw_to_chat:Dict[str,list[Concept]] = dict()
+    # These are append only (insertion ordered dicts keyed by node id), read them
+    # newest first using _sequence and _keyword_concepts.
+    # Keying by id means a node can be removed in O(1) without scanning.
+    self._seq_event:Dict[str,Concept] = dict()
+    self._seq_thought:Dict[str,Concept] = dict()
+    self._seq_chat:Dict[str,Concept] = dict()
+
+    self._kw_to_event:Dict[str,Dict[str,Concept]] = dict()
+    self._kw_to_thought:Dict[str,Dict[str,Concept]] = dict()
+    self._kw_to_chat:Dict[str,Dict[str,Concept]] = dict()
 
     self._kw_strength_event:Dict[str,int] = dict()
     self._kw_strength_thought:Dict[str,int] = dict()
     self._kw_strength_chat:Dict[str,int] = dict()
     self._emotions = emotion_regulator
+    # Change feed of added and removed concepts, only recorded once _track_changes is called.
+    self._changes:Union[list[dict],None] = None
 
     # For those unfamiliar, see https://datasciencedojo.com/blog/embeddings-and-llm/ or any
     # other resource on embeddings related to LLM's
     # Any embedding model can be used, all that is important is that the same model is used.
+    # Concepts without an embedding get theirs in one batch instead of one request each.
+    missing = [] if snapshot_embeddings is not None else [concept["description"] for concept in concepts if concept.get("embedding",None) is None]
+    generated = iter(self._generate_embeddings(missing)) if missing else iter(())
     # Makes all the event nodes
     for concept in concepts:
       node_type = concept["type"]
-      created = datetime.strptime(concept["created"], 
-                                           '%Y-%m-%d %H:%M:%S')
-      last_accessed = datetime.strptime(concept["last_accessed"], 
-                                           '%Y-%m-%d %H:%M:%S')
+      # '%Y-%m-%d %H:%M:%S', fromisoformat parses it an order of magnitude faster than strptime.
+      created = datetime.fromisoformat(concept["created"])
+      last_accessed = datetime.fromisoformat(concept["last_accessed"])
       description = concept["description"]
       impact = concept.get("impact",None)
       embedding = concept.get("embedding",None)
+      if embedding is None and not self._store.attaching:
+        embedding = next(generated)
       
+      # Saved concepts keep their id, so that ids stay stable across a save and load.
       self._add_conceptnode(node_type,
                             created,
                             last_accessed,
                             description,
                             impact=impact,
-                            embedding=embedding)
+                            embedding=embedding,
+                            node_id=concept.get("id",None))
     self.__time_func:Callable[[],datetime] = current_time_func
 
   def _add_conceptnode(self, 
@@ -63,7 +104,12 @@ class Memory(ABC):
                        last_accessed:datetime,
                        description:str, 
                        impact:Union[None,int] = None,
-                       embedding:Union[None,np.ndarray] = None)->Concept:
+                       embedding:Union[None,np.ndarray] = None,
+                       node_id:Union[None,str] = None)->Concept:
+    '''
+    node_id is given when a saved concept is loaded again. Saved concepts are not
+    necessarily in the order of their ids, so the counter only ever moves forward.
+    '''
     # For this refactor, we use getattr a lot because its convenient
     # All it does is access a attribute.
     # So: self.kw_strength_event
@@ -72,75 +118,153 @@ class Memory(ABC):
     # different keywords
 
     # Setting up the node ID and counts.
-    node_count = len(self._id_to_node.keys()) + 1
-    node_id = f"node_{str(node_count)}"
-    if embedding == None:
+    if node_id is None:
+      node_number = self._next_node_id
+    else:
+      node_number = self.__node_number(node_id)
+    self._next_node_id = max(self._next_node_id, node_number + 1)
+    # While a snapshot is being loaded, the store already has the embedding.
+    if embedding is None and not self._store.attaching:
       embedding = self._generate_embedding(description)
-    if impact == None:
+    if impact is None:
       impact = self._emotions.determine_emotional_impact(node_type,description)
 
     # Creating the <ConceptNode> object.
-    node = Concept(node_id,
-                   node_type,
-                   created, 
-                   last_accessed,
-                   description,
-                   embedding, 
-                   impact)
+    node = self._store.add(node_number,
+                           node_type,
+                           created, 
+                           last_accessed,
+                           description,
+                           embedding, 
+                           impact)
+    node_id = node.id
 
     # Creating various dictionary cache for fast access. 
     # Review Note:
-    # its an insert because the items closest to the start are assumed to be the items most recently added, but this is irrelevant because nodes are ranked on when last they were accessed, not when they were added.
-
-    getattr(self, f"_seq_{node_type}").insert(0,node)
-    keywords = [i.lower() for i in node.keywords]
-    for kw in keywords: 
-      kw_list = getattr(self, f"_kw_to_{node_type}")
-      if kw in kw_list:
-        kw_list[kw].insert(0,node)
-      else: 
-        kw_list[kw] = [node]
+    # items are appended, and read in reverse so that the most recently added come first, but this is irrelevant because nodes are ranked on when last they were accessed, not when they were added.
+
+    getattr(self, f"_seq_{node_type}")[node_id] = node
+    kw_to_nodes = getattr(self, f"_kw_to_{node_type}")
+    for kw in self.__normalized_keywords(node):
+      kw_to_nodes.setdefault(kw,dict())[node_id] = node
     self._id_to_node[node_id] = node 
+    if self._index is not None:
+      self._index.add(node.slot, self._store.embeddings[node.slot])
+    if self._changes is not None:
+      self._changes.append({'op' : 'add', 'id' : node_id})
     return node
 
   def _remove_node(self,node_id:str):
     '''
-    Removes any node via ID, this checks all availible lists.
-    Assumes ID's are unique.
-    '''
-    def try_remove_list(node:Concept,list_potentially_containing_item:list):
-      try:
-        list_potentially_containing_item.remove(node)
-      except:
-        pass
-    def try_remove_from_keywords(target_node:Concept,keywords:Dict[str,list]):
-      for _,concepts in keywords.items():
-        try:
-          concepts.remove(target_node)
-        except ValueError:
-          pass
-
+    Removes any node via ID.
+    Only the sequence of the nodes type and the nodes own keywords are touched.
+    '''
     node = self._id_to_node.pop(node_id,None)
     if node == None:
       raise ValueError(f"Node with provided ID: '{node_id}' does not exist")
+    if self._changes is not None:
+      self._changes.append({'op' : 'remove', 'id' : node_id})
+    node_type = node.node_type
+    keywords = self.__normalized_keywords(node)
+    if self._index is not None:
+      self._index.remove(node.slot)
+    # The node is only a view, so everything needed from it must be read before this.
+    self._store.remove(node.slot)
+
+    getattr(self, f"_seq_{node_type}").pop(node_id,None)
+    kw_to_nodes = getattr(self, f"_kw_to_{node_type}")
+    for kw in keywords:
+      nodes = kw_to_nodes.get(kw)
+      if nodes is None:
+        continue
+      nodes.pop(node_id,None)
+      if not nodes:
+        del kw_to_nodes[kw]
+
+  @staticmethod
+  def __node_number(node_id:str)->int:
+    return int(node_id.removeprefix("node_"))
 
-    try_remove_list(node,self._seq_event)
-    try_remove_list(node,self._seq_thought)
-    try_remove_list(node,self._seq_chat)
+  @staticmethod
+  def __normalized_keywords(node:Concept)->set[str]:
+    return {kw.lower() for kw in node.keywords}
 
-    try_remove_from_keywords(node, self._kw_to_event)
-    try_remove_from_keywords(node, self._kw_to_thought)
-    try_remove_from_keywords(node, self._kw_to_chat)
+  def _sequence(self,node_type:Literal["chat","event","thought"])->list[Concept]:
+    '''
+    All nodes of a type, most recently added first.
+    '''
+    return list(reversed(getattr(self, f"_seq_{node_type}").values()))
+
+  def _keyword_concepts(self,node_type:Literal["chat","event","thought"],keyword:str)->list[Concept]:
+    '''
+    All nodes of a type with the keyword, most recently added first.
+    '''
+    nodes = getattr(self, f"_kw_to_{node_type}").get(keyword.lower(),{})
+    return list(reversed(nodes.values()))
 
-  # Placeholder TODO
-  # Will do embedding call here for now without the model thing, bad practice might TODO and fix later but for now its good enough.
   def _generate_embedding(self, phrase:str)->np.ndarray:
-    prompt_arguments = {
-        'model' : 'nomic-embed-text',
-        'prompt' : phrase
-        }
-    response = requests.post('http://localhost:11434/api/embeddings', json=prompt_arguments).json()
-    return np.array(response['embedding'])
+    return self._embedder.embed_one(phrase)
+
+  def _generate_embeddings(self, phrases:list[str])->np.ndarray:
+    '''
+    Embeds all phrases in as few requests as possible.
+    Returns a (n, d) float32 matrix, row i belonging to phrases[i].
+    '''
+    return self._embedder.embed(phrases)
+
+  def _track_changes(self):
+    '''
+    Starts recording the change feed (see _drain_changes), used for checkpointing.
+    '''
+    self._changes = []
+
+  def _drain_changes(self)->list[dict]:
+    '''
+    Every concept added or removed since the last drain, in order.
+    Added concepts are serialized here, so concepts that were added and
+    removed before the drain are only recorded as a placeholder.
+    '''
+    if not self._changes:
+      return []
+    changes, self._changes = self._changes, []
+    drained = []
+    removed_before_drain = set()
+    for change in changes:
+      if change['op'] == 'add':
+        node = self._id_to_node.get(change['id'])
+        if node is None:
+          # removed again before the drain, a placeholder keeps the id counter in sync.
+          removed_before_drain.add(change['id'])
+          drained.append({'op' : 'add', 'id' : change['id'], 'concept' : None})
+          continue
+        record = self._store.records(np.array([node.slot],dtype=np.int64),embeddings=False)[0]
+        # base64 float32 is far more compact than a list of floats
+        record['embedding_b64'] = base64.b64encode(node.embedding.astype(np.float32).tobytes()).decode('ascii')
+        drained.append({'op' : 'add', 'id' : change['id'], 'concept' : record})
+      elif change['id'] not in removed_before_drain:
+        drained.append(change)
+    return drained
+
+  def _apply_changes(self,changes:list[dict]):
+    '''
+    Replays a drained change feed, on a memory that is in the state it was in
+    when the feed started. Added concepts get the same ids they had.
+    '''
+    for change in changes:
+      if change['op'] == 'add':
+        record = change['concept']
+        if record is None:
+          self._next_node_id = max(self._next_node_id, self.__node_number(change['id']) + 1)
+          continue
+        self._add_conceptnode(record['type'],
+                              datetime.fromisoformat(record['created']),
+                              datetime.fromisoformat(record['last_accessed']),
+                              record['description'],
+                              impact=record['impact'],
+                              embedding=np.frombuffer(base64.b64decode(record['embedding_b64']),dtype=np.float32),
+                              node_id=change['id'])
+      else:
+        self._remove_node(change['id'])
 
   def get_current_time(self)->datetime:
     return self.__time_func()
@@ -159,54 +283,85 @@ class Memory(ABC):
     '''
     raise NotImplementedError(f"concrete class: {type(self)} must impliment abstract method: _retrieval_score. See core/Memory.py:_retrieval_score")
 
-  def _retrieve_relevant_concept_scores(self,concept:np.ndarray,relevance_weights:tuple)->list[Tuple[float,Concept]]:
+  def _retrieval_scores(self,concept:np.ndarray,slots:Union[np.ndarray,slice])->Tuple[np.ndarray,...]:
     '''
-    Takes in a list of concepts and looks in memory for relevant concepts.
-    Concepts are ranked by the _retrieval_score method which determines the likely hood
-    of a concept being remembered
-    _retrieval_score is a abstract method that must be implimented by the concrete class.
+    Vectorized counterpart of _retrieval_score.
+    Scores every concept stored in the given slots of self._store at once, returning
+    one array per factor, in the same order as _retrieval_score.
+
+    By default this falls back to calling _retrieval_score once per candidate.
+    Concrete classes should override this using the columns of self._store.
     '''
-    # could be a list but better safe than sorry
-    relevance_scores:list[Tuple[float,Concept]] = []
-    for _, concept_candidate in self._id_to_node.items():
-      if np.array_equal(concept,concept_candidate.embedding):
-        continue
-      raw_score = self._retrieval_score(concept,concept_candidate)
+    candidates = np.arange(self._store.used)[slots]
+    scores = [self._retrieval_score(concept,self._store.concept(slot)) for slot in candidates]
+    return tuple(np.array(factor,dtype=np.float64) for factor in zip(*scores))
 
-      if len(raw_score) != len(relevance_weights):
-        raise RuntimeError("Tuple returned by _retrieval_score, does not match the length of the weights used in calculating final score")
+  def _candidate_slots(self,concept:np.ndarray,top_k:Union[int,None]=None)->Union[np.ndarray,slice]:
+    '''
+    The slots that should be scored for a query.
+    Without a vector index this is every slot, otherwise it is the
+    relevance shortlist from the index.
+    '''
+    if self._index is None:
+      return slice(0,self._store.used)
+    shortlist_size = max(self._shortlist_size, top_k or 0)
+    slots,_ = self._index.search(ConceptStore.normalize(concept),shortlist_size)
+    return slots
 
-      # dot product of the tuples appended to the index corresponding with the node were
-      # evaluating
-      relevance_scores.append(
-          (sum(x*y for x,y in zip(raw_score,relevance_weights)), 
-           concept_candidate))
-    return relevance_scores
+  def _retrieve_relevant_concept_scores(self,
+                                        concept:np.ndarray,
+                                        relevance_weights:tuple,
+                                        top_k:Union[int,None]=None)->Tuple[np.ndarray,np.ndarray]:
+    '''
+    Scores the concepts in memory against the concept being evaluated.
+    Concepts are ranked by the _retrieval_scores method which determines the likely hood
+    of a concept being remembered.
+    Returns the slots of the candidates and their scores.
+    '''
+    if len(self._store) == 0:
+      return np.empty(0,dtype=np.int64),np.empty(0,dtype=np.float64)
+    slots = self._candidate_slots(concept,top_k)
+    candidate_slots = np.arange(self._store.used)[slots]
+    # A concept is not relevant to itself
+    candidates = self._store.live[slots] & ~self._store.identical(concept,slots)
+
+    raw_score = self._retrieval_scores(concept,slots)
+    if len(raw_score) != len(relevance_weights):
+      raise RuntimeError("Tuple returned by _retrieval_scores, does not match the length of the weights used in calculating final score")
 
-  def _retrieve_relevant_concepts(self,concepts:list[np.ndarray],relevance_weights:tuple)->list[Concept]:
+    # dot product of the factors with the weights, for every candidate
+    scores = np.zeros(len(candidate_slots),dtype=np.float64)
+    for factor,weight in zip(raw_score,relevance_weights):
+      scores += weight*np.asarray(factor,dtype=np.float64)
+    return candidate_slots[candidates],scores[candidates]
+
+  @tracing.traced()
+  def _retrieve_relevant_concepts(self,
+                                  concepts:list[np.ndarray],
+                                  relevance_weights:tuple,
+                                  top_k:Union[int,None]=None)->list[Concept]:
     '''
     Takes in a list of concepts and looks in memory for relevant concepts.
-    Concepts are ranked by the _retrieval_score method which determines the likely hood
-    of a concept being remembered
-    _retrieval_fitler is a abstract method that must be implimented by the concrete class.
+    Concepts are ranked by the _retrieval_scores method which determines the likely hood
+    of a concept being remembered.
+    A candidate that is relevant to multiple concepts keeps its highest score.
+    If top_k is provided, only the top_k most relevant concepts are returned.
     '''
-    relevance_scores:dict[str,Tuple[float,Concept]] = {}
+    best_scores = np.full(self._store.used,-np.inf)
     for concept in concepts:
-      candidate_scores = self._retrieve_relevant_concept_scores(concept,relevance_weights)
-      for candidate in candidate_scores:
-        # Check if candidate has already been seen
-        candidate_id = candidate[1].id
-        if candidate_id in relevance_scores:
-          #  update if the relevance score is greater than what was previously assigned to it.
-          old_score = relevance_scores[candidate_id][0]
-          if old_score < candidate[0]:
-            # TODO, maybe scale because it came up a second time?
-            relevance_scores[candidate_id] = candidate
-        else:
-          relevance_scores[candidate_id] = candidate
-
-    to_return = sorted(relevance_scores.values(),key=lambda x:x[0],reverse=True)
-    return [concept for _, concept in to_return]
+      slots,scores = self._retrieve_relevant_concept_scores(concept,relevance_weights,top_k)
+      # TODO, maybe scale because it came up a second time?
+      best_scores[slots] = np.maximum(best_scores[slots],scores)
+
+    slots = np.flatnonzero(best_scores > -np.inf)
+    scores = best_scores[slots]
+    if top_k is not None and top_k < len(slots):
+      if top_k <= 0:
+        return []
+      top = np.argpartition(-scores,top_k - 1)[:top_k]
+      slots,scores = slots[top],scores[top]
+    order = np.argsort(-scores,kind='stable')
+    return [self._store.concept(slot) for slot in slots[order]]
   
   @abstractmethod
   def retrieve_relevant_concepts(self,concepts:list[np.ndarray])->list[Concept]:
@@ -222,13 +377,5 @@ class Memory(ABC):
     raise NotImplementedError(f"concrete class: {type(self)} must impliment abstract method: retrieve_relevant_concepts. See core/Memory.py:retrieve_relevant_concepts")
 
 
-  @staticmethod
-  @njit
-  def _similarity_score_function(a, b):
-    '''
-    This function can return a negative value, but the likely hood is
-    very low after testing, and if a negative value does occur, then it means
-    the embeddings must be so distant from each other that it is a good thing.
-    '''
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
+  # Kept as an attribute so that concrete classes can keep using self._similarity_score_function
+  _similarity_score_function = staticmethod(cosine_similarity)
@@ -10,7 +10,8 @@ class Personality:
       self.__learned_traits:str = personality['learned_traits']
     except TypeError:
       raise ValueError("Recieved dict is malformed")
-    pass
+    # changes whenever get_summarized_identity would return something else
+    self.__identity_version = 0
 
   def get_summarized_identity(self):
     """
@@ -41,8 +42,11 @@ class Personality:
     LongTermMemory.
     '''
     self.__learned_traits = new_traits
+    self.__identity_version += 1
+
   def increment_age(self):
     self.__age += 1
+    self.__identity_version += 1
 
   # Getters
   @property
@@ -65,6 +69,10 @@ class Personality:
   def lifestyle(self):
     return self.__lifestyle
 
+  @property
+  def identity_version(self)->int:
+    return self.__identity_version
+
   def state(self):
     return {
         'first_name' : self.__first_name,
@@ -1,11 +1,15 @@
 from datetime import datetime
-from typing import Callable, Dict, Tuple
+from typing import Callable, Dict, Tuple, Union
+from reverie.backend_server import tracing
 from reverie.backend_server.persona.core.Concept import Concept
+from reverie.backend_server.persona.core.ConceptStore import ConceptStore, to_epoch_seconds
 from reverie.backend_server.persona.core.Memory import Memory
 from reverie.backend_server.persona.core.Personality import Personality
+from reverie.backend_server.persona.core.VectorIndex import VectorIndex
+from reverie.backend_server.persona.core.kernels import importance_gradient, last_accessed_decay, score_candidates
 from reverie.backend_server.persona.core.social.EmotionRegulator import EmotionalRegulator
+from reverie.backend_server.persona.models.EmbeddingModel import EmbeddingModel
 
-from numba import njit
 import numpy as np
 
 
@@ -14,11 +18,16 @@ class ShortTermMemory(Memory):
                short_term:dict,
                time_func:Callable[[],datetime],
                emotion_regulator:EmotionalRegulator,
-               personality:Personality
+               personality:Personality,
+               embedding_model:Union[EmbeddingModel,None]=None,
+               vector_index:Union[VectorIndex,None]=None,
+               snapshot_embeddings:Union[Tuple[np.ndarray,np.ndarray,np.ndarray],None]=None
                ) -> None:
     try:
       concepts = short_term['concepts']
-      super().__init__(concepts,emotion_regulator,time_func)
+      super().__init__(concepts,emotion_regulator,time_func,embedding_model,vector_index,snapshot_embeddings)
+      # The counter can be ahead of the highest id if the newest concepts were removed.
+      self._next_node_id = max(self._next_node_id, int(short_term.get('next_node_id', 1)))
       self.__currently = short_term['currently']
       self.__attention_span = int(short_term['attention_span'])
       # used in reactions and for filtering
@@ -31,9 +40,10 @@ class ShortTermMemory(Memory):
     except TypeError as e:
       raise ValueError(f"Dictionary does not contain correct type:\n {e}")
 
+  @tracing.traced()
   def process_events(self,new_events:list[str]):
     to_return:list[Concept] = []
-    recent_events = [event.description for event in self._seq_event]
+    recent_events = {event.description for event in self._seq_event.values()}
     for desc in new_events:
       # If the event is related to ourselves, it is assumed to already be registered
       #   In the event that hypothetically you would want to play out a scenario where
@@ -67,26 +77,30 @@ class ShortTermMemory(Memory):
     
 
   def _retrieval_score(self, concept: np.ndarray, potential_candidate: Concept) -> Tuple[float,...]:
-    @njit(cache=True)
-    def last_accessed_decay_function(x)->float:
-        return 1.1 ** (-4 * x ** 2)
-
-    @njit(cache=True)
-    def importance_gradient_function(x)->float:
-        return 0.5 * (np.exp(0.85 * (x - 1)) - np.exp(0.4 * (x - 1))) / (np.exp(0.8 * (x - 1)) + np.exp(-0.2 * (x - 1))) + 0.2
-
     last_accessed = potential_candidate.last_accessed
     current_time = self.get_current_time()
     # conversion to days
     time_delta = (current_time - last_accessed).total_seconds()/86400
-    return (last_accessed_decay_function(time_delta),
-            importance_gradient_function(potential_candidate.impact),
-            self._similarity_score_function(concept,potential_candidate.embedding))
+    return (last_accessed_decay(time_delta),
+            importance_gradient(potential_candidate.impact),
+            self._similarity_score_function(np.asarray(concept,dtype=np.float64),potential_candidate.embedding))
   
+  def _retrieval_scores(self, concept: np.ndarray, slots: Union[np.ndarray,slice]) -> Tuple[np.ndarray,...]:
+    # Same functions as _retrieval_score, fused into a single compiled pass over the candidates.
+    if isinstance(slots, slice):
+      slots = np.arange(self._store.used, dtype=np.int64)[slots]
+    scores = score_candidates(self._store.embeddings,
+                              self._store.last_accessed,
+                              self._store.impact,
+                              np.asarray(slots, dtype=np.int64),
+                              ConceptStore.normalize(concept),
+                              to_epoch_seconds(self.get_current_time()))
+    return tuple(scores)
+
   def retrieve_relevant_concepts(self, concepts: list[np.ndarray]) -> list[Concept]:
     # Factors: 
     # Weight 1, Last accessed: this is short term memory so we forget quicker
-    return self._retrieve_relevant_concepts(concepts,(1,2,2))[:self.__attention_span]
+    return self._retrieve_relevant_concepts(concepts,(1,2,2),self.__attention_span)
   
   def cleanup(self):
     raise NotImplemented()
@@ -96,7 +110,9 @@ class ShortTermMemory(Memory):
     '''
     Returns all events that have happened right now
     '''
-    return [concept for _, concept in self._id_to_node.items() if concept.created == self.get_current_time()]
+    store = self._store
+    slots = np.flatnonzero(store.live & (store.created == to_epoch_seconds(self.get_current_time())))
+    return [store.concept(slot) for slot in slots]
 
   @property
   def attention_span(self):
@@ -108,17 +124,24 @@ class ShortTermMemory(Memory):
 
   def state(self):
     return {
-        'concepts' : [
-          {
-            "type": concept._type_of_concept,
-            "created": str(concept._created),
-            "last_accessed": str(concept._last_accessed),
-            "description": concept._description,
-            "keywords": concept._keywords,
-            "embedding" : concept._embedding.tolist(),
-            "impact" : concept._impact
-          } for concept in self._id_to_node.values()
-        ], 
+        'concepts' : self._store.records(self.__stored_slots()), 
+        'next_node_id' : self._next_node_id,
         'currently' : self.__currently,
         'attention_span' : self.__attention_span
       }
+
+  def snapshot(self)->Tuple[dict,Tuple[np.ndarray,np.ndarray,np.ndarray]]:
+    '''
+    Same as state, but the embeddings are returned separately as the
+    (embeddings, norms, digests) that can be passed back in as snapshot_embeddings.
+    '''
+    slots = self.__stored_slots()
+    return {
+        'concepts' : self._store.records(slots,embeddings=False), 
+        'next_node_id' : self._next_node_id,
+        'currently' : self.__currently,
+        'attention_span' : self.__attention_span
+      }, self._store.snapshot_embeddings(slots)
+
+  def __stored_slots(self)->np.ndarray:
+    return np.array([concept.slot for concept in self._id_to_node.values()],dtype=np.int64)
@@ -12,10 +12,6 @@ from numpy.lib import math
 from reverie.backend_server.world.World import Tile, World
 from reverie.backend_server.world.world_objects.WorldObject import WorldObject
 
-from pathfinding.core.diagonal_movement import DiagonalMovement
-from pathfinding.core.grid import Grid
-from pathfinding.finder.a_star import AStarFinder
-
 class SpatialMemory:
   def __init__(self, spatial_memory:dict, environment:World) -> None:
     self.__current_location:Tile = spatial_memory['current_location']
@@ -51,21 +47,12 @@ class SpatialMemory:
 
 
   def _path_finding(self,target:Tile):
-    collision_maze = Grid(matrix=self.__environment.collision_map.tolist())
-    current_position = collision_maze.node(
-        self.__current_location.x, 
-        self.__current_location.y)
-    target_position = collision_maze.node(target.x, target.y)
     # optimal movement, we should probably make it more 
     # inefficient some how to make the movements more human, 
     # or just design the map in a way that its more human
-    a_star = AStarFinder(diagonal_movement=DiagonalMovement.always)
-    path,_ = a_star.find_path(current_position,target_position,collision_maze)
-    path_co_ordinates:list[tuple[int,int]] = [(node.x,node.y) for node in path]
-    path_co_ordinates.reverse()
-    self.__current_path = []
-    for tile in path_co_ordinates:
-      self.__current_path.append(self.__environment.get_tile(tile))
+    path = self.__environment.find_path(self.__current_location.x_y_pair, target.x_y_pair)
+    # get_next_step pops from the end, the current location first
+    self.__current_path = path[::-1]
 
   def get_next_step(self)->Tile|None:
     if self.__current_path == []:
@@ -0,0 +1,61 @@
+'''
+Every prompt template under persona/core/**/templates, loaded once.
+
+Templates used to be read from disk and re-parsed on every model call. The
+registry reads and compiles all of them the first time it is used, so a
+broken template fails at startup, and components look their templates up
+(with the amount of parameters they pass) when they are constructed, so an
+arity mismatch fails there instead of in the middle of a simulation.
+'''
+import os
+from typing import Union
+
+from reverie.backend_server.persona.models.PromptTemplate import PromptTemplate
+
+
+class TemplateRegistry:
+  _default:Union['TemplateRegistry',None] = None
+
+  def __init__(self, root:str=os.path.dirname(__file__)) -> None:
+    '''
+    Templates are named by the folder above their templates folder and their file name,
+    e.g. planning/wake_up_hour for core/planning/templates/wake_up_hour.txt
+    '''
+    self.__templates:dict[str,PromptTemplate] = {}
+    for folder, _, files in os.walk(root):
+      if os.path.basename(folder) != 'templates':
+        continue
+      prefix = os.path.relpath(os.path.dirname(folder), root).replace(os.sep, '/')
+      for file_name in sorted(files):
+        if not file_name.endswith('.txt'):
+          continue
+        name = f"{prefix}/{file_name[:-len('.txt')]}" if prefix != '.' else file_name[:-len('.txt')]
+        with open(os.path.join(folder, file_name), 'r') as file:
+          self.__templates[name] = PromptTemplate(file.read(), name)
+
+  @classmethod
+  def default(cls)->'TemplateRegistry':
+    '''
+    The registry of persona/core, shared by every component.
+    '''
+    if cls._default is None:
+      cls._default = cls()
+    return cls._default
+
+  def get(self, name:str, arity:Union[int,None]=None)->PromptTemplate:
+    '''
+    Throws KeyError if there is no such template, and ValueError if arity is provided and does not match.
+    '''
+    try:
+      template = self.__templates[name]
+    except KeyError:
+      raise KeyError(f"No template named '{name}', known templates: {sorted(self.__templates)}")
+    if arity is not None:
+      template.check_arity(arity)
+    return template
+
+  def __contains__(self, name:str)->bool:
+    return name in self.__templates
+
+  def __len__(self)->int:
+    return len(self.__templates)
@@ -0,0 +1,277 @@
+'''
+Vector indexes that memory uses to shortlist relevant concepts.
+
+Without an index, retrieval scores every stored concept, which is O(N) per
+query and grows without bound over long simulations. With an index, only a
+relevance shortlist is taken from the index, and recency and impact scoring is
+applied to that shortlist.
+
+All vectors and queries must be unit length (see ConceptStore.normalize),
+so the dot product is the cosine similarity. Keys are the slots of the
+concepts in the ConceptStore.
+'''
+from abc import ABC, abstractmethod
+import threading
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+
+class VectorIndex(ABC):
+  @abstractmethod
+  def add(self, key:int, vector:np.ndarray):
+    raise NotImplementedError()
+
+  @abstractmethod
+  def remove(self, key:int):
+    '''
+    Raises KeyError if the key is not in the index.
+    '''
+    raise NotImplementedError()
+
+  @abstractmethod
+  def search(self, query:np.ndarray, k:int)->Tuple[np.ndarray,np.ndarray]:
+    '''
+    Returns the keys of (up to) the k most similar vectors and their similarities,
+    ordered from most to least similar.
+    '''
+    raise NotImplementedError()
+
+  @abstractmethod
+  def __len__(self)->int:
+    raise NotImplementedError()
+
+
+class FlatIndex(VectorIndex):
+  '''
+  Exact search, compares the query with every vector.
+  Used to validate approximate indexes, and as the lists of IVFIndex.
+  '''
+  def __init__(self, capacity:int=64) -> None:
+    self.__capacity = capacity
+    self.__size = 0
+    self.__vectors:Union[np.ndarray,None] = None
+    self.__keys = np.zeros(capacity, dtype=np.int64)
+    self.__positions:Dict[int,int] = {}
+
+  def add(self, key:int, vector:np.ndarray):
+    if key in self.__positions:
+      raise ValueError(f"Key {key} is already in the index")
+    vector = np.asarray(vector, dtype=np.float32)
+    if self.__vectors is None:
+      self.__vectors = np.zeros((self.__capacity, vector.shape[0]), dtype=np.float32)
+    if self.__size == self.__capacity:
+      self.__capacity *= 2
+      vectors = np.zeros((self.__capacity, self.__vectors.shape[1]), dtype=np.float32)
+      vectors[:self.__size] = self.__vectors[:self.__size]
+      keys = np.zeros(self.__capacity, dtype=np.int64)
+      keys[:self.__size] = self.__keys[:self.__size]
+      self.__vectors, self.__keys = vectors, keys
+    self.__vectors[self.__size] = vector
+    self.__keys[self.__size] = key
+    self.__positions[key] = self.__size
+    self.__size += 1
+
+  def remove(self, key:int):
+    position = self.__positions.pop(key)
+    last = self.__size - 1
+    # move the last vector into the hole so that storage stays contiguous
+    if position != last and self.__vectors is not None:
+      self.__vectors[position] = self.__vectors[last]
+      self.__keys[position] = self.__keys[last]
+      self.__positions[int(self.__keys[position])] = position
+    self.__size = last
+
+  def search(self, query:np.ndarray, k:int)->Tuple[np.ndarray,np.ndarray]:
+    if self.__size == 0 or self.__vectors is None or k <= 0:
+      return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    similarities = self.__vectors[:self.__size] @ np.asarray(query, dtype=np.float32)
+    if k < self.__size:
+      top = np.argpartition(-similarities, k - 1)[:k]
+    else:
+      top = np.arange(self.__size)
+    top = top[np.argsort(-similarities[top], kind='stable')]
+    return self.__keys[top], similarities[top]
+
+  @property
+  def vectors(self)->np.ndarray:
+    if self.__vectors is None:
+      return np.zeros((0, 0), dtype=np.float32)
+    return self.__vectors[:self.__size]
+
+  @property
+  def keys(self)->np.ndarray:
+    return self.__keys[:self.__size]
+
+  def __len__(self)->int:
+    return self.__size
+
+
+class IVFIndex(VectorIndex):
+  '''
+  Approximate inverted file index in pure numpy.
+
+  Vectors are clustered with spherical k-means into n_lists lists, a query
+  only searches the n_probe lists whose centroids are closest to it, which
+  makes a search roughly O(n_probe * N / n_lists) instead of O(N).
+
+  Until train_threshold vectors have been added, it behaves exactly like a
+  FlatIndex. The centroids are retrained whenever the index has grown by
+  retrain_factor since the last training, so that the lists stay balanced
+  as memory grows.
+
+  Training is O(N), so add does not wait for it: it runs on a background
+  thread while the current lists keep serving adds, removes and searches,
+  and the changes made in the meantime are replayed onto the new lists when
+  they are swapped in. Pass background=False to train inside add instead,
+  and use wait_for_training to get a deterministic index.
+  '''
+  _replay_under_lock = 64
+
+  def __init__(self,
+               n_probe:int=16,
+               train_threshold:int=2048,
+               retrain_factor:float=4.0,
+               kmeans_iterations:int=10,
+               seed:int=0,
+               background:bool=True) -> None:
+    self.__n_probe = n_probe
+    self.__train_threshold = train_threshold
+    self.__retrain_factor = retrain_factor
+    self.__iterations = kmeans_iterations
+    self.__rng = np.random.default_rng(seed)
+    self.__background = background
+    self.__centroids:Union[np.ndarray,None] = None
+    self.__trained_size = 0
+    self.__lists:list[FlatIndex] = [FlatIndex()]
+    self.__key_to_list:Dict[int,int] = {}
+    self.__lock = threading.RLock()
+    self.__training:Union[threading.Thread,None] = None
+    # (key, vector) for adds and (key, None) for removes made while training
+    self.__journal:list[Tuple[int,Union[np.ndarray,None]]] = []
+
+  def add(self, key:int, vector:np.ndarray):
+    vector = np.asarray(vector, dtype=np.float32)
+    with self.__lock:
+      if self.__centroids is None:
+        list_id = 0
+      else:
+        list_id = int(np.argmax(self.__centroids @ vector))
+      self.__lists[list_id].add(key, vector)
+      self.__key_to_list[key] = list_id
+      if self.__training is not None:
+        self.__journal.append((key, vector))
+      elif len(self) >= self.__train_threshold and len(self) >= self.__trained_size * self.__retrain_factor:
+        if self.__background:
+          self.__training = threading.Thread(target=self._train, daemon=True)
+          self.__training.start()
+        else:
+          self._train()
+
+  def remove(self, key:int):
+    with self.__lock:
+      list_id = self.__key_to_list.pop(key)
+      self.__lists[list_id].remove(key)
+      if self.__training is not None:
+        self.__journal.append((key, None))
+
+  def wait_for_training(self):
+    '''
+    Blocks until a training that is running in the background has been swapped in.
+    '''
+    training = self.__training
+    if training is not None:
+      training.join()
+
+  def search(self, query:np.ndarray, k:int)->Tuple[np.ndarray,np.ndarray]:
+    query = np.asarray(query, dtype=np.float32)
+    with self.__lock:
+      return self.__search(query, k)
+
+  def __search(self, query:np.ndarray, k:int)->Tuple[np.ndarray,np.ndarray]:
+    if self.__centroids is None:
+      return self.__lists[0].search(query, k)
+    n_probe = min(self.__n_probe, len(self.__lists))
+    centroid_similarity = self.__centroids @ query
+    probe = np.argpartition(-centroid_similarity, n_probe - 1)[:n_probe]
+    keys = []
+    similarities = []
+    for list_id in probe:
+      list_keys, list_similarities = self.__lists[list_id].search(query, k)
+      keys.append(list_keys)
+      similarities.append(list_similarities)
+    all_keys = np.concatenate(keys)
+    all_similarities = np.concatenate(similarities)
+    if k < len(all_keys):
+      top = np.argpartition(-all_similarities, k - 1)[:k]
+    else:
+      top = np.arange(len(all_keys))
+    top = top[np.argsort(-all_similarities[top], kind='stable')]
+    return all_keys[top], all_similarities[top]
+
+  def _train(self):
+    '''
+    Spherical k-means over (a sample of) all vectors, then rebuilds the lists.
+    Only taking the snapshot and swapping in the new lists hold the lock.
+    '''
+    with self.__lock:
+      keys = np.concatenate([index.keys for index in self.__lists])
+      vectors = np.concatenate([index.vectors for index in self.__lists if len(index)])
+      self.__journal = []
+    n_lists = max(1, int(np.sqrt(len(keys))))
+    sample_size = min(len(keys), n_lists * 64)
+    sample = vectors[self.__rng.choice(len(keys), size=sample_size, replace=False)]
+    centroids = sample[self.__rng.choice(sample_size, size=n_lists, replace=False)].copy()
+    for _ in range(self.__iterations):
+      assignment = np.argmax(sample @ centroids.T, axis=1)
+      for centroid in range(n_lists):
+        members = sample[assignment == centroid]
+        if len(members) == 0:
+          # re-seed empty clusters
+          centroids[centroid] = sample[self.__rng.integers(sample_size)]
+          continue
+        mean = members.sum(axis=0)
+        norm = np.linalg.norm(mean)
+        if norm > 0:
+          centroids[centroid] = mean / norm
+
+    lists = [FlatIndex() for _ in range(n_lists)]
+    key_to_list:Dict[int,int] = {}
+    assignment = np.argmax(vectors @ centroids.T, axis=1)
+    for key, vector, list_id in zip(keys, vectors, assignment):
+      lists[list_id].add(int(key), vector)
+      key_to_list[int(key)] = int(list_id)
+
+    # replay what changed since the snapshot, outside of the lock until little is left
+    while True:
+      with self.__lock:
+        journal, self.__journal = self.__journal, []
+        if len(journal) <= self._replay_under_lock:
+          self.__replay(journal, centroids, lists, key_to_list)
+          self.__centroids = centroids
+          self.__lists = lists
+          self.__key_to_list = key_to_list
+          self.__trained_size = len(keys)
+          self.__training = None
+          return
+      self.__replay(journal, centroids, lists, key_to_list)
+
+  @staticmethod
+  def __replay(journal:list[Tuple[int,Union[np.ndarray,None]]],
+               centroids:np.ndarray,
+               lists:list[FlatIndex],
+               key_to_list:Dict[int,int]):
+    for key, vector in journal:
+      if vector is None:
+        lists[key_to_list.pop(key)].remove(key)
+      else:
+        list_id = int(np.argmax(centroids @ vector))
+        lists[list_id].add(key, vector)
+        key_to_list[key] = list_id
+
+  @property
+  def n_lists(self)->int:
+    return len(self.__lists)
+
+  def __len__(self)->int:
+    return len(self.__key_to_list)
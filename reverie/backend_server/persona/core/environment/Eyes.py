@@ -1,3 +1,5 @@
+from reverie.backend_server import tracing
+from reverie.backend_server.world.SpatialIndex import SpatialIndex
 from reverie.backend_server.world.World import World
 from reverie.backend_server.persona.core.SpatialMemory import SpatialMemory
 from reverie.backend_server.persona.core.ShortTermMemory import ShortTermMemory
@@ -17,9 +19,11 @@ class Eyes:
     except:
       raise ValueError("Dictionary does not contain expected value")
 
+  @tracing.traced()
   def observe_environment(self):
-    surrounding_environment = self.__environment.get_surrounding_environment(
-        (self.__spatial_memory.current_location.x, self.__spatial_memory.current_location.y),
+    # only tiles with objects or agents on them have events
+    surrounding_environment = self.__environment.spatial_index.tiles_within(
+        self.__spatial_memory.current_location.x_y_pair,
         self.__vision_radius)
 
     observed_events = self.__spatial_memory.process_visual_input(surrounding_environment)
@@ -40,6 +44,19 @@ class Eyes:
       # Surely the same event cannot occur in two places, if this is the case, then why call this every time?
     return self.__short_term_memory.process_events(list(observed_event_set))
 
+  def minutes_until_sighting(self, body, horizon:int)->int:
+    '''
+    The least amount of minutes before another agent than body can come into view, agents
+    take one step per tick (see Legs.move). 0 if one is in view already, horizon if none
+    is close enough to come into view within horizon minutes.
+    '''
+    center = self.__spatial_memory.current_location.x_y_pair
+    # closest first
+    for agent, tile in self.__environment.spatial_index.agents_within(center, self.__vision_radius + horizon):
+      if agent is not body:
+        return max(0, SpatialIndex.distance(center, tile.x_y_pair) - self.__vision_radius)
+    return horizon
+
   @property
   def vision_radius(self):
     return self.__vision_radius
@@ -21,6 +21,8 @@ class Legs:
     Returns the amount of ticks a movement takes place over.
     '''
     current_tile = self.__spatial_memory.current_location
-    current_tile._remove_agent(self.__agent)
-    tile._add_agent(self.__agent)
+    def step():
+      current_tile._remove_agent(self.__agent)
+      tile._add_agent(self.__agent)
+    self.__world._defer(step)
     return 1
@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import Callable, Union
 from collections import deque
+from reverie.backend_server import tracing
 from reverie.backend_server.persona.core.Personality import Personality
 from reverie.backend_server.persona.core.environment.interactors.Interactor import Interactor
 from reverie.backend_server.persona.core.planning.DailyPlanning import DailyPlanning
@@ -14,6 +15,7 @@ class ComputerInteractor(Interactor):
     self.current_progress = "just started"
     self.last_command = None 
 
+  @tracing.traced()
   def interact_with(self, target: WorldObject):
     '''
     Construct a prompt to perform an action
@@ -57,6 +59,7 @@ class ComputerInteractor(Interactor):
       self.last_command = response
     return self.current_progress
 
+  @tracing.traced()
   def form_context(self,
                    previous_context:str,
                    current_task:str,
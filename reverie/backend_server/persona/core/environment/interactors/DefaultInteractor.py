@@ -1,5 +1,6 @@
 from datetime import datetime
 from typing import Callable
+from reverie.backend_server import tracing
 from reverie.backend_server.persona.core.Personality import Personality
 from reverie.backend_server.persona.core.environment.interactors.Interactor import Interactor
 from reverie.backend_server.persona.core.planning.DailyPlanning import DailyPlanning
@@ -11,6 +12,7 @@ class DefaultInteractor(Interactor):
   def __init__(self, daily_planner: DailyPlanning,personality:Personality,model:Model,time_func:Callable[[],datetime]) -> None:
     super().__init__([], daily_planner,personality,model,time_func)
 
+  @tracing.traced()
   def interact_with(self, target: WorldObject):
     '''
     Construct a prompt to perform an action
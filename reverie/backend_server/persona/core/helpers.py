@@ -1,3 +1,5 @@
+import re
+
 def validate_number(response:str, _="")->str:
   '''
   Used a lot in core/social/EmotionRegulator.py as the validate function 
@@ -32,3 +34,33 @@ def validate_hour_minute_time(response:str, _="")->str:
 
 def no_validate(response:str,_="")->str:
   return response
+
+# Regex of a valid HH:MM time, for StructuredOutput constraints
+hour_minute_time_pattern = r'([01][0-9]|2[0-3]):[0-5][0-9]'
+
+# Prefix validators are used with Model.run_inference(prefix_validate=...) on a
+# partial response. They return False once no continuation of the response can
+# pass the matching validate function, so that generation can be aborted early.
+
+_number_prefix = re.compile(r'\s*[+-]?\d*\s*')
+_time_prefix = re.compile(r'\s*(\d*)\s*(:\s*(\d*)\s*)?')
+
+def number_prefix(partial:str)->bool:
+  '''
+  Prefix validator for validate_number
+  '''
+  return _number_prefix.fullmatch(partial) is not None
+
+def hour_minute_time_prefix(partial:str)->bool:
+  '''
+  Prefix validator for validate_hour_minute_time, appending digits never makes a value smaller.
+  '''
+  match = _time_prefix.fullmatch(partial)
+  if match is None:
+    return False
+  hours, _, minutes = match.groups()
+  if hours and int(hours) > 23:
+    return False
+  if minutes and int(minutes) > 59:
+    return False
+  return True
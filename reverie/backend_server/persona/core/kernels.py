@@ -0,0 +1,80 @@
+'''
+Compiled kernels used when scoring concepts during memory retrieval.
+
+These used to be defined inside ShortTermMemory._retrieval_score, which created
+a new dispatcher (and potentially a new compilation) for every candidate that
+was scored. They are defined once here instead, compiled with an on disk
+cache, and warm_up() should be called once at start up so that the compilation
+(or cache load) is not paid for in the middle of a simulation.
+'''
+from numba import njit, prange
+import numpy as np
+
+
+@njit(cache=True)
+def last_accessed_decay(x):
+  return 1.1 ** (-4 * x ** 2)
+
+
+@njit(cache=True)
+def importance_gradient(x):
+  return 0.5 * (np.exp(0.85 * (x - 1)) - np.exp(0.4 * (x - 1))) / (np.exp(0.8 * (x - 1)) + np.exp(-0.2 * (x - 1))) + 0.2
+
+
+@njit(cache=True)
+def cosine_similarity(a, b):
+  '''
+  This function can return a negative value, but the likely hood is
+  very low after testing, and if a negative value does occur, then it means
+  the embeddings must be so distant from each other that it is a good thing.
+  '''
+  return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+@njit(cache=True, parallel=True, fastmath=True)
+def score_candidates(embeddings, last_accessed, impact, slots, query, current_time):
+  '''
+  Fused kernel that scores a whole batch of candidates in one pass.
+
+  embeddings must contain unit length rows, and query must be unit length,
+  so that the dot product is the cosine similarity.
+  last_accessed and current_time are in seconds, slots are the rows to score.
+
+  Returns a (3, len(slots)) array: last accessed decay, importance gradient
+  and similarity, in the same order as ShortTermMemory._retrieval_score.
+  '''
+  scores = np.empty((3, slots.shape[0]), dtype=np.float64)
+  dimensions = query.shape[0]
+  for i in prange(slots.shape[0]):
+    slot = slots[i]
+    # conversion to days
+    time_delta = (current_time - last_accessed[slot]) / 86400.0
+    scores[0, i] = last_accessed_decay(time_delta)
+    scores[1, i] = importance_gradient(np.float64(impact[slot]))
+    similarity = 0.0
+    for j in range(dimensions):
+      similarity += embeddings[slot, j] * query[j]
+    scores[2, i] = similarity
+  return scores
+
+
+def warm_up():
+  '''
+  Compiles (or loads from the cache) every kernel for the types that memory uses.
+  '''
+  embeddings = np.ones((2, 4), dtype=np.float32) / 2
+  query = np.ones(4, dtype=np.float32) / 2
+  last_accessed_decay(0.5)
+  importance_gradient(5.0)
+  cosine_similarity(embeddings[0], query)
+  cosine_similarity(embeddings[0].astype(np.float64), query.astype(np.float64))
+  # Memory loaded from a snapshot starts with read only (memory mapped) embeddings, which is a different type.
+  read_only = embeddings.copy()
+  read_only.setflags(write=False)
+  for matrix in (embeddings, read_only):
+    score_candidates(matrix,
+                     np.zeros(2, dtype=np.int64),
+                     np.ones(2, dtype=np.int8),
+                     np.arange(2, dtype=np.int64),
+                     query,
+                     0)
@@ -6,19 +6,22 @@ Be copied over and used for determining incomplete tasks, etc.
 Tasks are Immutable except for setting the target, so it is safe to move them around
 the system to be used as data for other methods in different objects.
 '''
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass, field
 from itertools import chain
 from datetime import datetime
 from typing import Tuple, Union
 from collections import deque
-import os
 
+from reverie.backend_server import tracing
 from reverie.backend_server.persona.core.Concept import Concept
 from reverie.backend_server.persona.core.LongTermMemory import LongTermMemory
 from reverie.backend_server.persona.core.Personality import Personality
 from reverie.backend_server.persona.core.ShortTermMemory import ShortTermMemory
 from reverie.backend_server.persona.core.SpatialMemory import SpatialMemory
-from reverie.backend_server.persona.core.helpers import no_validate, validate_hour_minute_time
+from reverie.backend_server.persona.core.TemplateRegistry import TemplateRegistry
+from reverie.backend_server.persona.core.helpers import hour_minute_time_pattern, hour_minute_time_prefix, no_validate, validate_hour_minute_time
+from reverie.backend_server.persona.models.StructuredOutput import StructuredOutput
 from reverie.backend_server.persona.models.model import Model
 from reverie.backend_server.world.world_objects.WorldObject import WorldObject
 
@@ -49,7 +52,7 @@ class Task:
 class DailyPlanningData:
   wake_up_time:datetime
   # This includes variance, but is still subject to change.
-  # This must be sorted
+  # This must be sorted, and is replaced instead of modified in place (see ScheduleIndex)
   schedule:list[Tuple[TimePeriod,Task]]
   incompleted_tasks:list[Task]
 
@@ -61,6 +64,69 @@ class DailyPlanningData:
   def schedule_prompt_format(self):
     return '\n'.join([f"{time.start} <-> {time.end} <-> {task.description}" for (time,task) in self.schedule])
 
+class ScheduleIndex:
+  '''
+  Finds the current task of a schedule: the first entry whose TimePeriod contains the time.
+  The start and end of every TimePeriod split the day into segments in which the current
+  task does not change, so the answer is precomputed per segment. A cursor follows the
+  time as it moves forward, which makes lookups O(1) amortized, going back in time
+  (or restoring a checkpoint) falls back to a bisect.
+  Entries with an empty TimePeriod are never current.
+  '''
+  def __init__(self,schedule:list[Tuple[TimePeriod,Task]]) -> None:
+    self.schedule = schedule
+    self.__boundaries = sorted({boundary for time_period,_ in schedule for boundary in (time_period.start,time_period.end)})
+    # __current[i] is the current entry for __boundaries[i] <= time < __boundaries[i + 1]
+    self.__current:list[Union[Tuple[Task,TimePeriod],None]] = [None] * len(self.__boundaries)
+    # later entries first, so that earlier entries overwrite them where they overlap
+    for time_period,task in reversed(schedule):
+      entry = (task,time_period)
+      for segment in range(bisect_left(self.__boundaries,time_period.start),bisect_left(self.__boundaries,time_period.end)):
+        self.__current[segment] = entry
+    # __next[i] is the first entry other than __current[i] that is current in a later segment
+    self.__next:list[Union[Tuple[Task,TimePeriod],None]] = [None] * len(self.__boundaries)
+    # the first entry of the later segments, and the first one after that which is another entry
+    first,other = None,None
+    for segment in range(len(self.__boundaries) - 1, -1, -1):
+      self.__next[segment] = first if first is not self.__current[segment] else other
+      entry = self.__current[segment]
+      if entry is not None and entry is not first:
+        first,other = entry,first
+    # segment of the last lookup, -1 is before the first boundary
+    self.__cursor = -1
+
+  def __seek(self,time:datetime)->int:
+    boundaries = self.__boundaries
+    cursor = self.__cursor
+    if cursor >= 0 and time < boundaries[cursor]:
+      cursor = bisect_right(boundaries,time) - 1
+    else:
+      while cursor + 1 < len(boundaries) and boundaries[cursor + 1] <= time:
+        cursor += 1
+    self.__cursor = cursor
+    return cursor
+
+  def current(self,time:datetime)->Union[Tuple[Task,TimePeriod],None]:
+    segment = self.__seek(time)
+    return self.__current[segment] if segment >= 0 else None
+
+  def next(self,time:datetime)->Union[Tuple[Task,TimePeriod],None]:
+    '''
+    The entry that becomes current after the current one, or the first one if time is before the schedule.
+    '''
+    segment = self.__seek(time)
+    if segment < 0:
+      return next((entry for entry in self.__current if entry is not None),None)
+    return self.__next[segment]
+
+  def next_boundary(self,time:datetime)->Union[datetime,None]:
+    '''
+    The first start or end of a TimePeriod after time, None if there is none.
+    '''
+    segment = self.__seek(time)
+    return self.__boundaries[segment + 1] if segment + 1 < len(self.__boundaries) else None
+
+
 class DailyPlanning:
   '''
   Is responsible for all planning on a daily basis.
@@ -70,6 +136,9 @@ class DailyPlanning:
   This uses logic originally from cognitive_modules/plan.py:_long_term_planning()
   However it contains some extensions to that logic.
   '''
+  # The lines that _validate_plan_format accepts
+  _plan_format = StructuredOutput.lines(f'{hour_minute_time_pattern} <-> {hour_minute_time_pattern} <-> [^\n<>]+')
+
   # Should we do short and long term memory or just one?
   def __init__(self, 
                llm:Model,
@@ -88,12 +157,24 @@ class DailyPlanning:
     self.__data = data
     self.__previous_day = previous_days_data
     self.__steps = deque(current_steps,maxlen=15)
-    self._template_dir = os.path.join(os.path.dirname(__file__), 'templates')
-    pass
+    self.__schedule_index = ScheduleIndex(data.schedule)
+    # name : amount of parameters, checked here so that a mismatch fails before the simulation starts
+    templates = TemplateRegistry.default()
+    self._templates = {name : templates.get(f"planning/{name}", arity) for name,arity in [
+      ("detect_computer_interaction", 1),
+      ("deconstruct_high_level_action", 1),
+      ("wake_up_hour", 2),
+      ("daily_plan_outline", 4),
+      ("detailed_plan", 3),
+      ("introduce_variance", 1),
+      ("introduce_variance_strict", 2),
+      ("associate_object_with_task", 2),
+    ]}
 
 
   # TODO what if something bad happens, maybe we should be 
   #   able to rethink how we are gonna approach the day
+  @tracing.traced()
   def plan_for_today(self):
     '''
     Must be called at the very begining of a new day
@@ -148,6 +229,7 @@ class DailyPlanning:
       new_schedule.append((new_time,task))
     self.__data.schedule = new_schedule
 
+  @tracing.traced()
   def _extrapulate_computer_interactions(self):
     '''
     This looks at the schedule for today and extrapulates all tasks that require
@@ -168,8 +250,7 @@ class DailyPlanning:
           flattened.append(item)
       return flattened
 
-    with open(os.path.join(self._template_dir, "detect_computer_interaction.txt"),"r") as file:
-        prompt = file.read()
+    prompt = self._templates["detect_computer_interaction"]
     system_input = [self.__personality.get_summarized_identity()]
     example_output = "yes"
     fail_safe = "no"
@@ -183,7 +264,8 @@ class DailyPlanning:
                                           example_output,
                                           validate,
                                           fail_safe,
-                                          special_instruction=special_instruction)
+                                          special_instruction=special_instruction,
+                                          structured_output=StructuredOutput.enum(['yes','no']))
       if output == 'yes':
         # create mini actions
         # take this task, and break it down into smaller components of how the task is going to be performed.
@@ -198,10 +280,10 @@ class DailyPlanning:
         new_schedule.append((time,action))
     self.__data.schedule = flatten_schedule(new_schedule)
 
+  @tracing.traced()
   def _break_up_actions(self,action:str)->str:
     print(action)
-    with open(os.path.join(self._template_dir, "deconstruct_high_level_action.txt"),"r") as file:
-      prompt = file.read()
+    prompt = self._templates["deconstruct_high_level_action"]
     prompt_input = [action]
     system_input = [self.__personality.get_summarized_identity()]
     example = f'''
@@ -226,16 +308,18 @@ class DailyPlanning:
                                       self._validate_plan_format,
                                       failsafe,
                                       special_instruction=special_instruction,
+                                      prefix_validate=self._plan_format_prefix,
+                                      structured_output=self._plan_format,
                                       )
 
+  @tracing.traced()
   def _wake_up_time(self)->datetime:
     date = self.__short_term_memory.get_current_time()
     if date.hour != 0 or date.minute != 0:
       raise RuntimeError(f"DailyPlanning.wake_up_time called when time is not 00:00 (start of a new day). Current time is: {date}")
       
     # TODO check project board
-    with open(os.path.join(self._template_dir, "wake_up_hour.txt"),"r") as file:
-        prompt = file.read()
+    prompt = self._templates["wake_up_hour"]
     prompt_input = [self.__personality.lifestyle,
                     self.__personality.full_name]
     system_input = [self.__personality.get_summarized_identity()]
@@ -248,15 +332,18 @@ class DailyPlanning:
                                         example_output,
                                         validate_hour_minute_time,
                                         fail_safe,
-                                        special_instruction=special_instruction)
+                                        special_instruction=special_instruction,
+                                        prefix_validate=hour_minute_time_prefix,
+                                        structured_output=StructuredOutput.pattern(hour_minute_time_pattern))
     hour,minute = map(int,output.split(":"))
     return date.replace(hour=hour,minute=minute)
 
 
+  @tracing.traced()
   def _get_important_points(self):
-    important_events = self.__short_term_memory._generate_embedding(
-        f"{self.__personality.full_name}'s plan for today")
-    plan_for_today = self.__short_term_memory._generate_embedding(f"{self.__personality.full_name}'s plan for today.")
+    important_events, plan_for_today = self.__short_term_memory._generate_embeddings([
+        f"{self.__personality.full_name}'s plan for today",
+        f"{self.__personality.full_name}'s plan for today."])
     retrieved_memories = self.__short_term_memory.retrieve_relevant_concepts([important_events,plan_for_today])
     event_descriptions = "\n".join([concept.description for concept in retrieved_memories])
 
@@ -274,6 +361,7 @@ class DailyPlanning:
                                       fail_safe,
                                       special_instruction=special_instruction)
   
+  @tracing.traced()
   def _get_broad_overview(self,recent_knowledge:str,overwrite=False):
     '''
     we plan out our day according to:
@@ -288,8 +376,7 @@ class DailyPlanning:
       return ",".join(actions)
 
     date =  self.__short_term_memory.get_current_time()
-    with open(os.path.join(self._template_dir, "daily_plan_outline.txt"),"r") as file:
-      prompt = file.read()
+    prompt = self._templates["daily_plan_outline"]
     prompt_input = ["\n".join(self.__standard_tasks),
                     f"{date.year} {date.strftime("%B")} {date.day}",
                     f"{self.__data.wake_up_time.hour}:{self.__data.wake_up_time.minute}",
@@ -317,7 +404,8 @@ class DailyPlanning:
                                         example,
                                         validate,
                                         failsafe,
-                                        special_instruction if overwrite else  "Do NOT prefix your response with any comments."
+                                        special_instruction if overwrite else  "Do NOT prefix your response with any comments.",
+                                        structured_output=StructuredOutput.lines(r'[0-9]+\) [^\n)]+')
                                         ).split(",")
     if overwrite:
       self.__standard_tasks = output
@@ -338,18 +426,43 @@ class DailyPlanning:
         raise ValueError(f"Response has malformed task: {task}")
     return response
 
-
+  def _plan_format_prefix(self,partial:str)->bool:
+    '''
+    Prefix validator for _validate_plan_format, every finished line must be a valid task,
+    and the line being generated must still be able to become one.
+    '''
+    *lines, current = partial.split("\n")
+    for line in lines:
+      try:
+        self._validate_plan_format(line)
+      except ValueError:
+        return False
+    parts = current.split("<->")
+    if len(parts) > 3:
+      return False
+    for index, part in enumerate(parts[:2]):
+      if index == len(parts)-1:
+        # the separator may be half generated
+        part = part.rstrip("<-")
+        return hour_minute_time_prefix(part)
+      try:
+        validate_hour_minute_time(part.strip())
+      except ValueError:
+        return False
+    return True
+
+
+  @tracing.traced()
   def _detailed_plan(self,plan_outline:str):
     '''
     Formulates a detailed plan for the agent to follow that guides their
     behavior. This plan is more a prediction, as it includes time
     variances that aim to simulate human behavior.
     '''
-    embeddings = [self.__short_term_memory._generate_embedding(item) for item in plan_outline.split('\n')]
+    embeddings = list(self.__short_term_memory._generate_embeddings(plan_outline.split('\n')))
     most_important_concepts = self.__short_term_memory.retrieve_relevant_concepts(embeddings)
     most_important_points = [concept.description for concept in most_important_concepts]
-    with open(os.path.join(self._template_dir, "detailed_plan.txt"),"r") as file:
-      prompt = file.read()
+    prompt = self._templates["detailed_plan"]
     prompt_input = [self.__personality.full_name, plan_outline,'\n'.join(most_important_points)]
     example = '''
 07:00 <-> 07:15 <-> Wake up and get out of bed
@@ -382,9 +495,12 @@ class DailyPlanning:
                                       example,
                                       self._validate_plan_format,
                                       failsafe,
-                                      special_instruction=special_instruction
+                                      special_instruction=special_instruction,
+                                      prefix_validate=self._plan_format_prefix,
+                                      structured_output=self._plan_format
                                       )
 
+  @tracing.traced()
   def _induce_variance(self,plan:str,time_bound:Union[TimePeriod,None]=None):
     '''
     Introduce variance into the response, through testing, it has been
@@ -392,8 +508,7 @@ class DailyPlanning:
     more consistent and superiour results
     '''
     to_return:list[Tuple[TimePeriod,Task]] = []
-    with open(os.path.join(self._template_dir, f"introduce_variance{"_strict" if time_bound is not None else ""}.txt"),"r") as file:
-      prompt = file.read()
+    prompt = self._templates[f"introduce_variance{"_strict" if time_bound is not None else ""}"]
     prompt_input = [plan,time_bound.hour_min_str()] if time_bound is not None else [plan]
     example = '''
 06:25 <-> 07:00 <-> Wake up and complete morning routine
@@ -422,7 +537,9 @@ class DailyPlanning:
                                           example,
                                           self._validate_plan_format,
                                           failsafe,
-                                          special_instruction=special_instruction
+                                          special_instruction=special_instruction,
+                                          prefix_validate=self._plan_format_prefix,
+                                          structured_output=self._plan_format
                                           )
 
     tasks = [line.strip() for line in response.split('\n')]
@@ -449,6 +566,7 @@ class DailyPlanning:
   # based on the object distance etc.
   # TODO, this should maybe be used later down the line instead of when the
   # tasks are initialized.
+  @tracing.traced()
   def _associate_object_with_task(self,
                                   allocated_time_period:TimePeriod,
                                   task:Task,
@@ -479,9 +597,8 @@ class DailyPlanning:
       else:
         raise ValueError("Response does not correspond with one of the availible objects")
 
-    with open(os.path.join(self._template_dir, "associate_object_with_task.txt"),"r") as file:
-      prompt = file.read()
-      prompt_input = [task.description,"\n".join(object_names)]
+    prompt = self._templates["associate_object_with_task"]
+    prompt_input = [task.description,"\n".join(object_names)]
     example_response = object_names[0]
     special_instruction = "Write the name of the object exactly as it appears in the list. Do not add aditional information to your answer. If there is no object availible that you think would best fit the task, respond with the word: None"
     failsafe = "None"
@@ -492,7 +609,8 @@ class DailyPlanning:
                                           example_response,
                                           validate,
                                           failsafe,
-                                          special_instruction=special_instruction)
+                                          special_instruction=special_instruction,
+                                          structured_output=StructuredOutput.enum(object_names + ["None"]))
     
     # TODO: Impliment some kind of movement constant to calculate travel distances.
     if response == "None":
@@ -517,26 +635,32 @@ class DailyPlanning:
         'standard' : self.__standard_tasks
         }
 
+  def __indexed_schedule(self)->ScheduleIndex:
+    # every change of the schedule replaces the list
+    if self.__schedule_index.schedule is not self.__data.schedule:
+      self.__schedule_index = ScheduleIndex(self.__data.schedule)
+    return self.__schedule_index
+
   @property
-  def current_task(self):
+  def current_task(self)->Union[Tuple[Task,TimePeriod],None]:
     '''
     Returns the first task for which the current_time is
     with in the bounds of the tasks TimePeriod.
     '''
-    for time,task in self.__data.schedule:
-      if self. __short_term_memory.get_current_time() in time:
-        return task,time
-    return None
+    return self.__indexed_schedule().current(self.__short_term_memory.get_current_time())
+
+  def next_boundary(self,time:datetime)->Union[datetime,None]:
+    '''
+    The first start or end of a TimePeriod in the schedule after time, None if there is none.
+    '''
+    return self.__indexed_schedule().next_boundary(time)
 
   @property
-  def next_task(self):
+  def next_task(self)->Union[Tuple[Task,TimePeriod],None]:
     '''
-    Returns the first task for which the current_time is
-    with in the bounds of the tasks TimePeriod.
+    Returns the task that follows the current task, None if it is the last one.
     '''
-    for (time,task) in self.__data.schedule:
-      if self. __short_term_memory.get_current_time() in time:
-        return task,time
+    return self.__indexed_schedule().next(self.__short_term_memory.get_current_time())
   
   def state(self):
     def return_schedule(x:list):
@@ -1,20 +1,23 @@
+from reverie.backend_server import tracing
 from reverie.backend_server.persona.core.Personality import Personality
-from reverie.backend_server.persona.core.helpers import validate_number
+from reverie.backend_server.persona.core.TemplateRegistry import TemplateRegistry
+from reverie.backend_server.persona.core.helpers import number_prefix, validate_number
+from reverie.backend_server.persona.models.StructuredOutput import StructuredOutput
 from reverie.backend_server.persona.models.model import Model
-import os
 
 
 class EmotionalRegulator:
   def __init__(self,personality:Personality,llm:Model) -> None:
     self.__personality = personality
     self.__model = llm
-    self._template_dir = os.path.join(os.path.dirname(__file__), 'templates')
+    templates = TemplateRegistry.default()
+    self._templates = {event_type : templates.get(f"social/impact_{event_type}", 2) for event_type in ["event","chat","thought"]}
 
+  @tracing.traced()
   def determine_emotional_impact(self, event_type:str, description:str)->int:
     if event_type not in ["event","chat","thought"]:
       raise ValueError("event type must be an event,chat,or thought")
-    with open(os.path.join(self._template_dir, f"impact_{event_type}.txt"),"r") as file:
-      prompt = file.read()
+    prompt = self._templates[event_type]
     prompt_input = [self.__personality.full_name,
                     description]
     system_input = [self.__personality.get_summarized_identity()]
@@ -29,5 +32,7 @@ class EmotionalRegulator:
                                          example_output,
                                          validate_number,
                                          fail_safe,
-                                         special_instruction=special_instruction)
+                                         special_instruction=special_instruction,
+                                         prefix_validate=number_prefix,
+                                         structured_output=StructuredOutput.integer(1,10))
     return int(output)
@@ -0,0 +1,97 @@
+from abc import abstractmethod
+from typing import Awaitable, Callable, Generator, List, Tuple, Union
+
+from reverie.backend_server.persona.models.PromptTemplate import PromptTemplate
+from reverie.backend_server.persona.models.StructuredOutput import StructuredOutput
+from reverie.backend_server.persona.models.model import Model
+
+
+class AsyncModel(Model):
+  '''
+  A Model that can also be awaited.
+
+  run_inference_async and run_inference_with_context_async behave exactly like
+  run_inference and run_inference_with_context (same prompts, validation,
+  retries and cache), but are coroutines, so many requests can be in flight
+  on one event loop. Both share Model._inference, only the model is awaited here.
+  The synchronous methods keep working for the existing synchronous callers,
+  nothing in the simulation awaits these yet (agents are ticked on threads,
+  see SimulationRunner), they are there for callers that run on an event loop.
+  '''
+  @abstractmethod
+  async def _call_model_async(self,prompt_arguments:dict)->str:
+    pass
+
+  @abstractmethod
+  async def _call_model_with_context_async(self,prompt_arguments:dict)->dict:
+    pass
+
+  async def _stream_model_async(self,prompt_arguments:dict,prefix_validate:Callable[[str],bool])->str:
+    '''
+    See Model._stream_model
+    '''
+    response = await self._call_model_async(prompt_arguments)
+    if not prefix_validate(response):
+      raise ValueError(f'Response can not be valid:"{response}"')
+    return response
+
+  async def run_inference_async(self,
+                                user_prompt:Union[str,PromptTemplate],
+                                user_prompt_parameters:list[str],
+                                system_prompt_parameters:list[str],
+                                example_output:str,
+                                validate:Callable[[str,str],str],
+                                fail_safe_response:str,
+                                special_instruction:Union[str,None]=None,
+                                repeat=3,
+                                system_prompt:Union[str,None]=None,
+                                prefix_validate:Union[Callable[[str],bool],None]=None,
+                                structured_output:Union[StructuredOutput,None]=None)->str:
+    '''
+    See Model.run_inference
+    '''
+    inference = self._inference(user_prompt,user_prompt_parameters,system_prompt_parameters,example_output,validate,
+                                fail_safe_response,special_instruction,repeat,system_prompt,prefix_validate,structured_output)
+    return await self._complete_async(inference,self.__call_model_async)
+
+  async def run_inference_with_context_async(self,
+                                             user_prompt:Union[str,PromptTemplate],
+                                             user_prompt_parameters:list[str],
+                                             system_prompt_parameters:list[str],
+                                             example_output:str,
+                                             validate:Callable[[str,str],str],
+                                             fail_safe_response:str,
+                                             special_instruction:Union[str,None]=None,
+                                             repeat=3,
+                                             system_prompt:Union[str,None]=None,
+                                             context:Union[None,List[int]]=None)->Tuple[str,List[int]]:
+    '''
+    See Model.run_inference_with_context
+    '''
+    inference = self._inference_with_context(user_prompt,user_prompt_parameters,system_prompt_parameters,example_output,
+                                             validate,fail_safe_response,special_instruction,repeat,system_prompt,context)
+    return await self._complete_async(inference,self._call_model_with_context_async)
+
+  async def __call_model_async(self,final_prompt:dict,prefix_validate:Union[Callable[[str],bool],None])->str:
+    if prefix_validate is None:
+      return await self._call_model_async(final_prompt)
+    return await self._stream_model_async(final_prompt,prefix_validate)
+
+  @staticmethod
+  async def _complete_async(inference:Generator[tuple,object,object],call_model:Callable[...,Awaitable]):
+    '''
+    See Model._complete, the model is awaited instead.
+    '''
+    try:
+      request = next(inference)
+      while True:
+        try:
+          response = await call_model(*request)
+        except Exception as e:
+          request = inference.throw(e)
+        else:
+          request = inference.send(response)
+    except StopIteration as stop:
+      return stop.value
+    finally:
+      inference.close()
@@ -0,0 +1,147 @@
+'''
+HTTP connections shared by every model client.
+
+Without this, every inference and embedding request opened (and tore down)
+its own TCP connection. A ConnectionPool keeps connections alive and reuses
+them, for synchronous callers through a pooled requests.Session, and for
+coroutines through an aiohttp.ClientSession. AgentBuilder shares one pool
+between every agent it builds.
+'''
+import asyncio
+import json
+import threading
+from typing import AsyncIterator, Iterator
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class ConnectionPool:
+  def __init__(self,
+               timeout:float=600.0,
+               connect_timeout:float=5.0,
+               limit:int=64,
+               limit_per_host:int=8) -> None:
+    '''
+    timeout is the total time a request may take (generation on a CPU can be slow),
+    connect_timeout is the time allowed to establish a connection.
+    limit is the maximum amount of open connections, limit_per_host the maximum
+    to a single server, there is no point in making it larger than the amount of
+    requests the server handles in parallel.
+    '''
+    if limit < 1 or limit_per_host < 1:
+      raise ValueError("Connection limits must be at least 1")
+    self.__timeout = timeout
+    self.__connect_timeout = connect_timeout
+    self.__limit = limit
+    self.__limit_per_host = limit_per_host
+
+    self.__session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=limit, pool_maxsize=limit_per_host)
+    self.__session.mount('http://', adapter)
+    self.__session.mount('https://', adapter)
+
+    # aiohttp sessions belong to the event loop they are created on, so one is made per loop.
+    self.__clients:dict[asyncio.AbstractEventLoop,aiohttp.ClientSession] = {}
+    self.__lock = threading.Lock()
+
+  def post(self, url:str, body:dict)->dict:
+    '''
+    Posts json and returns the json response, raises requests.HTTPError on an error status.
+    '''
+    response = self.__session.post(url, json=body, timeout=self.timeout)
+    response.raise_for_status()
+    return response.json()
+
+  async def post_async(self, url:str, body:dict)->dict:
+    '''
+    Posts json and returns the json response, raises aiohttp.ClientResponseError on an error status.
+    '''
+    client = self.client()
+    async with client.post(url, json=body) as response:
+      response.raise_for_status()
+      return await response.json(content_type=None)
+
+  def stream(self, url:str, body:dict)->Iterator[dict]:
+    '''
+    Posts json and yields every line of a newline delimited json response as it arrives.
+    Closing the generator early drops the connection, which makes the server stop generating.
+    '''
+    response = self.__session.post(url, json=body, timeout=self.timeout, stream=True)
+    finished = False
+    try:
+      response.raise_for_status()
+      for line in response.iter_lines():
+        if line:
+          yield json.loads(line)
+      finished = True
+    finally:
+      # a fully read response goes back to the pool by itself
+      if not finished:
+        response.close()
+
+  async def stream_async(self, url:str, body:dict)->AsyncIterator[dict]:
+    '''
+    See stream, the generator must be closed with aclose when it is left early.
+    '''
+    client = self.client()
+    async with client.post(url, json=body) as response:
+      response.raise_for_status()
+      finished = False
+      try:
+        async for line in response.content:
+          if line.strip():
+            yield json.loads(line)
+        finished = True
+      finally:
+        # release would wait for the rest of the body, close drops the connection
+        if not finished:
+          response.close()
+
+  def client(self)->aiohttp.ClientSession:
+    '''
+    The aiohttp session for the running event loop.
+    '''
+    loop = asyncio.get_running_loop()
+    with self.__lock:
+      client = self.__clients.get(loop)
+      if client is None or client.closed:
+        connector = aiohttp.TCPConnector(limit=self.__limit, limit_per_host=self.__limit_per_host)
+        client = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.__timeout, connect=self.__connect_timeout))
+        self.__clients[loop] = client
+      return client
+
+  async def close_async(self):
+    '''
+    Closes the aiohttp session of the running loop, and the synchronous session.
+    '''
+    loop = asyncio.get_running_loop()
+    with self.__lock:
+      client = self.__clients.pop(loop, None)
+    if client is not None:
+      await client.close()
+    self.__session.close()
+
+  def close(self):
+    '''
+    Closes the synchronous session, aiohttp sessions must be closed with close_async on their loop.
+    '''
+    self.__session.close()
+
+  @property
+  def session(self)->requests.Session:
+    return self.__session
+
+  @property
+  def timeout(self)->tuple[float,float]:
+    '''
+    In the (connect, read) form that requests expects.
+    '''
+    return (self.__connect_timeout, self.__timeout)
+
+  @property
+  def limit_per_host(self)->int:
+    return self.__limit_per_host
@@ -0,0 +1,96 @@
+'''
+Client for the embedding model.
+
+Phrases are embedded in batches instead of one request per phrase, and
+every embedding is memoized by its exact text so that the same phrase is
+never paid for twice (plan lines and memory descriptions repeat a lot).
+'''
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Union
+
+import numpy as np
+
+from reverie.backend_server.persona.models.ConnectionPool import ConnectionPool
+
+
+class EmbeddingModel:
+  '''
+  Batched embedding client for an Ollama compatible server.
+
+  Batches are sent to /api/embed in a single request. Older servers that do not
+  support it fall back to a pooled set of concurrent /api/embeddings requests.
+  Note that /api/embed returns normalised vectors, this does not matter for
+  the cosine similarity that memory retrieval uses.
+  '''
+  def __init__(self,
+               model:str='nomic-embed-text',
+               host:str='http://localhost:11434',
+               max_batch_size:int=64,
+               max_workers:int=8,
+               max_cached:int=100000,
+               pool:Union[ConnectionPool,None]=None) -> None:
+    '''
+    Requests go through the pool, which should be shared with every other client of the same server.
+    '''
+    self._model_name = model
+    self._batch_address = f'{host}/api/embed'
+    self._single_address = f'{host}/api/embeddings'
+    self.__max_batch_size = max_batch_size
+    self.__max_workers = max_workers
+    self.__max_cached = max_cached
+    self.__batch_supported = True
+    self.__pool = pool if pool is not None else ConnectionPool()
+    self.__memo:OrderedDict[str,np.ndarray] = OrderedDict()
+    self.__lock = threading.Lock()
+
+  def embed(self, phrases:list[str])->np.ndarray:
+    '''
+    Returns a (n, d) float32 matrix where row i is the embedding of phrases[i].
+    '''
+    # Rows are taken from this local copy, the memo can be evicted by other threads in between.
+    with self.__lock:
+      found = {phrase : self.__memo[phrase] for phrase in phrases if phrase in self.__memo}
+    missing = list(dict.fromkeys(phrase for phrase in phrases if phrase not in found))
+    for start in range(0, len(missing), self.__max_batch_size):
+      batch = missing[start:start + self.__max_batch_size]
+      embeddings = self._request_batch(batch)
+      for phrase, embedding in zip(batch, embeddings):
+        found[phrase] = np.asarray(embedding, dtype=np.float32)
+    rows = [found[phrase] for phrase in phrases]
+    with self.__lock:
+      # most recently used last, evicted phrases that were used again are put back
+      for phrase in dict.fromkeys(phrases):
+        self.__memo[phrase] = found[phrase]
+        self.__memo.move_to_end(phrase)
+      while len(self.__memo) > self.__max_cached:
+        self.__memo.popitem(last=False)
+    if not rows:
+      return np.empty((0, 0), dtype=np.float32)
+    return np.stack(rows)
+
+  def embed_one(self, phrase:str)->np.ndarray:
+    return self.embed([phrase])[0]
+
+  def _request_batch(self, phrases:list[str])->list[list[float]]:
+    if self.__batch_supported:
+      response = self.__pool.session.post(self._batch_address,
+                                          json={'model' : self._model_name, 'input' : phrases},
+                                          timeout=self.__pool.timeout)
+      if response.status_code != 404:
+        response.raise_for_status()
+        return response.json()['embeddings']
+      # Server predates the batch endpoint, don't try again.
+      self.__batch_supported = False
+    if len(phrases) == 1:
+      return [self._request_single(phrases[0])]
+    with ThreadPoolExecutor(max_workers=min(self.__max_workers, len(phrases))) as pool:
+      return list(pool.map(self._request_single, phrases))
+
+  def _request_single(self, phrase:str)->list[float]:
+    return self.__pool.post(self._single_address, {'model' : self._model_name, 'prompt' : phrase})['embedding']
+
+  @property
+  def cached(self)->int:
+    return len(self.__memo)
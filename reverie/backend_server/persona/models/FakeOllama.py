@@ -0,0 +1,302 @@
+'''
+A stand in for an Ollama server, for tests and benchmarks that must not depend on a real model.
+
+It serves the endpoints the model clients use:
+  /api/generate     answers with the example response of the prompt (every prompt
+                    of the simulation ends with "An example response is:"), or
+                    with the first matching rule. Streaming, format (json schema,
+                    see StructuredOutput.py) and context are supported.
+  /api/embed        batched embeddings
+  /api/embeddings   single embeddings
+
+Everything is deterministic: embeddings are pseudo random vectors seeded by
+the text, and choices (an enum without a usable example, for instance) are
+seeded by the prompt. Latency is artificial and configurable, so the cost of
+the simulation engine itself can be measured, or a slow model imitated.
+
+Usage:
+  python -m reverie.backend_server.persona.models.FakeOllama --port 11434 --latency 0.5
+or in process:
+  with FakeOllama(latency=0.01) as server:
+    LLama3Instruct(host=server.host)
+'''
+import argparse
+from collections import Counter
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+from typing import Union
+
+import numpy as np
+
+
+class FakeOllama:
+  _example_marker = "An example response is:\n"
+
+  def __init__(self,
+               host:str='127.0.0.1',
+               port:int=0,
+               latency:float=0.0,
+               token_latency:float=0.0,
+               embedding_latency:float=0.0,
+               dimensions:int=768,
+               rules:Union[list[tuple[str,str]],None]=None) -> None:
+    '''
+    port 0 picks a free port, see the host property for the address.
+    latency is added to every generate request, token_latency to every generated token
+    (roughly one per 4 characters), embedding_latency to every embedding request.
+    rules are (regex, response) pairs, the response of the first regex that is found
+    in the prompt is used instead of the example response.
+    '''
+    self.__latency = latency
+    self.__token_latency = token_latency
+    self.__embedding_latency = embedding_latency
+    self.__dimensions = dimensions
+    self.__rules = [(re.compile(pattern), response) for pattern, response in (rules or [])]
+    self.__counts:Counter[str] = Counter()
+    self.__lock = threading.Lock()
+    self.__server = ThreadingHTTPServer((host, port), self.__handler())
+    self.__server.daemon_threads = True
+    self.__thread:Union[threading.Thread,None] = None
+
+  def __handler(self):
+    fake = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+      # headers and body are separate writes, with Nagle every response waits for a delayed ACK
+      disable_nagle_algorithm = True
+
+      def log_message(self, format, *args):
+        pass
+
+      def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        fake._count(self.path)
+        match self.path:
+          case '/api/generate':
+            if body.get('stream', True) and body.get('prompt'):
+              self.__stream(fake._generate_tokens(body), body)
+            else:
+              self.__json(fake._generate(body))
+          case '/api/embed':
+            self.__json(fake._embed(body))
+          case '/api/embeddings':
+            self.__json(fake._embeddings(body))
+          case _:
+            self.__json({'error' : f'unknown endpoint {self.path}'}, 404)
+
+      def __json(self, data:dict, status:int=200):
+        encoded = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+      def __stream(self, tokens:list[str], body:dict):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+          time.sleep(fake._latency)
+          for token in tokens:
+            time.sleep(fake._token_latency)
+            self.__chunk({'model' : body.get('model'), 'response' : token, 'done' : False})
+          self.__chunk({'model' : body.get('model'), 'response' : '', 'done' : True,
+                        'context' : fake._context(body, ''.join(tokens)), **fake._token_counts(body, tokens)})
+          self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+          # the client aborted the generation
+          fake._count('aborted')
+
+      def __chunk(self, data:dict):
+        line = json.dumps(data).encode('utf-8') + b'\n'
+        self.wfile.write(f'{len(line):x}\r\n'.encode('ascii') + line + b'\r\n')
+        self.wfile.flush()
+
+    return Handler
+
+  def _count(self, key:str):
+    with self.__lock:
+      self.__counts[key] += 1
+
+  @property
+  def _latency(self)->float:
+    return self.__latency
+
+  @property
+  def _token_latency(self)->float:
+    return self.__token_latency
+
+  # Generation
+
+  @staticmethod
+  def _seed(text:str)->int:
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+
+  def _response(self, body:dict)->str:
+    prompt = body.get('prompt', '')
+    for pattern, response in self.__rules:
+      if pattern.search(prompt):
+        return response
+    example = prompt.split(self._example_marker)[-1].strip() if self._example_marker in prompt else ''
+    schema = body.get('format')
+    if isinstance(schema, dict):
+      return json.dumps(self._value(schema, example, np.random.default_rng(self._seed(prompt))))
+    if schema == 'json':
+      return example if self._is_json(example) else '{}'
+    return example
+
+  @staticmethod
+  def _is_json(text:str)->bool:
+    try:
+      json.loads(text)
+      return True
+    except json.JSONDecodeError:
+      return False
+
+  def _value(self, schema:dict, example:str, rng:np.random.Generator):
+    '''
+    A value that satisfies schema, taken from the example where it fits.
+    '''
+    if 'enum' in schema:
+      options = schema['enum']
+      return example if example in options else options[int(rng.integers(len(options)))]
+    match schema.get('type'):
+      case 'object':
+        return {key : self._value(value, example, rng) for key, value in schema.get('properties', {}).items()}
+      case 'array':
+        items = schema.get('items', {})
+        lines = [line.strip() for line in example.split('\n') if line.strip()]
+        if 'pattern' in items:
+          lines = [line for line in lines if re.search(items['pattern'], line)]
+        values = [self._value(items, line, rng) for line in lines]
+        while len(values) < schema.get('minItems', 0):
+          values.append(self._value(items, '', rng))
+        return values
+      case 'integer' | 'number':
+        minimum = schema.get('minimum', 0)
+        maximum = schema.get('maximum', minimum + 10)
+        try:
+          value = int(example) if schema['type'] == 'integer' else float(example)
+          if minimum <= value <= maximum:
+            return value
+        except ValueError:
+          pass
+        return int(rng.integers(minimum, maximum + 1))
+      case 'boolean':
+        return example.lower() == 'true' if example.lower() in ('true', 'false') else bool(rng.integers(2))
+      case _:
+        return example
+
+  def _generate(self, body:dict)->dict:
+    if not body.get('prompt'):
+      # an empty prompt only loads the model
+      return {'model' : body.get('model'), 'response' : '', 'done' : True}
+    response = self._response(body)
+    time.sleep(self.__latency + self.__token_latency * len(self._tokens(response)))
+    return {'model' : body.get('model'), 'response' : response, 'done' : True,
+            'context' : self._context(body, response), **self._token_counts(body, self._tokens(response))}
+
+  def _generate_tokens(self, body:dict)->list[str]:
+    return self._tokens(self._response(body))
+
+  @staticmethod
+  def _tokens(text:str)->list[str]:
+    return [text[start:start + 4] for start in range(0, len(text), 4)]
+
+  def _token_counts(self, body:dict, tokens:list[str])->dict[str,int]:
+    '''
+    The statistics Ollama reports, without a prefix cache every prompt token is evaluated.
+    '''
+    prompt = body.get('system', '') + body.get('prompt', '')
+    return {'prompt_eval_count' : len(self._tokens(prompt)) + len(body.get('context') or []), 'eval_count' : len(tokens)}
+
+  def _context(self, body:dict, response:str)->list[int]:
+    '''
+    Stands in for the token ids of the conversation, one per 4 characters like the tokens.
+    '''
+    previous = body.get('context') or []
+    text = body.get('prompt', '') + response
+    return list(previous) + [self._seed(token) % 128000 for token in self._tokens(text)]
+
+  # Embeddings
+
+  def _embedding(self, text:str)->np.ndarray:
+    embedding = np.random.default_rng(self._seed(text)).standard_normal(self.__dimensions)
+    return embedding / np.linalg.norm(embedding)
+
+  def _embed(self, body:dict)->dict:
+    phrases = body.get('input', [])
+    if isinstance(phrases, str):
+      phrases = [phrases]
+    time.sleep(self.__embedding_latency)
+    return {'model' : body.get('model'), 'embeddings' : [self._embedding(phrase).tolist() for phrase in phrases]}
+
+  def _embeddings(self, body:dict)->dict:
+    time.sleep(self.__embedding_latency)
+    return {'embedding' : self._embedding(body.get('prompt', '')).tolist()}
+
+  # Lifecycle
+
+  def start(self)->'FakeOllama':
+    '''
+    Serves from a background thread.
+    '''
+    if self.__thread is None:
+      self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+      self.__thread.start()
+    return self
+
+  def stop(self):
+    if self.__thread is not None:
+      self.__server.shutdown()
+      self.__thread.join()
+      self.__thread = None
+    self.__server.server_close()
+
+  def __enter__(self)->'FakeOllama':
+    return self.start()
+
+  def __exit__(self, *_):
+    self.stop()
+
+  @property
+  def host(self)->str:
+    address, port = self.__server.server_address[:2]
+    return f'http://{address}:{port}'
+
+  @property
+  def counts(self)->dict[str,int]:
+    '''
+    Requests served per endpoint, and 'aborted' for streams the client closed early.
+    '''
+    with self.__lock:
+      return dict(self.__counts)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Serve a deterministic stand in for Ollama.')
+  parser.add_argument('--host', type=str, default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=11434)
+  parser.add_argument('--latency', type=float, default=0.0,
+                      help='Seconds added to every generate request.')
+  parser.add_argument('--token_latency', type=float, default=0.0,
+                      help='Seconds added per generated token.')
+  parser.add_argument('--embedding_latency', type=float, default=0.0,
+                      help='Seconds added to every embedding request.')
+  parser.add_argument('--dimensions', type=int, default=768,
+                      help='Size of the embeddings, nomic-embed-text uses 768.')
+  args = parser.parse_args()
+  server = FakeOllama(args.host, args.port, args.latency, args.token_latency, args.embedding_latency, args.dimensions)
+  print(f'Serving on {server.host}')
+  try:
+    server.start()
+    threading.Event().wait()
+  except KeyboardInterrupt:
+    server.stop()
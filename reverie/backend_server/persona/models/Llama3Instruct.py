@@ -1,19 +1,32 @@
-import requests
+from typing import Callable, Union
 
-from reverie.backend_server.persona.models.model import Model
+from reverie.backend_server import tracing
+from reverie.backend_server.persona.models.AsyncModel import AsyncModel
+from reverie.backend_server.persona.models.ConnectionPool import ConnectionPool
+from reverie.backend_server.persona.models.ResponseCache import ResponseCache
+from reverie.backend_server.persona.models.StructuredOutput import StructuredOutput
 
 
-class LLama3Instruct(Model):
-  def __init__(self,model='llama3.1:8b-instruct-q8_0',seed=None) -> None:
+class LLama3Instruct(AsyncModel):
+  def __init__(self,
+               model='llama3.1:8b-instruct-q8_0',
+               seed=None,
+               cache:Union[ResponseCache,None]=None,
+               host:str='http://localhost:11434',
+               pool:Union[ConnectionPool,None]=None) -> None:
     '''
     The model parameter is the model string that you want to target
+    Requests go through the pool, which should be shared with every other client of the same server.
     '''
-    super().__init__()
-    self._address = 'http://localhost:11434/api/generate'
+    super().__init__(cache)
+    self._address = f'{host}/api/generate'
     self._model_name = model
+    self._pool = pool if pool is not None else ConnectionPool()
 
     # send empty prompt to load model into memory
-    requests.post(self._address, json={'model' : self._model_name})
+    # in replay mode the model is never called so there is nothing to load
+    if cache is None or cache.mode != 'replay':
+      self._pool.post(self._address, {'model' : self._model_name})
 
   def _format_final_prompt(self,user_prompt:str,system_prompt:str)->dict:
     return {
@@ -23,12 +36,73 @@ class LLama3Instruct(Model):
         'system' : system_prompt
         }
 
+  def _constrain(self,prompt_arguments:dict,structured_output:StructuredOutput)->bool:
+    # Ollama turns the json schema into a grammar that the sampler has to follow
+    prompt_arguments['format'] = structured_output.format
+    return True
+
+  def _session_arguments(self,prompt_arguments:dict,num_ctx:int,num_keep:int,keep_alive:str)->dict:
+    # Ollama reloads the model when num_ctx changes, so every request of every session must agree on it.
+    # num_keep is the amount of tokens at the start of the prompt that are kept when the context overflows.
+    options = {**prompt_arguments.get('options', {}), 'num_ctx' : num_ctx, 'num_keep' : num_keep}
+    return {**prompt_arguments, 'options' : options, 'keep_alive' : keep_alive}
+
+  @staticmethod
+  def _count_tokens(response:dict):
+    # only the final object of a stream has the counts, prompt_eval_count leaves out the reused prefix
+    tracing.count_tokens(response.get('prompt_eval_count'), response.get('eval_count'))
+
   def _call_model(self,prompt_arguments:dict)->str:
-    response = requests.post(self._address, json=prompt_arguments).json()
+    response = self._pool.post(self._address, prompt_arguments)
+    self._count_tokens(response)
     print(response['response'])
     return response['response']
-  
+
   def _call_model_with_context(self,prompt_arguments:dict)->dict:
-    response = requests.post(self._address, json=prompt_arguments).json()
+    response = self._pool.post(self._address, prompt_arguments)
+    self._count_tokens(response)
+    keep = ['response', 'context']
+    return {key : response[key] for key in keep}
+
+  def _stream_model(self,prompt_arguments:dict,prefix_validate:Callable[[str],bool])->str:
+    '''
+    Ollama streams one json object per token, closing the connection stops the generation.
+    '''
+    response = ''
+    chunks = self._pool.stream(self._address, {**prompt_arguments, 'stream' : True})
+    try:
+      for chunk in chunks:
+        response += chunk.get('response', '')
+        self._count_tokens(chunk)
+        if not prefix_validate(response):
+          raise ValueError(f'Generation aborted, response can not be valid:"{response}"')
+    finally:
+      chunks.close()
+    print(response)
+    return response
+
+  async def _call_model_async(self,prompt_arguments:dict)->str:
+    response = await self._pool.post_async(self._address, prompt_arguments)
+    self._count_tokens(response)
+    print(response['response'])
+    return response['response']
+
+  async def _call_model_with_context_async(self,prompt_arguments:dict)->dict:
+    response = await self._pool.post_async(self._address, prompt_arguments)
+    self._count_tokens(response)
     keep = ['response', 'context']
     return {key : response[key] for key in keep}
+
+  async def _stream_model_async(self,prompt_arguments:dict,prefix_validate:Callable[[str],bool])->str:
+    response = ''
+    chunks = self._pool.stream_async(self._address, {**prompt_arguments, 'stream' : True})
+    try:
+      async for chunk in chunks:
+        response += chunk.get('response', '')
+        self._count_tokens(chunk)
+        if not prefix_validate(response):
+          raise ValueError(f'Generation aborted, response can not be valid:"{response}"')
+    finally:
+      await chunks.aclose()
+    print(response)
+    return response
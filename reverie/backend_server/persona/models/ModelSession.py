@@ -0,0 +1,179 @@
+'''
+A per agent view of a shared model.
+
+Nearly every prompt of an agent starts with the same system prompt, the
+default system prompt filled in with Personality.get_summarized_identity().
+Ollama keeps the evaluated prompt of its previous requests around and only
+evaluates what comes after the longest common prefix, so if that system
+prompt is byte for byte the same on every call, processing it (which
+dominates inference time on a CPU for prompts this long) is paid once.
+That only holds while the model stays loaded: Ollama unloads it after five
+idle minutes, and reloads it whenever num_ctx changes.
+
+A ModelSession wraps the shared model for one agent and:
+- renders the system prompt once, until the identity changes
+  (Personality.identity_version, bumped by _revise_learned_traits),
+- sends the same num_ctx and keep_alive with every request, and num_keep so
+  that the system prompt is what is kept when the context overflows,
+- trims contexts passed to run_inference_with_context to fit in num_ctx.
+
+The session has no cache of its own, the ResponseCache of the wrapped model
+is used, with the same keys.
+'''
+import asyncio
+from typing import Callable, List, Tuple, Union
+
+from reverie.backend_server.persona.core.Personality import Personality
+from reverie.backend_server.persona.models.AsyncModel import AsyncModel
+from reverie.backend_server.persona.models.PromptTemplate import PromptTemplate
+from reverie.backend_server.persona.models.StructuredOutput import StructuredOutput
+from reverie.backend_server.persona.models.model import Model
+
+
+class ModelSession(AsyncModel):
+  def __init__(self,
+               model:Model,
+               personality:Personality,
+               num_ctx:int=8192,
+               keep_alive:str='24h',
+               response_tokens:int=1024) -> None:
+    '''
+    response_tokens is the room left in the context for the response when contexts are trimmed.
+    '''
+    if num_ctx <= response_tokens:
+      raise ValueError("num_ctx must be larger than response_tokens")
+    super().__init__(model._cache)
+    self.__model = model
+    self.__personality = personality
+    self.__num_ctx = num_ctx
+    self.__keep_alive = keep_alive
+    self.__response_tokens = response_tokens
+    self._default_system_prompt = model._default_system_prompt
+    self.__identity_version = -1
+    self.__identity = ""
+    self.__rendered_system_prompt = ""
+    self.__num_keep = 0
+
+  @staticmethod
+  def _estimate_tokens(text:str)->int:
+    '''
+    Over estimates on purpose, english text averages about 4 characters per token.
+    '''
+    return len(text)//3 + 1
+
+  def __refresh(self):
+    version = self.__personality.identity_version
+    if version == self.__identity_version:
+      return
+    self.__identity = self.__personality.get_summarized_identity()
+    self.__rendered_system_prompt = super()._system_prompt(None, [self.__identity])
+    # the chat template adds a few tokens in front of the system prompt
+    self.__num_keep = self._estimate_tokens(self.__rendered_system_prompt) + 16
+    self.__identity_version = version
+
+  def _system_prompt(self,
+                     system_prompt:Union[str,None],
+                     system_prompt_parameters:list[str])->str:
+    if system_prompt is None and len(system_prompt_parameters) == 1:
+      self.__refresh()
+      if system_prompt_parameters[0] == self.__identity:
+        return self.__rendered_system_prompt
+    return super()._system_prompt(system_prompt, system_prompt_parameters)
+
+  def __arguments(self, prompt_arguments:dict)->dict:
+    self.__refresh()
+    return self.__model._session_arguments(prompt_arguments, self.__num_ctx, self.__num_keep, self.__keep_alive)
+
+  def _trim_context(self, context:Union[None,List[int]], user_prompt:str)->Union[None,List[int]]:
+    '''
+    Keeps the most recent tokens of the context that fit next to the system prompt,
+    the user prompt and the response.
+    '''
+    if not context:
+      return context
+    self.__refresh()
+    budget = self.__num_ctx - self.__num_keep - self._estimate_tokens(user_prompt) - self.__response_tokens
+    if len(context) <= budget:
+      return context
+    return context[-budget:] if budget > 0 else None
+
+  # The wrapped model does the actual work
+
+  def _format_final_prompt(self,user_prompt:str,system_prompt:str)->dict:
+    return self.__model._format_final_prompt(user_prompt, system_prompt)
+
+  def _constrain(self,prompt_arguments:dict,structured_output:StructuredOutput)->bool:
+    return self.__model._constrain(prompt_arguments, structured_output)
+
+  def _call_model(self,prompt_arguments:dict)->str:
+    return self.__model._call_model(self.__arguments(prompt_arguments))
+
+  def _call_model_with_context(self,prompt_arguments:dict)->dict:
+    return self.__model._call_model_with_context(self.__arguments(prompt_arguments))
+
+  def _stream_model(self,prompt_arguments:dict,prefix_validate:Callable[[str],bool])->str:
+    return self.__model._stream_model(self.__arguments(prompt_arguments), prefix_validate)
+
+  async def _call_model_async(self,prompt_arguments:dict)->str:
+    if isinstance(self.__model, AsyncModel):
+      return await self.__model._call_model_async(self.__arguments(prompt_arguments))
+    return await asyncio.to_thread(self._call_model, prompt_arguments)
+
+  async def _call_model_with_context_async(self,prompt_arguments:dict)->dict:
+    if isinstance(self.__model, AsyncModel):
+      return await self.__model._call_model_with_context_async(self.__arguments(prompt_arguments))
+    return await asyncio.to_thread(self._call_model_with_context, prompt_arguments)
+
+  async def _stream_model_async(self,prompt_arguments:dict,prefix_validate:Callable[[str],bool])->str:
+    if isinstance(self.__model, AsyncModel):
+      return await self.__model._stream_model_async(self.__arguments(prompt_arguments), prefix_validate)
+    return await asyncio.to_thread(self._stream_model, prompt_arguments, prefix_validate)
+
+  def run_inference_with_context(self,
+                                 user_prompt:Union[str,PromptTemplate],
+                                 user_prompt_parameters:list[str],
+                                 system_prompt_parameters:list[str],
+                                 example_output:str,
+                                 validate:Callable[[str,str],str],
+                                 fail_safe_response:str,
+                                 special_instruction:Union[str,None]=None,
+                                 repeat=3,
+                                 system_prompt:Union[str,None]=None,
+                                 context:Union[None,List[int]]=None)->Tuple[str,List[int]]:
+    '''
+    See Model.run_inference_with_context, the context is trimmed to fit in num_ctx first.
+    '''
+    # the user prompt as it will be sent, templates and parameters filled in
+    _, filled_prompt = self._prepare_prompt(user_prompt, user_prompt_parameters, system_prompt_parameters,
+                                            example_output, special_instruction, system_prompt)
+    context = self._trim_context(context, filled_prompt)
+    return super().run_inference_with_context(user_prompt, user_prompt_parameters, system_prompt_parameters,
+                                              example_output, validate, fail_safe_response,
+                                              special_instruction, repeat, system_prompt, context)
+
+  async def run_inference_with_context_async(self,
+                                             user_prompt:Union[str,PromptTemplate],
+                                             user_prompt_parameters:list[str],
+                                             system_prompt_parameters:list[str],
+                                             example_output:str,
+                                             validate:Callable[[str,str],str],
+                                             fail_safe_response:str,
+                                             special_instruction:Union[str,None]=None,
+                                             repeat=3,
+                                             system_prompt:Union[str,None]=None,
+                                             context:Union[None,List[int]]=None)->Tuple[str,List[int]]:
+    # the user prompt as it will be sent, templates and parameters filled in
+    _, filled_prompt = self._prepare_prompt(user_prompt, user_prompt_parameters, system_prompt_parameters,
+                                            example_output, special_instruction, system_prompt)
+    context = self._trim_context(context, filled_prompt)
+    return await super().run_inference_with_context_async(user_prompt, user_prompt_parameters, system_prompt_parameters,
+                                                          example_output, validate, fail_safe_response,
+                                                          special_instruction, repeat, system_prompt, context)
+
+  @property
+  def model(self)->Model:
+    return self.__model
+
+  @property
+  def num_ctx(self)->int:
+    return self.__num_ctx
@@ -0,0 +1,59 @@
+import re
+
+
+class PromptTemplate:
+  '''
+  A prompt template that is parsed once and filled in with a single str.format.
+
+  Templates may start with a comment block that describes their inputs, see
+  core/planning/templates/wake_up_hour.txt as an example. It is removed here,
+  and the inputs it declares must be exactly the inputs the prompt uses, so a
+  template that is out of date with its description fails when it is loaded.
+  '''
+  _comment_marker = "<commentblockmarker>###</commentblockmarker>"
+  _input_pattern = re.compile(r'!<INPUT (\d+)>!')
+
+  def __init__(self, text:str, name:str="<prompt>") -> None:
+    '''
+    Throws ValueError if the inputs are not numbered 0 to n-1, or do not match the comment block.
+    '''
+    self.__name = name
+    comment = None
+    if self._comment_marker in text:
+      comment, text = text.split(self._comment_marker)[:2]
+
+    used = sorted({int(index) for index in self._input_pattern.findall(text)})
+    if used != list(range(len(used))):
+      raise ValueError(f"Template '{name}' must use the inputs 0 to n-1, uses: {used}")
+    if comment is not None:
+      declared = sorted({int(index) for index in self._input_pattern.findall(comment)})
+      if declared and declared != used:
+        raise ValueError(f"Template '{name}' declares the inputs {declared}, but uses {used}")
+    self.__arity = len(used)
+
+    escaped = text.replace("{", "{{").replace("}", "}}")
+    self.__format = self._input_pattern.sub(lambda match: "{" + match.group(1) + "}", escaped)
+
+  def format(self, parameters:list[str])->str:
+    '''
+    Throws ValueError if the amount of parameters is not the arity of the template.
+    '''
+    if len(parameters) != self.__arity:
+      raise ValueError(f"Template '{self.__name}' takes {self.__arity} parameters, got {len(parameters)}")
+    return self.__format.format(*parameters).strip()
+
+  def check_arity(self, arity:int):
+    '''
+    For callers to check the amount of parameters they are going to provide up front.
+    '''
+    if arity != self.__arity:
+      raise ValueError(f"Template '{self.__name}' takes {self.__arity} parameters, not {arity}")
+    return self
+
+  @property
+  def arity(self)->int:
+    return self.__arity
+
+  @property
+  def name(self)->str:
+    return self.__name
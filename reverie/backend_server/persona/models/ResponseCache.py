@@ -0,0 +1,169 @@
+'''
+On disk cache for model responses.
+
+Every simulated day re-issues a lot of near identical prompts (wake up hour,
+impact scoring, computer interaction detection, object association). Each one
+is a blocking round trip to the model, so responses that have already been
+paid for are stored here and keyed by a hash of the final formatted prompt.
+'''
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Literal, Union
+
+CacheMode = Literal['record', 'replay', 'bypass']
+
+
+class ResponseCache:
+  '''
+  Content addressed response store backed by a single sqlite file.
+
+  The key is a sha256 of the final prompt arguments that get sent to the model
+  (model name, system prompt, user prompt, sampling parameters, and the context
+  if one is used), so any change to the prompt is a different entry.
+
+  Modes:
+  - record: serve hits from the cache, call the model on a miss and store the result.
+  - replay: only serve hits from the cache, the model is never called.
+  - bypass: the cache is ignored entirely.
+
+  When more than max_entries responses are stored, the least recently used
+  entries are evicted.
+  '''
+  modes = ('record', 'replay', 'bypass')
+
+  def __init__(self,
+               location:str,
+               max_entries:int=50000,
+               mode:CacheMode='record') -> None:
+    if mode not in self.modes:
+      raise ValueError(f"Unknown cache mode: '{mode}', expected one of {self.modes}")
+    if max_entries < 1:
+      raise ValueError("max_entries must be at least 1")
+    self.__mode:CacheMode = mode
+    self.__max_entries = max_entries
+    self.__location = location
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    directory = os.path.dirname(location)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    # Agents may be ticked from multiple threads, all access goes through the lock.
+    self.__lock = threading.Lock()
+    self.__connection = sqlite3.connect(location, check_same_thread=False)
+    self.__connection.execute('PRAGMA journal_mode=WAL')
+    self.__connection.execute('PRAGMA synchronous=NORMAL')
+    self.__connection.execute('''
+      CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        last_used INTEGER NOT NULL
+      )''')
+    self.__connection.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)')
+    self.__connection.commit()
+    # A logical clock is used instead of wall time so that ordering is exact.
+    self.__clock, self.__size = self.__connection.execute(
+        'SELECT COALESCE(MAX(last_used), 0), COUNT(*) FROM responses').fetchone()
+
+  @staticmethod
+  def key_for(prompt_arguments:dict)->str:
+    '''
+    Hash of the final prompt, this must include everything that influences the response.
+    '''
+    canonical = json.dumps(prompt_arguments, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+  def get(self, key:str)->Union[str,None]:
+    '''
+    Returns the stored response or None on a miss. Always misses in bypass mode.
+    '''
+    if self.__mode == 'bypass':
+      return None
+    with self.__lock:
+      row = self.__connection.execute(
+          'SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+      if row is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self.__clock += 1
+      self.__connection.execute(
+          'UPDATE responses SET last_used = ? WHERE key = ?', (self.__clock, key))
+      self.__connection.commit()
+      return row[0]
+
+  def put(self, key:str, response:str):
+    '''
+    Stores a response, only has an effect in record mode.
+    '''
+    if self.__mode != 'record':
+      return
+    with self.__lock:
+      self.__clock += 1
+      existed = self.__connection.execute(
+          'SELECT 1 FROM responses WHERE key = ?', (key,)).fetchone() is not None
+      self.__connection.execute(
+          'INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)',
+          (key, response, self.__clock))
+      if not existed:
+        self.__size += 1
+      self.__evict()
+      self.__connection.commit()
+
+  def discard(self, key:str):
+    '''
+    Removes an entry, used when a cached response no longer passes validation.
+    '''
+    with self.__lock:
+      removed = self.__connection.execute(
+          'DELETE FROM responses WHERE key = ?', (key,)).rowcount
+      self.__size -= removed
+      self.__connection.commit()
+
+  def __evict(self):
+    overflow = self.__size - self.__max_entries
+    if overflow <= 0:
+      return
+    self.__connection.execute('''
+      DELETE FROM responses WHERE key IN (
+        SELECT key FROM responses ORDER BY last_used ASC LIMIT ?
+      )''', (overflow,))
+    self.__size -= overflow
+    self.evictions += overflow
+
+  def close(self):
+    with self.__lock:
+      self.__connection.commit()
+      self.__connection.close()
+
+  @property
+  def mode(self)->CacheMode:
+    return self.__mode
+
+  @mode.setter
+  def mode(self, mode:CacheMode):
+    if mode not in self.modes:
+      raise ValueError(f"Unknown cache mode: '{mode}', expected one of {self.modes}")
+    self.__mode = mode
+
+  @property
+  def location(self):
+    return self.__location
+
+  def __len__(self):
+    return self.__size
+
+  @property
+  def stats(self)->dict:
+    return {
+        'mode' : self.__mode,
+        'entries' : self.__size,
+        'max_entries' : self.__max_entries,
+        'hits' : self.hits,
+        'misses' : self.misses,
+        'evictions' : self.evictions
+      }
@@ -0,0 +1,180 @@
+'''
+Constrained output for prompts with a fixed answer format.
+
+Free form answers are the main reason for retries in Model.run_inference: a
+"Yes." instead of "yes", a comment before a schedule, and so on. A
+StructuredOutput describes the shape of the answer as a json schema, which
+models that support it (Ollama's format parameter) use to constrain decoding,
+so the answer can only be produced in that shape.
+
+The model answers with {"answer": ...}, decode turns that back into the plain
+text the existing validate functions expect, so callers keep their validators
+and models without constrained decoding keep working unchanged. The same goes
+for prefix validators, decode_prefix turns a partial {"answer": ... back into
+the plain text generated so far.
+'''
+import json
+import re
+from typing import Callable, Tuple, Union
+
+
+class StructuredOutput:
+  _answer_start = re.compile(r'\s*\{\s*"answer"\s*:\s*')
+  _escapes = {'"' : '"', '\\' : '\\', '/' : '/', 'b' : '\b', 'f' : '\f', 'n' : '\n', 'r' : '\r', 't' : '\t'}
+
+  def __init__(self, schema:dict, separator:str="\n") -> None:
+    '''
+    schema is the json schema of the answer.
+    If the answer is an array, its items are joined with separator when decoded.
+    '''
+    self.__schema = schema
+    self.__separator = separator
+
+  @classmethod
+  def enum(cls, options:list[str]):
+    '''
+    The answer is exactly one of options.
+    '''
+    if not options:
+      raise ValueError("An enum needs at least one option")
+    return cls({'type' : 'string', 'enum' : list(options)})
+
+  @classmethod
+  def integer(cls, minimum:Union[int,None]=None, maximum:Union[int,None]=None):
+    schema:dict = {'type' : 'integer'}
+    if minimum is not None:
+      schema['minimum'] = minimum
+    if maximum is not None:
+      schema['maximum'] = maximum
+    return cls(schema)
+
+  @classmethod
+  def pattern(cls, regex:str):
+    '''
+    The answer is a string that matches regex, anchors are added if they are missing.
+    '''
+    return cls({'type' : 'string', 'pattern' : cls.__anchored(regex)})
+
+  @classmethod
+  def lines(cls, regex:str, min_lines:int=1):
+    '''
+    The answer is a list of lines that each match regex, decoded as newline separated text.
+    '''
+    return cls({
+        'type' : 'array',
+        'items' : {'type' : 'string', 'pattern' : cls.__anchored(regex)},
+        'minItems' : min_lines
+      })
+
+  @staticmethod
+  def __anchored(regex:str)->str:
+    if not regex.startswith('^'):
+      regex = '^' + regex
+    if not regex.endswith('$'):
+      regex = regex + '$'
+    return regex
+
+  @property
+  def schema(self)->dict:
+    return self.__schema
+
+  @property
+  def format(self)->dict:
+    '''
+    The json schema of the complete response.
+    '''
+    return {
+        'type' : 'object',
+        'properties' : {'answer' : self.__schema},
+        'required' : ['answer']
+      }
+
+  def decode(self, response:str)->str:
+    '''
+    Throws ValueError if the response is not in the structured format.
+    '''
+    try:
+      answer = json.loads(response)['answer']
+    except (json.JSONDecodeError, KeyError, TypeError):
+      raise ValueError(f'Response is not structured:"{response}"')
+    if isinstance(answer, list):
+      return self.__separator.join(str(item) for item in answer)
+    return str(answer)
+
+  def decode_prefix(self, partial:str)->Union[str,None]:
+    '''
+    The plain text of the answer generated so far, as decode would return it for a
+    response that starts with partial. None if the answer has not started yet or
+    partial is not in the structured format, in which case nothing can be told from it.
+    '''
+    start = self._answer_start.match(partial)
+    if start is None:
+      return None
+    position = start.end()
+    if position == len(partial):
+      return None
+    if partial[position] == '"':
+      return self.__partial_string(partial, position + 1)[0]
+    if partial[position] != '[':
+      # numbers and the like, up to where the value ends
+      return re.match(r'[^,}\s]*', partial[position:]).group(0)
+
+    items = []
+    position += 1
+    while position < len(partial):
+      if partial[position] == '"':
+        item, position = self.__partial_string(partial, position + 1)
+        items.append(item)
+      elif partial[position] == ']':
+        break
+      else:
+        # whitespace, commas and other items
+        position += 1
+    return self.__separator.join(items)
+
+  @classmethod
+  def __partial_string(cls, partial:str, position:int)->Tuple[str,int]:
+    '''
+    Decodes the json string that starts at position (after its opening quote) up to its
+    closing quote or the end of partial. Returns the text and the position after it.
+    '''
+    text = []
+    while position < len(partial):
+      character = partial[position]
+      if character == '"':
+        return ''.join(text), position + 1
+      if character != '\\':
+        text.append(character)
+        position += 1
+        continue
+      escape = partial[position + 1:position + 2]
+      if escape == 'u':
+        digits = partial[position + 2:position + 6]
+        if len(digits) < 4:
+          break
+        text.append(chr(int(digits, 16)))
+        position += 6
+      elif escape in cls._escapes:
+        text.append(cls._escapes[escape])
+        position += 2
+      else:
+        # the escape has not been generated yet
+        break
+    return ''.join(text), len(partial)
+
+  def wrap(self, validate:Callable[[str,str],str])->Callable[[str,str],str]:
+    '''
+    Returns a validate function that decodes the response before validating it.
+    '''
+    def validate_structured(response:str, prompt:str="")->str:
+      return validate(self.decode(response), prompt)
+    return validate_structured
+
+  def wrap_prefix(self, prefix_validate:Callable[[str],bool])->Callable[[str],bool]:
+    '''
+    Returns a prefix validator that decodes the partial response before checking it.
+    '''
+    def prefix_validate_structured(partial:str)->bool:
+      decoded = self.decode_prefix(partial)
+      return decoded is None or prefix_validate(decoded)
+    return prefix_validate_structured
@@ -1,8 +1,14 @@
 from abc import ABC, abstractmethod
 import re
-from typing import Callable, List, Tuple, Union
+from typing import Callable, Generator, List, Tuple, Union
+import json
 import sys
 
+from reverie.backend_server import tracing
+from reverie.backend_server.persona.models.PromptTemplate import PromptTemplate
+from reverie.backend_server.persona.models.ResponseCache import ResponseCache
+from reverie.backend_server.persona.models.StructuredOutput import StructuredOutput
+
 # this is so that paths are relative to reverie/backend_server/persona
 # to provide drop in compatibility with existing path conventions
 sys.path.append('../../')
@@ -16,6 +22,24 @@ Each prompt will contain an example response. Use the example as a guideline for
 Often, prompts will ask you how you would react in different situations, or how you think the human that you are modeling will behave. You not only serve as a model of the human, but also of that individuals concious thinking and should respond appropriately according to the requirements of the prompt.
   """
   _prompt_input_pattern = re.compile(r'!<INPUT \d+>')
+  _cache:Union[ResponseCache,None] = None
+  # compiled default system prompts, subclasses may override _default_system_prompt
+  _system_templates:dict[str,PromptTemplate] = {}
+
+  def __init__(self,cache:Union[ResponseCache,None]=None) -> None:
+    '''
+    If a cache is provided, validated responses are stored in it and
+    identical prompts are served from it, see models/ResponseCache.py
+    '''
+    self._cache = cache
+
+  def _cache_key(self,final_prompt:dict)->Union[str,None]:
+    '''
+    Returns None when no cache should be consulted for this call.
+    '''
+    if self._cache is None or self._cache.mode == 'bypass':
+      return None
+    return ResponseCache.key_for(final_prompt)
 
   def __fill_in_prompt(self,prompt:str, prompt_parameters:list)->str:
     '''
@@ -38,6 +62,13 @@ Often, prompts will ask you how you would react in different situations, or how
 
     return prompt.strip()
 
+  def __default_system_template(self)->PromptTemplate:
+    template = self._system_templates.get(self._default_system_prompt)
+    if template is None:
+      template = PromptTemplate(self._default_system_prompt, "default system prompt")
+      self._system_templates[self._default_system_prompt] = template
+    return template
+
   @abstractmethod
   def _format_final_prompt(self,user_prompt:str,system_prompt:str)->dict:
     '''
@@ -56,8 +87,136 @@ Often, prompts will ask you how you would react in different situations, or how
   def _call_model_with_context(self,prompt_arguments:dict)->dict:
     raise NotImplementedError()
 
+  def _stream_model(self,prompt_arguments:dict,prefix_validate:Callable[[str],bool])->str:
+    '''
+    Like _call_model, but prefix_validate is called on the partial response as it is generated,
+    and generation is aborted with a ValueError as soon as it returns False.
+    Models that can not stream generate the full response and check it once.
+    '''
+    response = self._call_model(prompt_arguments)
+    if not prefix_validate(response):
+      raise ValueError(f'Response can not be valid:"{response}"')
+    return response
+
+  def _constrain(self,prompt_arguments:dict,structured_output:StructuredOutput)->bool:
+    '''
+    Adds the output constraint to the json body of the prompt.
+    Returns False if the model can not constrain its output, which is the default.
+    '''
+    return False
+
+  def _structure(self,
+                 final_prompt:dict,
+                 structured_output:Union[StructuredOutput,None],
+                 validate:Callable[[str,str],str],
+                 prefix_validate:Union[Callable[[str],bool],None])->Tuple[Callable[[str,str],str],Union[Callable[[str],bool],None]]:
+    '''
+    Constrains the final prompt if possible, and returns the validate and prefix_validate functions to use for it.
+    '''
+    if structured_output is None or not self._constrain(final_prompt,structured_output):
+      return validate,prefix_validate
+    if prefix_validate is not None:
+      prefix_validate = structured_output.wrap_prefix(prefix_validate)
+    return structured_output.wrap(validate),prefix_validate
+
+  def _system_prompt(self,
+                     system_prompt:Union[str,None],
+                     system_prompt_parameters:list[str])->str:
+    '''
+    Fills in the system prompt, the default system prompt if None is provided.
+    '''
+    match system_prompt:
+      case str(system_prompt):
+        return self.__fill_in_prompt(system_prompt, system_prompt_parameters)
+      case None:
+        if not len(system_prompt_parameters) == 1:
+          raise ValueError("Using the default system prompt requires a prompt_parameter list of length 1, see doc string")
+        return self.__default_system_template().format(system_prompt_parameters)
+
+  def _session_arguments(self,
+                         prompt_arguments:dict,
+                         num_ctx:int,
+                         num_keep:int,
+                         keep_alive:str)->dict:
+    '''
+    Returns the json body with the settings of a ModelSession applied (see models/ModelSession.py).
+    Models without such settings return it unchanged, which is the default.
+    '''
+    return prompt_arguments
+
+  def _prepare_prompt(self,
+                      user_prompt:Union[str,PromptTemplate],
+                      user_prompt_parameters:list[str],
+                      system_prompt_parameters:list[str],
+                      example_output:str,
+                      special_instruction:Union[str,None],
+                      system_prompt:Union[str,None])->Tuple[dict,str]:
+    '''
+    Fills in the prompts and returns the final prompt for the model and the user prompt (for validation).
+    '''
+    system_prompt = self._system_prompt(system_prompt, system_prompt_parameters)
+
+    match user_prompt:
+      case PromptTemplate():
+        filled = user_prompt.format(user_prompt_parameters)
+      case _:
+        filled = self.__fill_in_prompt(user_prompt,user_prompt_parameters)
+    user_prompt = f"{filled}\n"
+    user_prompt += f"{special_instruction}\n" if special_instruction else ""
+    user_prompt += f"An example response is:\n{example_output}"
+
+    return self._format_final_prompt(user_prompt, system_prompt),user_prompt
+
+  def _cached_inference(self,
+                        cache_key:Union[str,None],
+                        validate:Callable[[str,str],str],
+                        user_prompt:str,
+                        fail_safe_response:str,
+                        final_prompt:dict)->Tuple[bool,str]:
+    '''
+    Returns (True, response) if the call is answered from the cache, which
+    includes the fail safe on a miss in replay mode. Otherwise (False, "").
+    '''
+    if cache_key is None or self._cache is None:
+      return False,""
+    cached = self._cache.get(cache_key)
+    if cached is not None:
+      try:
+        return True,validate(cached,user_prompt)
+      except ValueError:
+        # validation rules changed since the response was recorded
+        self._cache.discard(cache_key)
+    if self._cache.mode == 'replay':
+      print(f"Warning: Failsafe response used for replay cache miss on prompt:{final_prompt}")
+      return True,fail_safe_response
+    return False,""
+
+  def _cached_inference_with_context(self,
+                                     cache_key:Union[str,None],
+                                     validate:Callable[[str,str],str],
+                                     user_prompt:str,
+                                     fail_safe_response:str,
+                                     final_prompt:dict)->Tuple[bool,Tuple[str,List[int]]]:
+    if cache_key is None or self._cache is None:
+      return False,("",[])
+    cached = self._cache.get(cache_key)
+    if cached is not None:
+      cached_response = json.loads(cached)
+      try:
+        return True,(validate(cached_response['response'],user_prompt),cached_response['context'])
+      except ValueError:
+        self._cache.discard(cache_key)
+    if self._cache.mode == 'replay':
+      print(f"Warning: Failsafe response used for replay cache miss on prompt:{final_prompt}")
+      return True,(fail_safe_response,[])
+    return False,("",[])
+
+  def _store(self,cache_key:Union[str,None],response:str):
+    if cache_key is not None and self._cache is not None:
+      self._cache.put(cache_key,response)
+
   def run_inference(self,
-                    user_prompt:str,
+                    user_prompt:Union[str,PromptTemplate],
                     user_prompt_parameters:list[str],
                     system_prompt_parameters:list[str],
                     example_output:str,
@@ -65,46 +224,31 @@ Often, prompts will ask you how you would react in different situations, or how
                     fail_safe_response:str,
                     special_instruction:Union[str,None]=None,
                     repeat=3,
-                    system_prompt:Union[str,None]=None)->str:
+                    system_prompt:Union[str,None]=None,
+                    prefix_validate:Union[Callable[[str],bool],None]=None,
+                    structured_output:Union[StructuredOutput,None]=None)->str:
     '''
     The model will run inference on the prompt.
+    The user prompt is either a PromptTemplate (see core/TemplateRegistry.py) or a string that is parsed on every call.
     System prompt can be specified, else the default system prompt of the class will be used.
     The default system prompt requires one argument that is provided through: Personality.get_summarized_identity()
     validate function must take in two arguments, the first is the response to be validated, and the second is the prompt that was provided to the model.
     special_instructions is appended to the end of the prompt just before the example.
+    If the model has a ResponseCache, cached responses are validated and returned without calling the model.
+    If prefix_validate is provided, the response is streamed and prefix_validate is called on
+    the partial response, it must return False once no continuation can pass validate.
+    The generation is then aborted and the next try starts straight away, see helpers.py for examples.
+    If structured_output is provided and the model supports it, the output is constrained to
+    its schema and decoded before validation, see models/StructuredOutput.py.
     Throws FileNotFoundError on file not found.
     Throws ValueError on parameter missmatches.
     '''
-    match system_prompt:
-      case str(system_prompt):
-        pass
-      case None:
-        system_prompt = self._default_system_prompt
-        if not len(system_prompt_parameters) == 1:
-          raise ValueError("Using the default system prompt requires a prompt_parameter list of length 1, see doc string")
-
-    #TODO refactor so that the prompt is read in as a string and provided by caller
-    user_prompt = f"{self.__fill_in_prompt(user_prompt,user_prompt_parameters)}\n"
-    user_prompt += f"{special_instruction}\n" if special_instruction else ""
-    user_prompt += f"An example response is:\n{example_output}"
-
-    system_prompt = self.__fill_in_prompt(system_prompt, system_prompt_parameters)
-
-    final_prompt = self._format_final_prompt(user_prompt, system_prompt)
-    for _ in range(repeat):
-      try:
-        response = self._call_model(final_prompt)
-        return validate(response,user_prompt)
-      except ValueError:
-        pass
-      except:
-        # TODO, impliment something more concrete here
-        pass
-    print(f"Warning: Failsafe response triggered after {repeat} tries for prompt:{final_prompt}")
-    return fail_safe_response
+    inference = self._inference(user_prompt,user_prompt_parameters,system_prompt_parameters,example_output,validate,
+                                fail_safe_response,special_instruction,repeat,system_prompt,prefix_validate,structured_output)
+    return self._complete(inference,self.__call_model)
 
   def run_inference_with_context(self,
-                    user_prompt:str,
+                    user_prompt:Union[str,PromptTemplate],
                     user_prompt_parameters:list[str],
                     system_prompt_parameters:list[str],
                     example_output:str,
@@ -115,35 +259,120 @@ Often, prompts will ask you how you would react in different situations, or how
                     system_prompt:Union[str,None]=None,
                     context:Union[None,List[int]]=None)->Tuple[str,List[int]]:
     '''
-    TODO bad copy paste practice, refactor later
+    Like run_inference, but the model continues from the given context (the tokens of the
+    earlier prompts and responses), and the new context is returned with the response.
+    After an invalid response, the next try is asked to pay attention to the instructions.
     '''
-    match system_prompt:
-      case str(system_prompt):
-        pass
-      case None:
-        system_prompt = self._default_system_prompt
-        if not len(system_prompt_parameters) == 1:
-          raise ValueError("Using the default system prompt requires a prompt_parameter list of length 1, see doc string")
+    inference = self._inference_with_context(user_prompt,user_prompt_parameters,system_prompt_parameters,example_output,
+                                             validate,fail_safe_response,special_instruction,repeat,system_prompt,context)
+    return self._complete(inference,self._call_model_with_context)
 
-    #TODO refactor so that the prompt is read in as a string and provided by caller
-    user_prompt = f"{self.__fill_in_prompt(user_prompt,user_prompt_parameters)}\n"
-    user_prompt += f"{special_instruction}\n" if special_instruction else ""
-    user_prompt += f"An example response is:\n{example_output}"
+  def __call_model(self,final_prompt:dict,prefix_validate:Union[Callable[[str],bool],None])->str:
+    if prefix_validate is None:
+      return self._call_model(final_prompt)
+    return self._stream_model(final_prompt,prefix_validate)
+
+  @staticmethod
+  def _complete(inference:Generator[tuple,object,object],call_model:Callable):
+    '''
+    Runs an inference generator (see _inference), calling the model whenever it asks for it.
+    '''
+    try:
+      request = next(inference)
+      while True:
+        try:
+          response = call_model(*request)
+        except Exception as e:
+          request = inference.throw(e)
+        else:
+          request = inference.send(response)
+    except StopIteration as stop:
+      return stop.value
+    finally:
+      inference.close()
 
-    system_prompt = self.__fill_in_prompt(system_prompt, system_prompt_parameters)
+  def _inference(self,
+                 user_prompt:Union[str,PromptTemplate],
+                 user_prompt_parameters:list[str],
+                 system_prompt_parameters:list[str],
+                 example_output:str,
+                 validate:Callable[[str,str],str],
+                 fail_safe_response:str,
+                 special_instruction:Union[str,None],
+                 repeat:int,
+                 system_prompt:Union[str,None],
+                 prefix_validate:Union[Callable[[str],bool],None],
+                 structured_output:Union[StructuredOutput,None])->Generator[tuple,str,str]:
+    '''
+    The prompt, cache, retries and fail safe of run_inference, without calling the model itself,
+    so that the synchronous and the async (see AsyncModel) versions share them.
+    Yields (final_prompt, prefix_validate) whenever the model has to be called, the response is
+    sent back (or the exception of the call thrown in) and the answer is returned, see _complete.
+    '''
+    final_prompt,user_prompt = self._prepare_prompt(user_prompt,user_prompt_parameters,system_prompt_parameters,
+                                                    example_output,special_instruction,system_prompt)
+    validate,prefix_validate = self._structure(final_prompt,structured_output,validate,prefix_validate)
+    cache_key = self._cache_key(final_prompt)
+    with tracing.llm_call() as call:
+      answered,cached = self._cached_inference(cache_key,validate,user_prompt,fail_safe_response,final_prompt)
+      if answered:
+        call.cached = True
+        return cached
 
-    final_prompt = self._format_final_prompt(user_prompt, system_prompt)
+      for _ in range(repeat):
+        call.attempts += 1
+        try:
+          response = yield final_prompt,prefix_validate
+          validated = validate(response,user_prompt)
+          self._store(cache_key,response)
+          return validated
+        except ValueError:
+          pass
+        except Exception:
+          # TODO, impliment something more concrete here
+          pass
+      call.fail_safe = True
+      print(f"Warning: Failsafe response triggered after {repeat} tries for prompt:{final_prompt}")
+      return fail_safe_response
 
-    for _ in range(repeat):
-      try:
-        final_prompt['context'] = context
-        response = self._call_model_with_context(final_prompt)
-        final_prompt['context'] = response['context']
-        return validate(response['response'],user_prompt),response['context']
-      except ValueError:
-        final_prompt['prompt'] = 'An invalid response was provided, pay careful attention to the given instructions and try again:\n' + final_prompt['prompt']
-      except:
-        # TODO, impliment something more concrete here
-        pass
-    print(f"Warning: Failsafe response triggered after {repeat} tries for prompt:{final_prompt}")
-    return fail_safe_response,[]
+  def _inference_with_context(self,
+                              user_prompt:Union[str,PromptTemplate],
+                              user_prompt_parameters:list[str],
+                              system_prompt_parameters:list[str],
+                              example_output:str,
+                              validate:Callable[[str,str],str],
+                              fail_safe_response:str,
+                              special_instruction:Union[str,None],
+                              repeat:int,
+                              system_prompt:Union[str,None],
+                              context:Union[None,List[int]])->Generator[tuple,dict,Tuple[str,List[int]]]:
+    '''
+    See _inference, yields (final_prompt,) for run_inference_with_context.
+    '''
+    final_prompt,user_prompt = self._prepare_prompt(user_prompt,user_prompt_parameters,system_prompt_parameters,
+                                                    example_output,special_instruction,system_prompt)
+    final_prompt['context'] = context
+    cache_key = self._cache_key(final_prompt)
+    with tracing.llm_call() as call:
+      answered,cached = self._cached_inference_with_context(cache_key,validate,user_prompt,fail_safe_response,final_prompt)
+      if answered:
+        call.cached = True
+        return cached
+
+      for _ in range(repeat):
+        call.attempts += 1
+        try:
+          final_prompt['context'] = context
+          response = yield (final_prompt,)
+          final_prompt['context'] = response['context']
+          validated = validate(response['response'],user_prompt)
+          self._store(cache_key,json.dumps(response))
+          return validated,response['context']
+        except ValueError:
+          final_prompt['prompt'] = 'An invalid response was provided, pay careful attention to the given instructions and try again:\n' + final_prompt['prompt']
+        except Exception:
+          # TODO, impliment something more concrete here
+          pass
+      call.fail_safe = True
+      print(f"Warning: Failsafe response triggered after {repeat} tries for prompt:{final_prompt}")
+      return fail_safe_response,[]
@@ -0,0 +1,233 @@
+'''
+Incremental checkpointing of a running simulation.
+
+A checkpoint directory contains generations, each one a full snapshot and a
+write ahead log of everything that changed after it:
+
+  CURRENT              the number of the generation to recover from
+  snapshot_<n>/        world.json and one Agent.save folder per agent
+  wal_<n>.jsonl        one record per tick
+
+A record only contains what changed during the tick: concepts that were
+added to or removed from memory (the memory change feed), and structural
+diffs (see delta.py) of the world and of the small agent components such as
+the daily plan and spatial memory. Only the objects that reported a change
+(World._drain_changes) and the agents that ticked (Agent._drain_component_states)
+are diffed, so writing one is cheap enough to do every tick however large the
+world is.
+
+Every compact_every ticks a new snapshot is written and the log starts over,
+so that recovery never has to replay more than that many records.
+'''
+import json
+import os
+import shutil
+from typing import Union
+
+from reverie.backend_server.persona.Agent import Agent
+from reverie.backend_server.persona.AgentFactory import AgentBuilder
+from reverie.backend_server.simulation import delta
+from reverie.backend_server.world.World import World
+
+
+class Checkpointer:
+  def __init__(self,
+               directory:str,
+               world:World,
+               agents:list[Agent],
+               compact_every:int=1440,
+               fsync:bool=False) -> None:
+    '''
+    Starts a new generation with a full snapshot straight away.
+    compact_every is in ticks, by default a simulated day.
+    With fsync, every record is flushed to disk before checkpoint returns,
+    otherwise a crash can lose the records the OS had not written yet.
+    '''
+    if compact_every < 1:
+      raise ValueError("compact_every must be at least 1")
+    self.__directory = directory
+    self.__world = world
+    self.__agents = {agent.name : agent for agent in agents}
+    if len(self.__agents) != len(agents):
+      raise ValueError("Agents must have unique names to be checkpointed")
+    self.__compact_every = compact_every
+    self.__fsync = fsync
+    self.__generation = self.current_generation(directory) or 0
+    self.__ticks_since_snapshot = 0
+    self.__log = None
+    self.__world_state:dict = {}
+    self.__agent_states:dict[str,dict] = {}
+    os.makedirs(directory, exist_ok=True)
+    self.compact()
+
+  @staticmethod
+  def current_generation(directory:str)->Union[int,None]:
+    try:
+      with open(os.path.join(directory, 'CURRENT'), 'r') as file:
+        return int(file.read().strip())
+    except FileNotFoundError:
+      return None
+
+  @staticmethod
+  def _agent_folder(name:str)->str:
+    return name.replace(' ', '_')
+
+  def checkpoint(self):
+    '''
+    Appends a record of everything that changed since the last call.
+    Should be called once per tick, after every agent has ticked.
+    '''
+    record:dict = {'time' : str(self.__world.current_time)}
+    world_changes = []
+    for key, state in self.__world._drain_changes().items():
+      if key == 'objects':
+        for object_id, object_state in state.items():
+          object_state = delta.canonical(object_state)
+          world_changes.extend(delta.diff(self.__world_state['objects'].get(object_id), object_state, ('objects', object_id)))
+          self.__world_state['objects'][object_id] = object_state
+      else:
+        state = delta.canonical(state)
+        world_changes.extend(delta.diff(self.__world_state.get(key), state, (key,)))
+        self.__world_state[key] = state
+    if world_changes:
+      record['world'] = world_changes
+
+    agents = {}
+    for name, agent in self.__agents.items():
+      changes = {}
+      memory_changes = agent._drain_memory_changes()
+      if memory_changes:
+        changes['memory'] = memory_changes
+      component_states = agent._drain_component_states()
+      if component_states is not None:
+        component_states = delta.canonical(component_states)
+        component_changes = delta.diff(self.__agent_states[name], component_states)
+        if component_changes:
+          changes['components'] = component_changes
+        self.__agent_states[name] = component_states
+      if changes:
+        agents[name] = changes
+    if agents:
+      record['agents'] = agents
+
+    self.__log.write(json.dumps(record, separators=(',', ':')) + '\n')
+    self.__log.flush()
+    if self.__fsync:
+      os.fsync(self.__log.fileno())
+
+    self.__ticks_since_snapshot += 1
+    if self.__ticks_since_snapshot >= self.__compact_every:
+      self.compact()
+
+  def compact(self):
+    '''
+    Writes a full snapshot as a new generation, starts its log and removes the previous generation.
+    '''
+    previous = self.__generation
+    generation = previous + 1
+    snapshot = os.path.join(self.__directory, f'snapshot_{generation}')
+    shutil.rmtree(snapshot, ignore_errors=True)
+    os.makedirs(snapshot)
+
+    self.__world_state = delta.canonical(self.__world.state())
+    # The change feeds start over, everything before this is in the snapshot
+    self.__world._track_changes()
+    agent_folders = {}
+    for name, agent in self.__agents.items():
+      agent_folders[name] = self._agent_folder(name)
+      agent.save(os.path.join(snapshot, agent_folders[name]))
+      agent._track_memory_changes()
+      agent._drain_component_states()
+      self.__agent_states[name] = delta.canonical(agent._component_states())
+    with open(os.path.join(snapshot, 'world.json'), 'w') as file:
+      json.dump({'world' : self.__world_state, 'agents' : agent_folders}, file)
+
+    if self.__log is not None:
+      self.__log.close()
+    self.__log = open(os.path.join(self.__directory, f'wal_{generation}.jsonl'), 'w')
+    if self.__fsync:
+      os.fsync(self.__log.fileno())
+
+    # The switch to the new generation is atomic, so a crash during compaction recovers from the previous one.
+    current = os.path.join(self.__directory, 'CURRENT')
+    with open(current + '.tmp', 'w') as file:
+      file.write(str(generation))
+      file.flush()
+      os.fsync(file.fileno())
+    os.replace(current + '.tmp', current)
+    self.__generation = generation
+    self.__ticks_since_snapshot = 0
+
+    if previous:
+      shutil.rmtree(os.path.join(self.__directory, f'snapshot_{previous}'), ignore_errors=True)
+      try:
+        os.remove(os.path.join(self.__directory, f'wal_{previous}.jsonl'))
+      except FileNotFoundError:
+        pass
+
+  def close(self):
+    if self.__log is not None:
+      self.__log.close()
+      self.__log = None
+
+  @property
+  def generation(self)->int:
+    return self.__generation
+
+  @staticmethod
+  def restore(directory:str, world:World, builder:AgentBuilder)->list[Agent]:
+    '''
+    Recovers the simulation from the latest generation: the snapshot is loaded
+    and the log is replayed on top of it.
+    world must be freshly produced by the WorldFactory, and builder must be an
+    AgentBuilder for it. The agents are returned in the order they were checkpointed.
+
+    A last record that was only partially written by a crash is ignored.
+    The recovered snapshot is written to <directory>/recovered, which the
+    returned agents load their embeddings from.
+    '''
+    generation = Checkpointer.current_generation(directory)
+    if generation is None:
+      raise FileNotFoundError(f"No checkpoint found in '{directory}'")
+    snapshot = os.path.join(directory, f'snapshot_{generation}')
+    records = []
+    with open(os.path.join(directory, f'wal_{generation}.jsonl'), 'r') as file:
+      for line in file:
+        try:
+          records.append(json.loads(line))
+        except json.JSONDecodeError:
+          # torn write at the end of the log
+          break
+
+    with open(os.path.join(snapshot, 'world.json'), 'r') as file:
+      manifest = json.load(file)
+    world_state = manifest['world']
+    agent_folders:dict[str,str] = manifest['agents']
+    component_changes:dict[str,list] = {name : [] for name in agent_folders}
+    memory_changes:dict[str,list] = {name : [] for name in agent_folders}
+    for record in records:
+      world_state = delta.apply(world_state, record.get('world', []))
+      for name, changes in record.get('agents', {}).items():
+        component_changes[name].extend(changes.get('components', []))
+        memory_changes[name].extend(changes.get('memory', []))
+    world._restore(world_state)
+
+    # The small components are patched on disk, so that the builder loads them as usual.
+    recovered = os.path.join(directory, 'recovered')
+    shutil.rmtree(recovered, ignore_errors=True)
+    shutil.copytree(snapshot, recovered)
+    agents = []
+    for name, folder in agent_folders.items():
+      agent_folder = os.path.join(recovered, folder)
+      components = {}
+      for component in ('daily_planner', 'eyes', 'personality', 'spatial_memory'):
+        with open(os.path.join(agent_folder, f'{component}.json'), 'r') as file:
+          components[component] = json.load(file)
+      components = delta.apply(components, component_changes[name])
+      for component, state in components.items():
+        with open(os.path.join(agent_folder, f'{component}.json'), 'w') as file:
+          json.dump(state, file)
+      agent = builder.initialize_agent(agent_folder)
+      agent._apply_memory_changes(memory_changes[name])
+      agents.append(agent)
+    return agents
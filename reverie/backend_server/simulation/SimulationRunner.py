@@ -0,0 +1,144 @@
+'''
+Drives a world with any amount of agents.
+
+Agent.tick is synchronous and spends nearly all of its time waiting on the
+model, so ticking agents one after the other serializes every LLM call of
+every agent. The runner owns the world clock instead and ticks all agents
+for the same minute concurrently: each tick runs in a worker thread that is
+awaited on an asyncio event loop, and a semaphore bounds how many ticks (and
+so how many model requests) are in flight at once. Set max_concurrency to the
+amount of requests the model server handles in parallel (OLLAMA_NUM_PARALLEL).
+
+Results must not depend on thread timing, so:
+- Mutations of shared world state are deferred (World._defer) and applied at
+  the barrier at the end of the minute, in the order the agents were given.
+- Agents that are using the same object this minute are ticked one after the
+  other in that order, agents using different objects are ticked concurrently.
+
+Most minutes nothing happens: an agent that is asleep, or in the middle of a
+task without a target, does the same thing every minute until the task ends.
+With skip_idle_time, the clock jumps straight to the earliest time an agent
+has something to do (Agent.next_event_time), and only the agents whose event
+it is are ticked. An agent that another agent could see is ticked every
+minute, so the agents behave exactly as if every minute was ticked.
+'''
+import asyncio
+from datetime import datetime, timedelta
+from typing import Union
+
+from reverie.backend_server.persona.Agent import Agent
+from reverie.backend_server.simulation.Checkpointer import Checkpointer
+from reverie.backend_server.world.World import World, current_actor
+
+
+class SimulationRunner:
+  def __init__(self,
+               world:World,
+               agents:list[Agent],
+               max_concurrency:int=4,
+               checkpointer:Union[Checkpointer,None]=None) -> None:
+    '''
+    If a checkpointer is provided, a checkpoint is made after every tick.
+    '''
+    if max_concurrency < 1:
+      raise ValueError("max_concurrency must be at least 1")
+    self.__world = world
+    self.__agents = agents
+    self.__max_concurrency = max_concurrency
+    self.__checkpointer = checkpointer
+    # per agent, when it next has something to do, None until it was ticked
+    self.__next_events:list[Union[datetime,None]] = [None] * len(agents)
+
+  async def step(self):
+    '''
+    Advances the world by one minute, and ticks every agent for it.
+    If agents raise, the exception of the first agent (in order) is raised after the barrier.
+    '''
+    self.__world._tick()
+    await self.__tick_agents(list(enumerate(self.__agents)))
+
+  async def skip_to_next_event(self, until:Union[datetime,None]=None):
+    '''
+    Advances the world to the earliest next event of the agents, at least one minute
+    and no further than until, and ticks the agents whose event it is.
+    Errors are raised like in step.
+    '''
+    next_minute = self.__world.current_time + timedelta(minutes=1)
+    events = [next_minute if event is None else max(event, next_minute) for event in self.__next_events]
+    time = min(events, default=next_minute if until is None else until)
+    if until is not None:
+      time = max(min(time, until), next_minute)
+    self.__world._tick(round((time - self.__world.current_time) / timedelta(minutes=1)))
+    await self.__tick_agents([(position, agent) for position, (agent, event) in enumerate(zip(self.__agents, events))
+                              if event <= time])
+
+  async def __tick_agents(self, agents:list[tuple[int,Agent]]):
+    self.__world._start_deferring()
+    semaphore = asyncio.Semaphore(self.__max_concurrency)
+    results = await asyncio.gather(
+        *(self.__tick_group(group, semaphore) for group in self.__groups(agents)))
+    # Barrier, every agent has finished this minute
+    self.__world._apply_deferred()
+    if self.__checkpointer is not None:
+      self.__checkpointer.checkpoint()
+    errors = [error for group_errors in results for error in group_errors]
+    if errors:
+      raise min(errors, key=lambda error: error[0])[1]
+
+  def __groups(self, agents:list[tuple[int,Agent]])->list[list[tuple[int,Agent]]]:
+    '''
+    Agents that share a target object form a group, every other agent is in a group of its own.
+    '''
+    groups:dict[Union[str,int],list[tuple[int,Agent]]] = {}
+    for position, agent in agents:
+      target = agent.current_target
+      key = position if target is None else target.id
+      groups.setdefault(key, []).append((position, agent))
+    return list(groups.values())
+
+  async def __tick_group(self,
+                         group:list[tuple[int,Agent]],
+                         semaphore:asyncio.Semaphore)->list[tuple[int,BaseException]]:
+    errors = []
+    for position, agent in group:
+      async with semaphore:
+        # to_thread copies the context, so deferred mutations know which agent made them
+        current_actor.set(position)
+        try:
+          await asyncio.to_thread(agent.tick)
+          self.__next_events[position] = agent.next_event_time()
+        except Exception as e:
+          self.__next_events[position] = None
+          errors.append((position, e))
+    return errors
+
+  async def run(self, ticks:int):
+    for _ in range(ticks):
+      await self.step()
+
+  async def run_until(self, time:datetime, skip_idle_time:bool=False):
+    while self.__world.current_time < time:
+      if skip_idle_time:
+        await self.skip_to_next_event(time)
+      else:
+        await self.step()
+
+  def run_ticks(self, ticks:int):
+    '''
+    Synchronous entry point, runs its own event loop.
+    '''
+    asyncio.run(self.run(ticks))
+
+  def run_minutes(self, minutes:int, skip_idle_time:bool=True):
+    '''
+    Synchronous entry point, runs the world for the given amount of minutes, skipping idle time by default.
+    '''
+    asyncio.run(self.run_until(self.__world.current_time + timedelta(minutes=minutes), skip_idle_time))
+
+  @property
+  def agents(self)->list[Agent]:
+    return self.__agents[:]
+
+  @property
+  def world(self)->World:
+    return self.__world
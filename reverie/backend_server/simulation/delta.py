@@ -0,0 +1,60 @@
+'''
+Minimal structural diffs between two JSON compatible states.
+
+Only dictionaries are diffed key by key, anything else (including lists) is
+replaced as a whole when it changes. This is enough for the states in this
+project, which are small dictionaries that change a few keys at a time.
+
+An operation is either ["set", path, value] or ["del", path], where path is
+the list of keys leading to the value.
+'''
+import json
+from typing import Any
+
+
+def canonical(state:Any)->Any:
+  '''
+  A deep copy of the state with tuples turned into lists etc, as it would be after
+  a round trip through json. States must be canonical before they are diffed.
+  '''
+  return json.loads(json.dumps(state))
+
+
+def diff(old:Any, new:Any, path:tuple=())->list[list]:
+  if isinstance(old, dict) and isinstance(new, dict):
+    operations = []
+    for key, value in new.items():
+      if key not in old:
+        operations.append(["set", [*path, key], value])
+      elif old[key] != value:
+        operations.extend(diff(old[key], value, (*path, key)))
+    for key in old.keys() - new.keys():
+      operations.append(["del", [*path, key]])
+    return operations
+  if old == new:
+    return []
+  return [["set", list(path), new]]
+
+
+def apply(state:Any, operations:list[list])->Any:
+  '''
+  Applies the operations in place where possible, and returns the new state
+  (which is only a different object if the root was replaced).
+  '''
+  for operation in operations:
+    path = operation[1]
+    if not path:
+      if operation[0] == "set":
+        state = operation[2]
+        continue
+      raise ValueError("The root of a state can not be deleted")
+    parent = state
+    for key in path[:-1]:
+      parent = parent[key]
+    if operation[0] == "set":
+      parent[path[-1]] = operation[2]
+    elif operation[0] == "del":
+      del parent[path[-1]]
+    else:
+      raise ValueError(f"Unknown operation: '{operation[0]}'")
+  return state
@@ -0,0 +1,217 @@
+'''
+Lightweight tracing of where simulation time goes.
+
+Spans are named, timed sections of code:
+
+  with tracing.span('Agent.tick', agent=name):
+    ...
+
+  @tracing.traced()
+  def _wake_up_time(self): ...
+
+Every span adds its duration to the metrics registry (tracing.registry) under
+span.<name>. When a trace file is open (tracing.export_to), spans are also
+written to it, as a Chrome trace (load it in chrome://tracing or Perfetto)
+for a .json file, or one json object per line for a .jsonl file.
+
+Model calls are accounted for per call site, which is the innermost span they
+are made in (e.g. DailyPlanning._wake_up_time). Model.run_inference records
+the attempts, retries, fail safe responses and cache hits, and model clients
+report the token counts of the server through count_tokens.
+
+Spans cost about a microsecond, so they are meant for steps of the
+simulation, not for inner loops.
+'''
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Iterator, Literal, TextIO, Union
+
+
+class MetricsRegistry:
+  '''
+  Counters, and summaries (count, total, min, max) of observed values.
+  '''
+  def __init__(self) -> None:
+    self.__counters:dict[str,float] = {}
+    self.__summaries:dict[str,list[float]] = {}
+    self.__lock = threading.Lock()
+
+  def increment(self, name:str, amount:float=1):
+    with self.__lock:
+      self.__counters[name] = self.__counters.get(name, 0) + amount
+
+  def observe(self, name:str, value:float):
+    with self.__lock:
+      summary = self.__summaries.get(name)
+      if summary is None:
+        self.__summaries[name] = [1, value, value, value]
+      else:
+        summary[0] += 1
+        summary[1] += value
+        summary[2] = min(summary[2], value)
+        summary[3] = max(summary[3], value)
+
+  def snapshot(self)->dict[str,dict]:
+    with self.__lock:
+      return {
+          'counters' : dict(sorted(self.__counters.items())),
+          'summaries' : {
+            name : {'count' : count, 'total' : total, 'mean' : total / count, 'min' : minimum, 'max' : maximum}
+            for name, (count, total, minimum, maximum) in sorted(self.__summaries.items())
+          }
+        }
+
+  def clear(self):
+    with self.__lock:
+      self.__counters.clear()
+      self.__summaries.clear()
+
+
+class TraceFile:
+  '''
+  Writes finished spans to a file as they end.
+  '''
+  def __init__(self, path:str, trace_format:Literal['chrome','jsonl']) -> None:
+    self.__format = trace_format
+    self.__file:TextIO = open(path, 'w')
+    self.__first = True
+    self.__lock = threading.Lock()
+    self.__pid = os.getpid()
+    if self.__format == 'chrome':
+      self.__file.write('[\n')
+
+  def write(self, name:str, start:float, duration:float, attributes:dict):
+    '''
+    start and duration in seconds, start from time.perf_counter.
+    '''
+    if self.__format == 'chrome':
+      event = {'name' : name, 'ph' : 'X', 'ts' : start * 1e6, 'dur' : duration * 1e6,
+               'pid' : self.__pid, 'tid' : threading.get_ident(), 'args' : attributes}
+    else:
+      event = {'name' : name, 'start' : start, 'duration' : duration,
+               'thread' : threading.get_ident(), **attributes}
+    encoded = json.dumps(event, default=str)
+    with self.__lock:
+      if self.__format == 'chrome':
+        # the chrome trace format allows the closing bracket to be missing, so a crash still leaves a usable file
+        encoded = encoded if self.__first else ',\n' + encoded
+      else:
+        encoded = encoded + '\n'
+      self.__first = False
+      self.__file.write(encoded)
+
+  def close(self):
+    with self.__lock:
+      if self.__format == 'chrome':
+        self.__file.write('\n]\n')
+      self.__file.close()
+
+
+class LLMCall:
+  '''
+  Accounting of a single Model.run_inference call.
+  '''
+  __slots__ = ('site', 'attempts', 'fail_safe', 'cached', 'prompt_tokens', 'response_tokens')
+
+  def __init__(self, site:str) -> None:
+    self.site = site
+    self.attempts = 0
+    self.fail_safe = False
+    self.cached = False
+    self.prompt_tokens = 0
+    self.response_tokens = 0
+
+  @property
+  def retries(self)->int:
+    return max(self.attempts - 1, 0)
+
+
+registry = MetricsRegistry()
+_trace_file:Union[TraceFile,None] = None
+_current_span:ContextVar[Union[str,None]] = ContextVar('current_span', default=None)
+_current_call:ContextVar[Union[LLMCall,None]] = ContextVar('current_llm_call', default=None)
+
+
+@contextmanager
+def span(name:str, **attributes:Any)->Iterator[dict]:
+  '''
+  Times the block, the yielded attributes can be added to while it runs.
+  '''
+  token = _current_span.set(name)
+  start = time.perf_counter()
+  try:
+    yield attributes
+  finally:
+    duration = time.perf_counter() - start
+    _current_span.reset(token)
+    registry.observe(f'span.{name}', duration)
+    trace_file = _trace_file
+    if trace_file is not None:
+      trace_file.write(name, start, duration, attributes)
+
+def traced(name:Union[str,None]=None)->Callable[[Callable],Callable]:
+  '''
+  Decorator that runs the function in a span, named after the function by default.
+  '''
+  def decorator(function:Callable)->Callable:
+    span_name = name if name is not None else function.__qualname__
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      with span(span_name):
+        return function(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def current_span()->Union[str,None]:
+  return _current_span.get()
+
+@contextmanager
+def llm_call()->Iterator[LLMCall]:
+  '''
+  Accounts for a model call, the call site is the span it is made in.
+  '''
+  call = LLMCall(current_span() or 'unknown')
+  token = _current_call.set(call)
+  try:
+    with span('llm', site=call.site) as attributes:
+      yield call
+      attributes.update(attempts=call.attempts, retries=call.retries, fail_safe=call.fail_safe,
+                        cached=call.cached, prompt_tokens=call.prompt_tokens, response_tokens=call.response_tokens)
+  finally:
+    _current_call.reset(token)
+    prefix = f'llm.{call.site}'
+    registry.increment(f'{prefix}.calls')
+    registry.increment(f'{prefix}.attempts', call.attempts)
+    registry.increment(f'{prefix}.retries', call.retries)
+    registry.increment(f'{prefix}.fail_safes', int(call.fail_safe))
+    registry.increment(f'{prefix}.cache_hits', int(call.cached))
+    registry.increment(f'{prefix}.prompt_tokens', call.prompt_tokens)
+    registry.increment(f'{prefix}.response_tokens', call.response_tokens)
+
+def count_tokens(prompt_tokens:Union[int,None], response_tokens:Union[int,None]):
+  '''
+  Called by model clients with the token counts the server reported, for every attempt.
+  '''
+  call = _current_call.get()
+  if call is not None:
+    call.prompt_tokens += prompt_tokens or 0
+    call.response_tokens += response_tokens or 0
+
+def export_to(path:str):
+  '''
+  Writes every span from now on to path, a Chrome trace if it ends in .json, json lines otherwise.
+  '''
+  global _trace_file
+  stop_export()
+  _trace_file = TraceFile(path, 'chrome' if path.endswith('.json') else 'jsonl')
+
+def stop_export():
+  global _trace_file
+  trace_file, _trace_file = _trace_file, None
+  if trace_file is not None:
+    trace_file.close()
@@ -0,0 +1,145 @@
+'''
+Travel times to every game object and arena of a World, without path searches.
+
+A distance field holds, for every tile, the number of steps to the closest
+tile of a target: an object id from game_object_maze.csv (every tile of every
+object with that id is a source, so this is the distance to the nearest
+one), or an arena from arena_maze.csv (its entrances are the sources, the
+tiles of the arena next to a tile outside of it). Agents take one step per
+tick (see Legs.move), so steps are minutes, and moves are the same 8
+neighbours as in Pathfinder.py.
+
+A field is computed with a breadth first search (about a millisecond on the
+testing map) the first time its target is asked for, and kept until
+World.set_collision changes the map, so only the targets that are actually
+used cost anything.
+
+  fields = world.distance_fields
+  fields.travel_time((x, y), DistanceFields.object_key(bed.id))
+  fields.path((x, y), DistanceFields.arena_key(tile.sector, tile.arena))
+'''
+import threading
+from typing import Tuple, Union
+
+from numba import njit
+import numpy as np
+
+
+@njit(cache=True)
+def breadth_first_search(walkable, sources):
+  '''
+  Steps from every tile to the closest of the sources (rows of x, y), -1 where they can not be reached.
+  Sources are reached from their walkable neighbours even if they are not walkable themselves.
+  '''
+  width, length = walkable.shape
+  distances = np.full((width, length), -1, dtype=np.int32)
+  queue = np.empty(width * length, dtype=np.int64)
+  head = 0
+  tail = 0
+  for source in range(sources.shape[0]):
+    x = sources[source, 0]
+    y = sources[source, 1]
+    if distances[x, y] == -1:
+      distances[x, y] = 0
+      queue[tail] = x * length + y
+      tail += 1
+  while head < tail:
+    node = queue[head]
+    head += 1
+    x = node // length
+    y = node % length
+    for dx in range(-1, 2):
+      for dy in range(-1, 2):
+        next_x = x + dx
+        next_y = y + dy
+        if next_x < 0 or next_y < 0 or next_x >= width or next_y >= length:
+          continue
+        if distances[next_x, next_y] != -1 or walkable[next_x, next_y] == 0:
+          continue
+        distances[next_x, next_y] = distances[x, y] + 1
+        queue[tail] = next_x * length + next_y
+        tail += 1
+  return distances
+
+
+class DistanceFields:
+  def __init__(self,
+               walkable:np.ndarray,
+               sources:dict[str,np.ndarray],
+               version:int=0) -> None:
+    '''
+    sources maps a key (see object_key and arena_key) to its source tiles, as rows of x, y.
+    version is the World.collision_version that walkable belongs to.
+    '''
+    self.__walkable = walkable
+    self.__sources = sources
+    self.__version = version
+    self.__fields:dict[str,np.ndarray] = {}
+    # agents ask for fields from concurrent ticks
+    self.__lock = threading.Lock()
+
+  @staticmethod
+  def object_key(object_id:str)->str:
+    return f'object:{object_id}'
+
+  @staticmethod
+  def arena_key(sector:str, arena:str)->str:
+    return f'arena:{sector}:{arena}'
+
+  def recomputed(self, walkable:np.ndarray, version:int)->'DistanceFields':
+    '''
+    The same targets for a changed collision map, their fields are computed again when they are used.
+    '''
+    return DistanceFields(walkable, self.__sources, version)
+
+  def __contains__(self, key:str)->bool:
+    return key in self.__sources
+
+  def field(self, key:str)->np.ndarray:
+    '''
+    Steps to the target from every tile, indexed [x][y], -1 where it can not be reached.
+    Computed on first use. Throws KeyError for unknown targets.
+    '''
+    field = self.__fields.get(key)
+    if field is None:
+      with self.__lock:
+        field = self.__fields.get(key)
+        if field is None:
+          field = breadth_first_search(self.__walkable, self.__sources[key])
+          field.flags.writeable = False
+          self.__fields[key] = field
+    return field
+
+  def travel_time(self, location:Tuple[int,int], key:str)->Union[int,None]:
+    '''
+    Minutes it takes to walk from location to the target, None if it can not be reached.
+    Throws KeyError for unknown targets.
+    '''
+    steps = int(self.field(key)[location])
+    return None if steps < 0 else steps
+
+  def path(self, location:Tuple[int,int], key:str)->list[Tuple[int,int]]:
+    '''
+    A shortest walk from location to the target, by always stepping to a neighbour that is
+    one step closer. Starts at location and ends on a source tile, empty if it can not be reached.
+    '''
+    field = self.field(key)
+    x, y = location
+    if field[x, y] < 0:
+      return []
+    width, length = field.shape
+    path = [(x, y)]
+    while field[x, y] > 0:
+      x, y = next((x + dx, y + dy)
+                  for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                  if 0 <= x + dx < width and 0 <= y + dy < length and field[x + dx, y + dy] == field[x, y] - 1)
+      path.append((x, y))
+    return path
+
+  @property
+  def version(self)->int:
+    return self.__version
+
+  @property
+  def keys(self)->list[str]:
+    return list(self.__sources)
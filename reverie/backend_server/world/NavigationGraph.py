@@ -0,0 +1,478 @@
+'''
+Hierarchical path finding over the sectors and arenas of a World.
+
+The map is split into regions, the connected walkable tiles that share a
+sector and arena (the same grouping as Tile.is_in_same_arena). A room is a
+region, large arenas like the outdoor tiles of a sector are cut into blocks
+of _block_size tiles so that no region is expensive to search. Where two
+regions touch, every stretch of touching tiles becomes a portal: a pair of
+neighbouring tiles, one on each side, in the middle of the stretch (long
+stretches get a portal every _portal_spacing tiles).
+
+The abstract graph has the portal tiles as nodes. Nodes in the same region
+are connected by the cost of walking between them inside the region, and
+the two tiles of a portal by the cost of one step. These costs are computed
+once when the graph is built. A search then only explores the graph and the
+regions of the start and the goal. The tile path is produced afterwards by A*
+inside each region it passes through (see Pathfinder.a_star), and those
+refinements are cached, so a long trip costs a small graph search and a few
+searches the size of a room.
+
+Costs are the same as in Pathfinder.py, 1 per step and sqrt(2) per diagonal
+step. Paths always go through portals, so they can be slightly longer than
+the shortest path, which is why World.find_path only uses the graph when it
+is asked to.
+
+When the collision map changes, updated only labels the group (the arena
+within a block) of every changed tile again, and only connects the portals
+of the regions in it and of their neighbours again.
+'''
+import copy
+import math
+import threading
+from typing import Iterable, Tuple, Union
+
+from numba import njit
+import numpy as np
+
+from reverie.backend_server.world.Pathfinder import a_star, heap_pop, heap_push, octile
+
+
+_SQRT2 = math.sqrt(2)
+
+
+@njit(cache=True)
+def label_regions(walkable, keys):
+  '''
+  Labels the 8 connected components of walkable tiles with the same key, -1 for walls.
+  Returns the labels and the amount of regions.
+  '''
+  width, length = walkable.shape
+  labels = np.full((width, length), -1, dtype=np.int64)
+  queue = np.empty(width * length, dtype=np.int64)
+  regions = 0
+  for start_x in range(width):
+    for start_y in range(length):
+      if walkable[start_x, start_y] == 0 or labels[start_x, start_y] != -1:
+        continue
+      key = keys[start_x, start_y]
+      labels[start_x, start_y] = regions
+      head = 0
+      tail = 1
+      queue[0] = start_x * length + start_y
+      while head < tail:
+        node = queue[head]
+        head += 1
+        x = node // length
+        y = node % length
+        for dx in range(-1, 2):
+          for dy in range(-1, 2):
+            next_x = x + dx
+            next_y = y + dy
+            if next_x < 0 or next_y < 0 or next_x >= width or next_y >= length:
+              continue
+            if labels[next_x, next_y] != -1 or walkable[next_x, next_y] == 0 or keys[next_x, next_y] != key:
+              continue
+            labels[next_x, next_y] = regions
+            queue[tail] = next_x * length + next_y
+            tail += 1
+      regions += 1
+  return labels, regions
+
+
+@njit(cache=True)
+def walking_costs(walkable, start_x, start_y):
+  '''
+  Dijkstra from start over walkable, the cost of reaching every tile, inf where it can not be reached.
+  '''
+  width, length = walkable.shape
+  cost = np.full((width, length), np.inf)
+  closed = np.zeros((width, length), dtype=np.bool_)
+  heap_keys = np.empty(1024, dtype=np.float64)
+  heap_nodes = np.empty(1024, dtype=np.int64)
+  cost[start_x, start_y] = 0.0
+  heap_keys, heap_nodes, size = heap_push(heap_keys, heap_nodes, 0, 0.0, start_x * length + start_y)
+  while size > 0:
+    node, size = heap_pop(heap_keys, heap_nodes, size)
+    x = node // length
+    y = node % length
+    if closed[x, y]:
+      continue
+    closed[x, y] = True
+    for dx in range(-1, 2):
+      for dy in range(-1, 2):
+        if dx == 0 and dy == 0:
+          continue
+        next_x = x + dx
+        next_y = y + dy
+        if next_x < 0 or next_y < 0 or next_x >= width or next_y >= length or walkable[next_x, next_y] == 0:
+          continue
+        next_cost = cost[x, y] + (_SQRT2 if dx != 0 and dy != 0 else 1.0)
+        if next_cost < cost[next_x, next_y]:
+          cost[next_x, next_y] = next_cost
+          heap_keys, heap_nodes, size = heap_push(heap_keys, heap_nodes, size, next_cost, next_x * length + next_y)
+  return cost
+
+
+@njit(cache=True)
+def search_portals(portals, edge_starts, edge_ends, edge_costs, start_costs, goal_costs, goal_x, goal_y):
+  '''
+  A* over the portal graph. The edges of portal p are edge_ends[edge_starts[p]:edge_starts[p + 1]].
+  start_costs and goal_costs hold the cost from the start to every portal and from every portal to
+  the goal, inf for portals outside of their regions.
+  Returns the portals on the cheapest way from start to goal, empty if there is none.
+  '''
+  count = portals.shape[0]
+  cost = np.full(count, np.inf)
+  parent = np.full(count, -1, dtype=np.int64)
+  closed = np.zeros(count, dtype=np.bool_)
+  heap_keys = np.empty(256, dtype=np.float64)
+  heap_nodes = np.empty(256, dtype=np.int64)
+  size = 0
+  for portal in range(count):
+    if start_costs[portal] < np.inf:
+      cost[portal] = start_costs[portal]
+      heap_keys, heap_nodes, size = heap_push(heap_keys, heap_nodes, size,
+                                              cost[portal] + octile(portals[portal, 0], portals[portal, 1], goal_x, goal_y),
+                                              portal)
+  best_cost = np.inf
+  best_portal = -1
+  while size > 0:
+    if heap_keys[0] >= best_cost:
+      break
+    portal, size = heap_pop(heap_keys, heap_nodes, size)
+    if closed[portal]:
+      continue
+    closed[portal] = True
+    if cost[portal] + goal_costs[portal] < best_cost:
+      best_cost = cost[portal] + goal_costs[portal]
+      best_portal = portal
+    for edge in range(edge_starts[portal], edge_starts[portal + 1]):
+      neighbour = edge_ends[edge]
+      next_cost = cost[portal] + edge_costs[edge]
+      if next_cost < cost[neighbour]:
+        cost[neighbour] = next_cost
+        parent[neighbour] = portal
+        heap_keys, heap_nodes, size = heap_push(heap_keys, heap_nodes, size,
+                                                next_cost + octile(portals[neighbour, 0], portals[neighbour, 1], goal_x, goal_y),
+                                                neighbour)
+  if best_portal == -1:
+    return np.empty(0, dtype=np.int64)
+  steps = 1
+  portal = best_portal
+  while parent[portal] != -1:
+    portal = parent[portal]
+    steps += 1
+  way = np.empty(steps, dtype=np.int64)
+  portal = best_portal
+  for step in range(steps - 1, -1, -1):
+    way[step] = portal
+    portal = parent[portal]
+  return way
+
+
+class NavigationGraph:
+  _block_size = 24
+  _portal_spacing = 8
+
+  def __init__(self, walkable:np.ndarray, keys:np.ndarray, version:int=0) -> None:
+    '''
+    keys identifies the sector and arena of every tile (any integer, the same for tiles in the same arena).
+    version is the World.collision_version the graph belongs to.
+    '''
+    self.__version = version
+    self.__walkable = walkable
+    length = walkable.shape[1]
+    block_x, block_y = np.indices(walkable.shape) // self._block_size
+    blocks = block_x * (-(-length // self._block_size)) + block_y
+    # an arena within a block, regions never reach from one group into another
+    self.__groups = (keys.astype(np.int64) + 1) * (blocks.max() + 1) + blocks
+    self.__labels, regions = label_regions(walkable, self.__groups)
+    self.__next_region = regions
+    # per region, the corner of its bounding box and the region cropped to it
+    self.__offsets:dict[int,Tuple[int,int]] = {}
+    self.__masks:dict[int,np.ndarray] = {}
+    self.__crop((0, 0, *walkable.shape), range(regions))
+    # (region, other region) : its portals, rows of x, y in region and x, y in other region
+    self.__borders = self.__find_borders((0, 0, *walkable.shape))
+    # per region, the tiles of its portals, and the edges between them as
+    # (portal, other portal, cost) with the portals numbered in that order
+    self.__region_portals:dict[int,np.ndarray] = {}
+    self.__region_edges:dict[int,Tuple[np.ndarray,np.ndarray,np.ndarray]] = {}
+    self.__connect(set(range(regions)))
+    self.__compile()
+    # per region, (from tile, to tile) : the tiles in between, for portals of the region
+    self.__refined:dict[int,dict[Tuple[Tuple[int,int],Tuple[int,int]],list[Tuple[int,int]]]] = {}
+    self.__lock = threading.Lock()
+
+  def updated(self, walkable:np.ndarray, changed:list[Tuple[int,int]], version:int)->'NavigationGraph':
+    '''
+    The graph of walkable, a map that only differs from the map of this graph in the changed tiles.
+    Only the regions in the groups of the changed tiles are labelled again, and only their portals
+    and those of their neighbours are connected again. The result is the same as a new graph.
+    This graph is not changed, so it can still be searched meanwhile.
+    '''
+    graph = copy.copy(self)
+    graph.__update(walkable, changed, version)
+    return graph
+
+  def __update(self, walkable:np.ndarray, changed:list[Tuple[int,int]], version:int):
+    self.__version = version
+    self.__walkable = walkable
+    self.__labels = self.__labels.copy()
+    self.__offsets = dict(self.__offsets)
+    self.__masks = dict(self.__masks)
+    self.__borders = dict(self.__borders)
+    self.__region_portals = dict(self.__region_portals)
+    self.__region_edges = dict(self.__region_edges)
+    self.__refined = dict(self.__refined)
+    self.__lock = threading.Lock()
+
+    width, length = walkable.shape
+    removed:set[int] = set()
+    added:list[int] = []
+    # the block of every group, and its new regions
+    windows:list[Tuple[Tuple[int,int,int,int],list[int]]] = []
+    groups = {int(self.__groups[tile]) : tile for tile in changed}
+    for group, (x, y) in groups.items():
+      low_x, low_y = x - x % self._block_size, y - y % self._block_size
+      window = (low_x, low_y, min(width, low_x + self._block_size), min(length, low_y + self._block_size))
+      in_group = self.__groups[window[0]:window[2], window[1]:window[3]] == group
+      labels = self.__labels[window[0]:window[2], window[1]:window[3]]
+      removed.update(int(region) for region in np.unique(labels[in_group]) if region >= 0)
+      group_labels, regions = label_regions(walkable[window[0]:window[2], window[1]:window[3]] * in_group,
+                                            in_group.astype(np.int64))
+      labels[in_group] = -1
+      labels[group_labels >= 0] = group_labels[group_labels >= 0] + self.__next_region
+      new_regions = range(self.__next_region, self.__next_region + regions)
+      self.__next_region += regions
+      self.__crop(window, new_regions)
+      added.extend(new_regions)
+      windows.append((window, list(new_regions)))
+
+    for region in removed:
+      for regions in (self.__offsets, self.__masks, self.__region_portals, self.__region_edges, self.__refined):
+        regions.pop(region, None)
+    affected = set(added)
+    for pair in [pair for pair in self.__borders if pair[0] in removed or pair[1] in removed]:
+      affected.update(pair)
+      del self.__borders[pair]
+    for (low_x, low_y, high_x, high_y), new_regions in windows:
+      # the borders of a group are at most a tile outside of its block, so all of them are found
+      # there, but only part of the borders of the regions of the neighbouring blocks
+      borders = self.__find_borders((max(0, low_x - 1), max(0, low_y - 1), min(width, high_x + 1), min(length, high_y + 1)),
+                                    new_regions)
+      for pair in borders:
+        affected.update(pair)
+      self.__borders.update(borders)
+    self.__connect(affected - removed)
+    self.__compile()
+
+  def __crop(self, window:Tuple[int,int,int,int], regions:Iterable[int]):
+    '''
+    Stores the bounding box and mask of the regions, which lie inside of window (low x, low y, high x, high y).
+    '''
+    low_x, low_y, high_x, high_y = window
+    labels = self.__labels[low_x:high_x, low_y:high_y]
+    order = np.argsort(labels, axis=None, kind='stable')
+    sorted_labels = labels.ravel()[order]
+    for region in regions:
+      start, end = np.searchsorted(sorted_labels, [region, region + 1])
+      locations = np.stack(np.unravel_index(order[start:end], labels.shape), axis=1)
+      low = locations.min(axis=0)
+      high = locations.max(axis=0) + 1
+      self.__offsets[region] = (int(low[0]) + low_x, int(low[1]) + low_y)
+      self.__masks[region] = (labels[low[0]:high[0], low[1]:high[1]] == region).astype(np.int32)
+
+  def __find_borders(self,
+                     window:Tuple[int,int,int,int],
+                     regions:Union[list[int],None]=None)->dict[Tuple[int,int],np.ndarray]:
+    '''
+    The portals between the regions that touch inside of window, only between regions that touch
+    one of regions if it is given. Every stretch of neighbouring tiles on the border of two regions
+    gets a portal, long ones one every _portal_spacing tiles.
+    '''
+    low_x, low_y, high_x, high_y = window
+    labels = self.__labels[low_x:high_x, low_y:high_y]
+    width, length = labels.shape
+    # (region, other region) : {tile in region : tile in other region}
+    borders:dict[Tuple[int,int],dict[Tuple[int,int],Tuple[int,int]]] = {}
+    for dx, dy in ((1, 0), (0, 1), (1, 1), (1, -1)):
+      here = labels[:width - dx, max(0, -dy):length - max(0, dy)]
+      there = labels[dx:, max(0, dy):length - max(0, -dy)]
+      found = (here != there) & (here >= 0) & (there >= 0)
+      if regions is not None:
+        found &= np.isin(here, regions) | np.isin(there, regions)
+      for x, y in np.argwhere(found):
+        tile = (int(x) + low_x, int(y) + max(0, -dy) + low_y)
+        other = (tile[0] + dx, tile[1] + dy)
+        # the side is chosen by group and not by region, so that it does not depend on how regions are numbered
+        if self.__groups[tile] > self.__groups[other]:
+          tile, other = other, tile
+        borders.setdefault((int(self.__labels[tile]), int(self.__labels[other])), {}).setdefault(tile, other)
+    portals = {}
+    for pair, border in borders.items():
+      rows = []
+      for stretch in self.__stretches(sorted(border)):
+        pieces = -(-len(stretch) // self._portal_spacing)
+        for piece in range(pieces):
+          tile = stretch[(2 * piece + 1) * len(stretch) // (2 * pieces)]
+          rows.append((*tile, *border[tile]))
+      portals[pair] = np.array(rows, dtype=np.int64)
+    return portals
+
+  @staticmethod
+  def __stretches(tiles:list[Tuple[int,int]])->list[list[Tuple[int,int]]]:
+    '''
+    Groups tiles into 8 connected stretches.
+    '''
+    remaining = set(tiles)
+    stretches = []
+    for tile in tiles:
+      if tile not in remaining:
+        continue
+      remaining.remove(tile)
+      stretch = [tile]
+      for x, y in stretch:
+        for neighbour in ((x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+          if neighbour in remaining:
+            remaining.remove(neighbour)
+            stretch.append(neighbour)
+      stretches.append(sorted(stretch))
+    return stretches
+
+  def __connect(self, regions:set[int]):
+    '''
+    Collects the portals of the regions and the walking costs between them.
+    '''
+    portal_tiles:dict[int,dict[Tuple[int,int],None]] = {region : {} for region in regions}
+    for (region, other_region), portals in self.__borders.items():
+      if region in portal_tiles:
+        portal_tiles[region].update(dict.fromkeys(map(tuple, portals[:, :2].tolist())))
+      if other_region in portal_tiles:
+        portal_tiles[other_region].update(dict.fromkeys(map(tuple, portals[:, 2:].tolist())))
+    for region in sorted(regions):
+      self.__region_portals[region] = np.array(sorted(portal_tiles[region]), dtype=np.int64).reshape(-1, 2)
+      starts, ends, costs = [], [], []
+      for portal, tile in enumerate(self.__region_portals[region]):
+        portal_costs = self.__costs_from(region, tile)
+        others = np.flatnonzero(portal_costs < np.inf)
+        others = others[others != portal]
+        starts.append(np.full(len(others), portal, dtype=np.int64))
+        ends.append(others)
+        costs.append(portal_costs[others])
+      self.__region_edges[region] = (np.concatenate([np.empty(0, dtype=np.int64), *starts]),
+                                     np.concatenate([np.empty(0, dtype=np.int64), *ends]),
+                                     np.concatenate([np.empty(0, dtype=np.float64), *costs]))
+
+  def __compile(self):
+    '''
+    Numbers the portals and lays out the edges of the graph for search_portals.
+    The portals of a region get consecutive numbers, in the order of __region_portals.
+    '''
+    regions = list(self.__region_portals)
+    counts = [len(self.__region_portals[region]) for region in regions]
+    firsts = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    self.__first_portal = dict(zip(regions, firsts.tolist()))
+    self.__portals = np.concatenate([np.empty((0, 2), dtype=np.int64), *self.__region_portals.values()])
+    self.__portal_numbers = np.full(self.__labels.shape, -1, dtype=np.int64)
+    self.__portal_numbers[self.__portals[:, 0], self.__portals[:, 1]] = np.arange(len(self.__portals))
+    edges = [self.__region_edges[region] for region in regions]
+    # the edges of a region are numbered from its first portal on
+    offsets = np.repeat(firsts[:-1], [len(region_starts) for region_starts, _, _ in edges])
+    pairs = np.concatenate([np.empty((0, 4), dtype=np.int64), *self.__borders.values()])
+    tiles = self.__portal_numbers[pairs[:, 0], pairs[:, 1]]
+    others = self.__portal_numbers[pairs[:, 2], pairs[:, 3]]
+    step_costs = np.where((pairs[:, 0] != pairs[:, 2]) & (pairs[:, 1] != pairs[:, 3]), _SQRT2, 1.0)
+    starts = np.concatenate([tiles, others, np.concatenate([np.empty(0, dtype=np.int64), *(e[0] for e in edges)]) + offsets])
+    ends = np.concatenate([others, tiles, np.concatenate([np.empty(0, dtype=np.int64), *(e[1] for e in edges)]) + offsets])
+    costs = np.concatenate([step_costs, step_costs, *(e[2] for e in edges)])
+    order = np.argsort(starts, kind='stable')
+    self.__edge_starts = np.searchsorted(starts[order], np.arange(len(self.__portals) + 1))
+    self.__edge_ends = ends[order]
+    self.__edge_costs = costs[order]
+
+  def __numbers(self, region:int)->np.ndarray:
+    '''
+    The numbers of the portals of a region, in the order of __region_portals.
+    '''
+    first = self.__first_portal[region]
+    return np.arange(first, first + len(self.__region_portals[region]))
+
+  def __tile(self, portal:int)->Tuple[int,int]:
+    return (int(self.__portals[portal, 0]), int(self.__portals[portal, 1]))
+
+  def __costs_from(self, region:int, tile:Tuple[int,int])->np.ndarray:
+    '''
+    The walking cost from tile to every portal of its region (in the order of __region_portals), staying inside the region.
+    '''
+    offset_x, offset_y = self.__offsets[region]
+    costs = walking_costs(self.__masks[region], tile[0] - offset_x, tile[1] - offset_y)
+    locations = self.__region_portals[region]
+    return costs[locations[:, 0] - offset_x, locations[:, 1] - offset_y]
+
+  def __local_path(self, region:int, start:Tuple[int,int], goal:Tuple[int,int])->list[Tuple[int,int]]:
+    offset_x, offset_y = self.__offsets[region]
+    path = a_star(self.__masks[region], start[0] - offset_x, start[1] - offset_y, goal[0] - offset_x, goal[1] - offset_y)
+    return [(int(x) + offset_x, int(y) + offset_y) for x, y in path]
+
+  def __refined_path(self, start:int, goal:int)->list[Tuple[int,int]]:
+    start_tile, goal_tile = self.__tile(start), self.__tile(goal)
+    region = int(self.__labels[start_tile])
+    if region != self.__labels[goal_tile]:
+      return [start_tile, goal_tile]
+    with self.__lock:
+      path = self.__refined.get(region, {}).get((start_tile, goal_tile))
+    if path is None:
+      path = self.__local_path(region, start_tile, goal_tile)
+      with self.__lock:
+        # shared with the graphs updated from this one, for the regions that did not change
+        self.__refined.setdefault(region, {})[(start_tile, goal_tile)] = path
+    return path
+
+  def find_path(self, start:Tuple[int,int], goal:Tuple[int,int])->list[Tuple[int,int]]:
+    '''
+    The (x, y) locations from start to goal, both included, empty if there is no path.
+    '''
+    start_region = int(self.__labels[start])
+    goal_region = int(self.__labels[goal])
+    if start_region < 0 or goal_region < 0:
+      return []
+    if start_region == goal_region:
+      path = self.__local_path(start_region, start, goal)
+      if path:
+        return path
+
+    start_costs = np.full(len(self.__portals), np.inf)
+    start_costs[self.__numbers(start_region)] = self.__costs_from(start_region, start)
+    goal_costs = np.full(len(self.__portals), np.inf)
+    goal_costs[self.__numbers(goal_region)] = self.__costs_from(goal_region, goal)
+    way = search_portals(self.__portals, self.__edge_starts, self.__edge_ends, self.__edge_costs,
+                         start_costs, goal_costs, goal[0], goal[1]).tolist()
+    if not way:
+      return []
+    path = self.__local_path(start_region, start, self.__tile(way[0]))
+    for here, there in zip(way, way[1:]):
+      path.extend(self.__refined_path(here, there)[1:])
+    path.extend(self.__local_path(goal_region, self.__tile(way[-1]), goal)[1:])
+    return path
+
+  @staticmethod
+  def warm_up():
+    '''
+    Compiles (or loads from the cache) the kernels, with a map of two regions.
+    '''
+    walkable = np.ones((2, 2), dtype=np.int32)
+    NavigationGraph(walkable, np.array([[0, 0], [1, 1]])).find_path((0, 0), (1, 1))
+
+  @property
+  def version(self)->int:
+    return self.__version
+
+  @property
+  def regions(self)->int:
+    return len(self.__masks)
+
+  @property
+  def portals(self)->int:
+    return len(self.__portals)
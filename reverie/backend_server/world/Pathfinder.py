@@ -0,0 +1,197 @@
+'''
+Paths over the collision map of a World.
+
+This replaces the pathfinding package, which builds a Grid of Node objects
+from a nested list for every request and searches it in pure python. Here A*
+runs as a compiled kernel directly on the collision array the World keeps
+(see World.collision_map), and found paths are kept in an LRU cache keyed by
+start, goal and World.collision_version, so an agent that walks the same way
+every day mostly gets its path from the cache, and any change to the map
+invalidates every cached path.
+
+Movement is the same as AStarFinder with DiagonalMovement.always: 8
+neighbours, diagonal steps cost sqrt(2) and may cut corners. The heuristic
+is the octile distance, which is exact on an empty map, so paths are
+shortest paths (ties between equally short paths may be broken differently).
+'''
+from collections import OrderedDict
+import math
+import threading
+from typing import Tuple
+
+from numba import njit
+import numpy as np
+
+
+_SQRT2 = math.sqrt(2)
+
+
+@njit(cache=True)
+def octile(x, y, goal_x, goal_y):
+  '''
+  The cost of the shortest walk between two tiles on an empty map.
+  '''
+  dx = abs(x - goal_x)
+  dy = abs(y - goal_y)
+  return (dx + dy) + (_SQRT2 - 2) * min(dx, dy)
+
+
+@njit(cache=True)
+def heap_push(heap_keys, heap_nodes, size, key, node):
+  '''
+  A binary min heap of (key, node) in two arrays, which are replaced by larger ones when full.
+  Returns the arrays and the new size.
+  '''
+  if size == len(heap_keys):
+    grown_keys = np.empty(2 * len(heap_keys), dtype=np.float64)
+    grown_nodes = np.empty(2 * len(heap_nodes), dtype=np.int64)
+    grown_keys[:size] = heap_keys
+    grown_nodes[:size] = heap_nodes
+    heap_keys, heap_nodes = grown_keys, grown_nodes
+  position = size
+  heap_keys[position] = key
+  heap_nodes[position] = node
+  while position > 0:
+    parent = (position - 1) // 2
+    if heap_keys[parent] <= heap_keys[position]:
+      break
+    heap_keys[parent], heap_keys[position] = heap_keys[position], heap_keys[parent]
+    heap_nodes[parent], heap_nodes[position] = heap_nodes[position], heap_nodes[parent]
+    position = parent
+  return heap_keys, heap_nodes, size + 1
+
+
+@njit(cache=True)
+def heap_pop(heap_keys, heap_nodes, size):
+  '''
+  Removes the node with the smallest key, returns it and the new size.
+  '''
+  node = heap_nodes[0]
+  size -= 1
+  heap_keys[0] = heap_keys[size]
+  heap_nodes[0] = heap_nodes[size]
+  position = 0
+  while True:
+    smallest = position
+    left = 2 * position + 1
+    right = left + 1
+    if left < size and heap_keys[left] < heap_keys[smallest]:
+      smallest = left
+    if right < size and heap_keys[right] < heap_keys[smallest]:
+      smallest = right
+    if smallest == position:
+      break
+    heap_keys[smallest], heap_keys[position] = heap_keys[position], heap_keys[smallest]
+    heap_nodes[smallest], heap_nodes[position] = heap_nodes[position], heap_nodes[smallest]
+    position = smallest
+  return node, size
+
+
+@njit(cache=True)
+def a_star(walkable, start_x, start_y, goal_x, goal_y):
+  '''
+  walkable is indexed [x][y] and is non zero where a tile can be walked on.
+  Returns the path as an array of (x, y) rows from start to goal, both included,
+  and an empty array if the goal can not be reached.
+  '''
+  width, length = walkable.shape
+  if walkable[start_x, start_y] == 0 or walkable[goal_x, goal_y] == 0:
+    return np.empty((0, 2), dtype=np.int64)
+  cost = np.full(width * length, np.inf)
+  parent = np.full(width * length, -1, dtype=np.int64)
+  closed = np.zeros(width * length, dtype=np.bool_)
+  heap_keys = np.empty(1024, dtype=np.float64)
+  heap_nodes = np.empty(1024, dtype=np.int64)
+  start = start_x * length + start_y
+  goal = goal_x * length + goal_y
+  cost[start] = 0.0
+  heap_keys, heap_nodes, size = heap_push(heap_keys, heap_nodes, 0, octile(start_x, start_y, goal_x, goal_y), start)
+  while size > 0:
+    node, size = heap_pop(heap_keys, heap_nodes, size)
+    if closed[node]:
+      continue
+    if node == goal:
+      break
+    closed[node] = True
+    x = node // length
+    y = node % length
+    for dx in range(-1, 2):
+      for dy in range(-1, 2):
+        if dx == 0 and dy == 0:
+          continue
+        next_x = x + dx
+        next_y = y + dy
+        if next_x < 0 or next_y < 0 or next_x >= width or next_y >= length or walkable[next_x, next_y] == 0:
+          continue
+        neighbour = next_x * length + next_y
+        if closed[neighbour]:
+          continue
+        next_cost = cost[node] + (_SQRT2 if dx != 0 and dy != 0 else 1.0)
+        if next_cost < cost[neighbour]:
+          cost[neighbour] = next_cost
+          parent[neighbour] = node
+          heap_keys, heap_nodes, size = heap_push(heap_keys, heap_nodes, size,
+                                              next_cost + octile(next_x, next_y, goal_x, goal_y), neighbour)
+  if cost[goal] == np.inf:
+    return np.empty((0, 2), dtype=np.int64)
+  steps = 1
+  node = goal
+  while node != start:
+    node = parent[node]
+    steps += 1
+  path = np.empty((steps, 2), dtype=np.int64)
+  node = goal
+  for step in range(steps - 1, -1, -1):
+    path[step, 0] = node // length
+    path[step, 1] = node % length
+    node = parent[node]
+  return path
+
+
+class Pathfinder:
+  '''
+  Shortest paths with an LRU cache, shared by everything that walks in one World.
+  '''
+  def __init__(self, cache_size:int=4096) -> None:
+    self.__cache:OrderedDict[Tuple[Tuple[int,int],Tuple[int,int],int],Tuple[Tuple[int,int],...]] = OrderedDict()
+    self.__cache_size = cache_size
+    self.__lock = threading.Lock()
+    self.__hits = 0
+    self.__misses = 0
+
+  def find_path(self,
+                walkable:np.ndarray,
+                version:int,
+                start:Tuple[int,int],
+                goal:Tuple[int,int])->Tuple[Tuple[int,int],...]:
+    '''
+    The (x, y) locations from start to goal, both included, empty if there is no path.
+    version must change whenever walkable does, see World.collision_version.
+    '''
+    key = (start, goal, version)
+    with self.__lock:
+      path = self.__cache.get(key)
+      if path is not None:
+        self.__cache.move_to_end(key)
+        self.__hits += 1
+        return path
+      self.__misses += 1
+    path = tuple(map(tuple, a_star(walkable, start[0], start[1], goal[0], goal[1]).tolist()))
+    with self.__lock:
+      self.__cache[key] = path
+      if len(self.__cache) > self.__cache_size:
+        self.__cache.popitem(last=False)
+    return path
+
+  @staticmethod
+  def warm_up():
+    '''
+    Compiles (or loads from the cache) the kernel for the collision maps of World.
+    '''
+    walkable = np.ones((2, 2), dtype=np.int32)
+    a_star(walkable, 0, 0, 1, 1)
+
+  @property
+  def stats(self)->dict[str,int]:
+    with self.__lock:
+      return {'hits' : self.__hits, 'misses' : self.__misses, 'size' : len(self.__cache)}
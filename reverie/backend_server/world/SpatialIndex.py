@@ -0,0 +1,191 @@
+'''
+Finds the agents and objects near a location without scanning the map.
+
+Tiles keep their objects and agents in lists, so the only way to find what
+is around a location used to be going over every tile in range. The index
+keeps the tiles that hold objects, and the agents with the tile they are on,
+in buckets of _cell_size x _cell_size tiles, and per arena. A query only
+visits the buckets that overlap its range, so it takes time in proportion to
+what is found rather than to the size of the map.
+
+Objects never move, they are indexed when the World is created. Agents are
+indexed by Tile._add_agent and Tile._remove_agent (see Legs.move). Those go
+through World._defer while agents are ticked concurrently, so the index does
+not change while agents query it.
+
+Distances are Chebyshev distances between tile coordinates, so a radius is a
+square around the center: that is the area Eyes always looked at, and the
+number of steps (diagonal steps included) to get there in the open.
+'''
+import math
+from typing import TYPE_CHECKING, Tuple, Union
+
+from reverie.backend_server.world.world_objects.WorldObject import WorldObject
+
+if TYPE_CHECKING:
+  from reverie.backend_server.world.World import Tile
+
+
+class SpatialIndex:
+  _cell_size = 8
+
+  def __init__(self, tiles:list[list['Tile']]) -> None:
+    self.__width = len(tiles)
+    self.__length = len(tiles[0]) if tiles else 0
+    # cell : tiles with objects
+    self.__object_cells:dict[Tuple[int,int],list['Tile']] = {}
+    # (sector, arena) : tiles with objects
+    self.__object_arenas:dict[Tuple[str,str],list['Tile']] = {}
+    # cell : {agent : its tile}, and the same per (sector, arena)
+    self.__agent_cells:dict[Tuple[int,int],dict[object,'Tile']] = {}
+    self.__agent_arenas:dict[Tuple[str,str],dict[object,'Tile']] = {}
+    self.__agent_tiles:dict[object,'Tile'] = {}
+    for row in tiles:
+      for tile in row:
+        if tile.objects:
+          self.__object_cells.setdefault(self.__cell(tile.x, tile.y), []).append(tile)
+          self.__object_arenas.setdefault((tile.sector, tile.arena), []).append(tile)
+        for agent in tile.agents:
+          self.add_agent(agent, tile)
+
+  def __cell(self, x:int, y:int)->Tuple[int,int]:
+    return (x // self._cell_size, y // self._cell_size)
+
+  @staticmethod
+  def distance(a:Tuple[int,int], b:Tuple[int,int])->int:
+    return max(abs(a[0] - b[0]), abs(a[1] - b[1]))
+
+  def __cells_within(self, center:Tuple[int,int], radius:float)->list[Tuple[int,int]]:
+    x, y = center
+    low_x, low_y = self.__cell(max(0, math.floor(x - radius)), max(0, math.floor(y - radius)))
+    high_x, high_y = self.__cell(math.ceil(x + radius), math.ceil(y + radius))
+    return [(cell_x, cell_y) for cell_x in range(low_x, high_x + 1) for cell_y in range(low_y, high_y + 1)]
+
+  def add_agent(self, agent, tile:'Tile'):
+    '''
+    Called by Tile._add_agent, an agent is on one tile at a time.
+    '''
+    if agent in self.__agent_tiles:
+      self.remove_agent(agent)
+    self.__agent_tiles[agent] = tile
+    self.__agent_cells.setdefault(self.__cell(tile.x, tile.y), {})[agent] = tile
+    self.__agent_arenas.setdefault((tile.sector, tile.arena), {})[agent] = tile
+
+  def remove_agent(self, agent):
+    '''
+    Called by Tile._remove_agent.
+    '''
+    tile = self.__agent_tiles.pop(agent, None)
+    if tile is None:
+      return
+    cell = self.__cell(tile.x, tile.y)
+    del self.__agent_cells[cell][agent]
+    if not self.__agent_cells[cell]:
+      del self.__agent_cells[cell]
+    arena = (tile.sector, tile.arena)
+    del self.__agent_arenas[arena][agent]
+    if not self.__agent_arenas[arena]:
+      del self.__agent_arenas[arena]
+
+  def agent_tile(self, agent)->Union['Tile',None]:
+    return self.__agent_tiles.get(agent)
+
+  def agents_within(self, center:Tuple[int,int], radius:float)->list[Tuple[object,'Tile']]:
+    '''
+    The agents at most radius away from center with their tiles, the closest first.
+    '''
+    found = [(self.distance(center, tile.x_y_pair), agent, tile)
+             for cell in self.__cells_within(center, radius)
+             for agent, tile in self.__agent_cells.get(cell, {}).items()]
+    found.sort(key=lambda entry: entry[0])
+    return [(agent, tile) for distance, agent, tile in found if distance <= radius]
+
+  def objects_within(self, center:Tuple[int,int], radius:float)->list[Tuple[WorldObject,'Tile']]:
+    '''
+    The objects at most radius away from center, the closest first. An object that covers
+    several tiles is listed once, with its closest tile.
+    '''
+    found:dict[WorldObject,Tuple[float,'Tile']] = {}
+    for cell in self.__cells_within(center, radius):
+      for tile in self.__object_cells.get(cell, []):
+        distance = self.distance(center, tile.x_y_pair)
+        if distance > radius:
+          continue
+        for game_object in tile.objects:
+          if game_object not in found or distance < found[game_object][0]:
+            found[game_object] = (distance, tile)
+    return [(game_object, tile) for game_object, (_, tile) in sorted(found.items(), key=lambda entry: entry[1][0])]
+
+  def tiles_within(self, center:Tuple[int,int], radius:float)->list['Tile']:
+    '''
+    The tiles at most radius away from center that hold objects or agents, the closest first.
+    Other tiles have no events, so this is all that can be seen from center.
+    '''
+    tiles:dict['Tile',float] = {}
+    for cell in self.__cells_within(center, radius):
+      for tile in [*self.__object_cells.get(cell, []), *self.__agent_cells.get(cell, {}).values()]:
+        distance = self.distance(center, tile.x_y_pair)
+        if distance <= radius:
+          tiles[tile] = distance
+    return sorted(tiles, key=tiles.get)
+
+  def agents_in_arena(self, tile:'Tile')->list[Tuple[object,'Tile']]:
+    '''
+    The agents in the same arena as tile (see Tile.is_in_same_arena) with their tiles.
+    '''
+    return list(self.__agent_arenas.get((tile.sector, tile.arena), {}).items())
+
+  def objects_in_arena(self, tile:'Tile')->list[Tuple[WorldObject,'Tile']]:
+    '''
+    The objects in the same arena as tile, each with the first of its tiles in the arena.
+    '''
+    found:dict[WorldObject,'Tile'] = {}
+    for object_tile in self.__object_arenas.get((tile.sector, tile.arena), []):
+      for game_object in object_tile.objects:
+        found.setdefault(game_object, object_tile)
+    return list(found.items())
+
+  def nearest_object(self,
+                     center:Tuple[int,int],
+                     kind:Union[str,type],
+                     radius:float=math.inf)->Union[Tuple[WorldObject,'Tile'],None]:
+    '''
+    The closest object of a kind and its closest tile, None if there is none within radius.
+    kind is either an object name ('bed') or a WorldObject class (Computer).
+    The buckets are searched in rings around center, so this stops as soon as nothing closer can be found.
+    '''
+    def matches(game_object:WorldObject)->bool:
+      return game_object.name == kind if isinstance(kind, str) else isinstance(game_object, kind)
+
+    center_x, center_y = self.__cell(*center)
+    rings = max(center_x, center_y,
+                (self.__width - 1) // self._cell_size - center_x,
+                (self.__length - 1) // self._cell_size - center_y)
+    best:Union[Tuple[float,WorldObject,'Tile'],None] = None
+    for ring in range(rings + 1):
+      # everything from this ring on is more than (ring - 1) * _cell_size away
+      if best is not None and best[0] <= (ring - 1) * self._cell_size:
+        break
+      if (ring - 1) * self._cell_size > radius:
+        break
+      for cell in self.__ring((center_x, center_y), ring):
+        for tile in self.__object_cells.get(cell, []):
+          distance = self.distance(center, tile.x_y_pair)
+          if distance > radius or (best is not None and distance >= best[0]):
+            continue
+          for game_object in tile.objects:
+            if matches(game_object):
+              best = (distance, game_object, tile)
+              break
+    return None if best is None else best[1:]
+
+  @staticmethod
+  def __ring(center:Tuple[int,int], ring:int)->list[Tuple[int,int]]:
+    '''
+    The cells exactly ring cells away from center.
+    '''
+    x, y = center
+    if ring == 0:
+      return [center]
+    sides = [(x + offset, y + side) for side in (-ring, ring) for offset in range(-ring, ring + 1)]
+    return sides + [(x + side, y + offset) for side in (-ring, ring) for offset in range(-ring + 1, ring)]
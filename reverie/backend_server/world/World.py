@@ -5,7 +5,9 @@ File: maze.py
 Description: Defines the Maze class, which represents the map of the simulated
 world in a 2-dimensional matrix. 
 """
+from contextvars import ContextVar
 from datetime import datetime, timedelta
+import threading
 import numpy as np
 
 '''
@@ -22,8 +24,15 @@ from collections.abc import Callable
 from typing import Any, Literal, Self, Tuple, Union
 import itertools
 
+from reverie.backend_server.world.DistanceFields import DistanceFields
+from reverie.backend_server.world.NavigationGraph import NavigationGraph
+from reverie.backend_server.world.Pathfinder import Pathfinder
+from reverie.backend_server.world.SpatialIndex import SpatialIndex
 from reverie.backend_server.world.world_objects.WorldObject import WorldObject
 
+# Position of the agent whose tick is running in the current context, see World._defer
+current_actor:ContextVar[int] = ContextVar('current_actor', default=0)
+
 
 class Tile:
   '''
@@ -56,6 +65,7 @@ class Tile:
     # See world_objects/ObjectList.py for a better understanding of whats happening in this loop
     self.__objects = objects
     self.__agents:list[Agent] = []
+    self.__spatial_index:Union[SpatialIndex,None] = None
     # TODO see if we can store agents in the tiles, but I suspect there will be a circular dependency
 
   def is_in_same_arena(self,to_compare:Self):
@@ -64,11 +74,27 @@ class Tile:
         return True
     return False
 
+  def attach_index(self,spatial_index:SpatialIndex):
+    '''
+    The World does this for all of its tiles, so that agents entering and leaving are indexed.
+    '''
+    self.__spatial_index = spatial_index
+
   def _add_agent(self,agent):
     self.__agents.append(agent)
+    if self.__spatial_index is not None:
+      self.__spatial_index.add_agent(agent, self)
 
   def _remove_agent(self,agent):
     self.__agents.remove(agent)
+    if self.__spatial_index is not None:
+      self.__spatial_index.remove_agent(agent)
+
+  def _set_wall(self,collide:bool):
+    '''
+    Only World.set_collision should call this, it keeps the collision map in sync.
+    '''
+    self.__colidable = collide
 
   @property
   def sector(self):
@@ -124,15 +150,56 @@ class World:
                length:int,
                tiles:list[list[Tile]],
                time:datetime,
-               world_objects:dict[str,WorldObject]):
+               world_objects:dict[str,WorldObject],
+               collision_map:Union[np.ndarray,None]=None,
+               distance_fields:Union[DistanceFields,None]=None,
+               arena_keys:Union[np.ndarray,None]=None):
+    '''
+    collision_map must agree with the tiles, 1 where a tile can be walked on and 0 for walls,
+    it is built from the tiles if it is not provided.
+    distance_fields are provided by the WorldFactory, see world/DistanceFields.py.
+    arena_keys numbers the arena of every tile for the NavigationGraph, it is built from the tiles if it is not provided.
+    '''
     self._maze_name = world_name
     self._maze_length = length
     self._maze_width = width
     self.__tiles = tiles
     self.__world_time = time
     self.__objects = world_objects
+    # ids of the objects whose state changed, only recorded once _track_changes is called
+    self.__changed_objects:Union[set[str],None] = None
+    self.__collisions_changed = False
     for obj in self.__objects.values():
       obj.attach_time(lambda: self.current_time)
+      obj.attach_change_feed(self.__object_changed)
+    self.__deferring = False
+    self.__deferred:list[Tuple[int,int,Callable[[],None]]] = []
+    self.__deferred_lock = threading.Lock()
+    if collision_map is None:
+      collision_map = np.array([[0 if tile.wall else 1 for tile in row] for row in tiles], dtype=np.int32)
+    if collision_map.shape != (width, length):
+      raise ValueError(f"collision_map has shape {collision_map.shape}, the world is {(width, length)}")
+    self.__collision_map = collision_map.astype(np.int32)
+    self.__collision_version = 0
+    # the tile that changed with every version, to update what is derived from the map
+    self.__changed_tiles:list[Tuple[int,int]] = []
+    # 'x,y' : collide, for every tile changed by set_collision, this is part of the state
+    self.__collision_changes:dict[str,bool] = {}
+    self.__pathfinder = Pathfinder()
+    self.__distance_fields = distance_fields
+    self.__distance_fields_lock = threading.Lock()
+    if arena_keys is None:
+      arenas:dict[Tuple[str,str],int] = {}
+      arena_keys = np.array([[arenas.setdefault((tile.sector, tile.arena), len(arenas)) for tile in row] for row in tiles],
+                            dtype=np.int64)
+    self.__arena_keys = arena_keys
+    # built the first time a long path is searched, see find_path
+    self.__navigation_graph:Union[NavigationGraph,None] = None
+    self.__navigation_graph_lock = threading.Lock()
+    self.__spatial_index = SpatialIndex(tiles)
+    for row in tiles:
+      for tile in row:
+        tile.attach_index(self.__spatial_index)
 
   def get_tile(self, tile:Tuple[int,int]): 
     """
@@ -171,11 +238,118 @@ class World:
   def _objects(self):
     return self.__objects
 
-  def _tick(self):
-    self.__world_time = self.__world_time + timedelta(minutes=1)
+  def _defer(self,mutation:Callable[[],None]):
+    '''
+    Mutations of shared world state (such as agents moving between tiles) go
+    through here. While agents are ticked concurrently, the mutation is queued
+    and applied at the end of the tick by _apply_deferred, in the order of the
+    agents (current_actor), so that the result does not depend on thread timing.
+    Otherwise it is applied immediately.
+    '''
+    if not self.__deferring:
+      mutation()
+      return
+    with self.__deferred_lock:
+      self.__deferred.append((current_actor.get(), len(self.__deferred), mutation))
+
+  def _start_deferring(self):
+    self.__deferring = True
+
+  def _apply_deferred(self):
+    '''
+    Applies the queued mutations, ordered by agent and then by the order they were made in.
+    '''
+    with self.__deferred_lock:
+      deferred, self.__deferred = self.__deferred, []
+      self.__deferring = False
+    for _, _, mutation in sorted(deferred, key=lambda entry: entry[:2]):
+      mutation()
+
+  # distance in tiles from which hierarchical paths are found over the navigation graph
+  _hierarchical_distance = 100
+
+  def find_path(self,start:Tuple[int,int],goal:Tuple[int,int],hierarchical:bool=False)->list[Tile]:
+    '''
+    The tiles of a shortest path from start to goal, both included, empty if there is none.
+    Paths are cached until the collision map changes, see world/Pathfinder.py.
+    With hierarchical, paths between far apart tiles go through the sectors and arenas on the
+    way instead, which is faster on large maps but they may be a few percent longer,
+    see world/NavigationGraph.py.
+    '''
+    if hierarchical and max(abs(start[0] - goal[0]), abs(start[1] - goal[1])) >= self._hierarchical_distance:
+      path = self.navigation_graph.find_path(start, goal)
+    else:
+      path = self.__pathfinder.find_path(self.__collision_map, self.__collision_version, start, goal)
+    return [self.get_tile(location) for location in path]
+
+  def set_collision(self,location:Tuple[int,int],collide:bool):
+    '''
+    Makes a tile a wall or walkable, for doors that lock or things that block the way.
+    Goes through _defer like every mutation of the world.
+    '''
+    self._defer(lambda: self.__set_collision(location, collide))
+
+  def __set_collision(self,location:Tuple[int,int],collide:bool):
+    tile = self.get_tile(location)
+    if tile.wall == collide:
+      return
+    tile._set_wall(collide)
+    self.__collision_map[location] = 0 if collide else 1
+    self.__collision_changes[f'{location[0]},{location[1]}'] = collide
+    self.__collision_version += 1
+    self.__changed_tiles.append(location)
+    self.__collisions_changed = True
+
+  def _tick(self,minutes:int=1):
+    self.__world_time = self.__world_time + timedelta(minutes=minutes)
 
   def _tick_back(self):
     self.__world_time = self.__world_time + timedelta(minutes=-1)
+  def state(self)->dict:
+    '''
+    Everything about the world that changes during a simulation.
+    The map itself is static and is loaded by the WorldFactory.
+    '''
+    return {
+        'world_time' : str(self.__world_time),
+        'objects' : {object_id : obj.state() for object_id, obj in self.__objects.items()},
+        'collisions' : dict(self.__collision_changes)
+      }
+
+  def __object_changed(self,object_id:str):
+    if self.__changed_objects is not None:
+      self.__changed_objects.add(object_id)
+
+  def _track_changes(self):
+    '''
+    Starts recording which parts of state() change (see _drain_changes), used for checkpointing.
+    '''
+    self.__changed_objects = set()
+    self.__collisions_changed = False
+
+  def _drain_changes(self)->dict:
+    '''
+    The parts of state() that may have changed since the last drain: the time, and
+    the collisions and the objects only if they changed. Unlike state(), this
+    does not grow with the amount of objects in the world.
+    '''
+    changes:dict = {'world_time' : str(self.__world_time)}
+    if self.__collisions_changed:
+      changes['collisions'] = dict(self.__collision_changes)
+      self.__collisions_changed = False
+    if self.__changed_objects:
+      changed, self.__changed_objects = self.__changed_objects, set()
+      changes['objects'] = {object_id : self.__objects[object_id].state() for object_id in sorted(changed)}
+    return changes
+
+  def _restore(self,state:dict):
+    self.__world_time = datetime.fromisoformat(state['world_time'])
+    for object_id, object_state in state['objects'].items():
+      self.__objects[object_id]._restore(object_state)
+    for location, collide in state.get('collisions', {}).items():
+      x, y = location.split(',')
+      self.__set_collision((int(x), int(y)), collide)
+
   @property
   def dimentions(self):
     return (self._maze_width,self._maze_length)
@@ -185,10 +359,49 @@ class World:
     return self.__world_time
 
   @property
-  def collision_map(self):
-    collision_map = np.ones(self.dimentions, dtype=np.int32)
-    for x,row in enumerate(self.__tiles):
-      for y,tile in enumerate(row):
-        if tile.wall:
-          collision_map[x][y] = 0
-    return collision_map
+  def collision_map(self)->np.ndarray:
+    '''
+    Indexed [x][y], 1 where a tile can be walked on and 0 for walls.
+    This is a read only view of the map the world maintains, see set_collision.
+    '''
+    view = self.__collision_map.view()
+    view.flags.writeable = False
+    return view
+
+  @property
+  def distance_fields(self)->Union[DistanceFields,None]:
+    '''
+    Travel times to every object and arena, None if the world was not loaded by the WorldFactory.
+    '''
+    with self.__distance_fields_lock:
+      if self.__distance_fields is not None and self.__distance_fields.version != self.__collision_version:
+        self.__distance_fields = self.__distance_fields.recomputed(self.__collision_map.copy(), self.__collision_version)
+      return self.__distance_fields
+
+  @property
+  def spatial_index(self)->SpatialIndex:
+    '''
+    The agents and objects by location and arena, see world/SpatialIndex.py.
+    '''
+    return self.__spatial_index
+
+  @property
+  def navigation_graph(self)->NavigationGraph:
+    '''
+    The graph of the sectors and arenas, updated where the collision map changed.
+    '''
+    with self.__navigation_graph_lock:
+      if self.__navigation_graph is None:
+        self.__navigation_graph = NavigationGraph(self.__collision_map.copy(), self.__arena_keys, self.__collision_version)
+      elif self.__navigation_graph.version != self.__collision_version:
+        self.__navigation_graph = self.__navigation_graph.updated(self.__collision_map.copy(),
+                                                                  self.__changed_tiles[self.__navigation_graph.version:],
+                                                                  self.__collision_version)
+      return self.__navigation_graph
+
+  @property
+  def collision_version(self)->int:
+    '''
+    Changes whenever the collision map does, so that anything derived from it can be cached.
+    '''
+    return self.__collision_version
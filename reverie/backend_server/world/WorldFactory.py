@@ -1,5 +1,10 @@
 from datetime import datetime
 import json
+from typing import Tuple
+
+import numpy as np
+
+from reverie.backend_server.world.DistanceFields import DistanceFields
 from reverie.backend_server.world.World import Tile, World
 from reverie.backend_server.world.world_objects.WorldObject import WorldObject
 from reverie.backend_server.world.world_objects.ObjectList import object_class_initializers
@@ -86,7 +91,69 @@ class WorldFactory:
       tiles.append(row)
 
     # Create world
-    return World(world_name,map_width,map_length,tiles,world_time,game_objects)
+    walkable = (np.array(collision_map) == "0").astype(np.int32)
+    arena_keys, arena_names = self.__arena_keys(np.array(arena_locations),
+                                                np.array(sector_locations),
+                                                sector_info,
+                                                area_info)
+    sources = self.__distance_field_sources(walkable,
+                                            np.array(game_object_locations),
+                                            arena_keys,
+                                            arena_names,
+                                            game_objects)
+    distance_fields = DistanceFields(walkable, sources)
+    return World(world_name,map_width,map_length,tiles,world_time,game_objects,walkable,distance_fields,arena_keys)
+
+  def __arena_keys(self,
+                   arena_locations:np.ndarray,
+                   sector_locations:np.ndarray,
+                   sector_info:dict[str,str],
+                   area_info:dict[str,str])->Tuple[np.ndarray,list[str]]:
+    '''
+    Numbers the arenas, which are identified by their sector and arena name like in Tile.is_in_same_arena.
+    Returns the number of the arena of every tile (-1 outside of arenas) and the DistanceFields.arena_key of every number.
+    '''
+    keys = np.full(arena_locations.shape, -1, dtype=np.int64)
+    arena_names:list[str] = []
+    for sector_id, arena_id in sorted(set(zip(sector_locations.ravel(), arena_locations.ravel()))):
+      if arena_id not in area_info:
+        continue
+      key = DistanceFields.arena_key(sector_info.get(sector_id, ""), area_info[arena_id])
+      if key not in arena_names:
+        arena_names.append(key)
+      keys[(sector_locations == sector_id) & (arena_locations == arena_id)] = arena_names.index(key)
+    return keys, arena_names
+
+  def __distance_field_sources(self,
+                               walkable:np.ndarray,
+                               game_object_locations:np.ndarray,
+                               keys:np.ndarray,
+                               arena_names:list[str],
+                               game_objects:dict[str,WorldObject])->dict[str,np.ndarray]:
+    '''
+    The tiles of every game object, and the entrances of every arena: its walkable tiles
+    next to a walkable tile that is not in the arena. An arena without entrances uses all of its tiles.
+    '''
+    sources:dict[str,np.ndarray] = {}
+    for object_id in sorted(game_objects):
+      locations = np.argwhere(game_object_locations == object_id)
+      if len(locations) > 0:
+        sources[DistanceFields.object_key(object_id)] = locations
+
+    entrance = np.zeros(walkable.shape, dtype=bool)
+    width, length = walkable.shape
+    padded_keys = np.pad(keys, 1, constant_values=-1)
+    padded_walkable = np.pad(walkable, 1, constant_values=0)
+    for dx in (-1, 0, 1):
+      for dy in (-1, 0, 1):
+        neighbour_keys = padded_keys[1 + dx:1 + dx + width, 1 + dy:1 + dy + length]
+        neighbour_walkable = padded_walkable[1 + dx:1 + dx + width, 1 + dy:1 + dy + length]
+        entrance |= (neighbour_walkable > 0) & (neighbour_keys != keys)
+    entrance &= (walkable > 0) & (keys >= 0)
+    for index, key in enumerate(arena_names):
+      locations = np.argwhere(entrance & (keys == index))
+      sources[key] = locations if len(locations) > 0 else np.argwhere(keys == index)
+    return sources
 
   def __create_game_objects(self,game_object_info:dict[str,dict])->dict[str,WorldObject]:
     to_return:dict = {}
@@ -466,6 +466,8 @@ class Computer(WorldObject):
     '''
     This will now raise an exception when we are done for this iteration
     '''
+    # the screen changes with (almost) every input
+    self._changed()
 
     if self._status == "Powered off":
       if input == "poweron":
@@ -507,7 +509,9 @@ class Computer(WorldObject):
   @property
   def ready_for_interaction(self):
     if self.localtime.minute == self.current_world_time.minute:
-      self.__delta = self.__delta - timedelta(seconds=60) if self.__delta.seconds >= 60 else self.__delta
+      if self.__delta.seconds >= 60:
+        self.__delta = self.__delta - timedelta(seconds=60)
+        self._changed()
       return True
     else:
       return False
@@ -515,3 +519,23 @@ class Computer(WorldObject):
   @property
   def object_time(self):
     return self.localtime
+
+  def state(self) -> dict:
+    return {
+        **super().state(),
+        'drive' : self.drive.structure,
+        'current_path' : self.drive.current_path,
+        'email' : self.email.structure,
+        'current_folder' : self.email.current_folder,
+        'screen' : self.screen,
+        'true_time_offset' : self.__delta // timedelta(milliseconds=1)
+      }
+
+  def _restore(self, state: dict):
+    super()._restore(state)
+    self.drive.structure = state['drive']
+    self.drive.current_path = state['current_path']
+    self.email.structure = state['email']
+    self.email.current_folder = state['current_folder']
+    self.screen = state['screen']
+    self.__delta = timedelta(milliseconds=state['true_time_offset'])
@@ -17,6 +17,7 @@ class WorldObject:
       self.__name:str = data['name']
       self.__data = data
       self._status:str = self.__data.get('status','idle')
+      self.__on_change:Union[Callable[[str],None],None] = None
     except:
       raise RuntimeError(f'WorldObject:__init__ for object{object_id}. Object source data does not contain required attributes.')
 
@@ -29,6 +30,19 @@ class WorldObject:
   def attach_time(self,time_func:Callable[[],datetime]):
     self._world_time = time_func
 
+  def attach_change_feed(self,on_change:Callable[[str],None]):
+    '''
+    The World does this so that it knows which objects to checkpoint, see World._drain_changes.
+    '''
+    self.__on_change = on_change
+
+  def _changed(self):
+    '''
+    Objects must call this whenever what state() returns changes.
+    '''
+    if self.__on_change is not None:
+      self.__on_change(self.__id)
+
   @property
   def current_world_time(self):
     return self._world_time()
@@ -60,3 +74,16 @@ class WorldObject:
   @property
   def id(self):
     return self.__id
+
+  def state(self)->dict:
+    '''
+    Everything about the object that can change during a simulation.
+    Objects with more state should override this and _restore.
+    '''
+    return {
+        'status' : self._status
+      }
+
+  def _restore(self,state:dict):
+    self._status = state['status']
+    self._changed()
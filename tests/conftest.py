@@ -0,0 +1,57 @@
+'''
+A world and agents without any model server: the models answer nothing and
+embeddings are random (but the same for the same text).
+'''
+import os
+
+import numpy as np
+import pytest
+
+from reverie.backend_server.persona.AgentFactory import AgentBuilder
+from reverie.backend_server.persona.models.model import Model
+from reverie.backend_server.world.WorldFactory import WorldFactory
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERSONALITY = os.path.join(REPO, 'assets', 'personalities', 'continuation_test')
+
+
+class FakeEmbeddings:
+  def embed(self, prompts:list[str])->np.ndarray:
+    return np.stack([self.embed_one(prompt) for prompt in prompts])
+
+  def embed_one(self, prompt:str)->np.ndarray:
+    return np.random.default_rng(sum(prompt.encode())).standard_normal(768).astype(np.float32)
+
+
+class SilentModel(Model):
+  def _format_final_prompt(self, user_prompt, system_prompt):
+    return {'prompt' : user_prompt, 'system' : system_prompt}
+
+  def _call_model(self, prompt):
+    return ''
+
+  def _call_model_with_context(self, prompt):
+    return {'response' : '', 'context' : []}
+
+
+def concepts_equal(expected:list[dict], got:list[dict])->bool:
+  if len(expected) != len(got):
+    return False
+  for a, b in zip(expected, got):
+    # embeddings make a round trip through float32
+    if not np.allclose(a['embedding'], b['embedding'], atol=1e-6):
+      return False
+    if {k : v for k, v in a.items() if k != 'embedding'} != {k : v for k, v in b.items() if k != 'embedding'}:
+      return False
+  return True
+
+
+@pytest.fixture
+def build():
+  '''
+  Returns a function that produces the testing world and an AgentBuilder for it.
+  '''
+  def build_world():
+    world = WorldFactory().produce_world(os.path.join(REPO, 'assets', 'world', 'testing'))
+    return world, AgentBuilder(world, SilentModel(), FakeEmbeddings())
+  return build_world
@@ -0,0 +1,65 @@
+'''
+The coroutines of AsyncModel retry, fall back and stream like the synchronous methods.
+'''
+import asyncio
+
+from reverie.backend_server import tracing
+from reverie.backend_server.persona.core.helpers import hour_minute_time_prefix, validate_hour_minute_time
+from reverie.backend_server.persona.models.AsyncModel import AsyncModel
+
+
+class ScriptedModel(AsyncModel):
+  '''
+  Answers with the given responses in order, an exception is raised instead of answered.
+  '''
+  def __init__(self, responses:list) -> None:
+    super().__init__()
+    self.responses = list(responses)
+    self.prompts:list[dict] = []
+
+  def _format_final_prompt(self, user_prompt, system_prompt):
+    return {'prompt' : user_prompt, 'system' : system_prompt}
+
+  def _answer(self, prompt_arguments):
+    self.prompts.append(dict(prompt_arguments))
+    response = self.responses.pop(0)
+    if isinstance(response, Exception):
+      raise response
+    return response
+
+  def _call_model(self, prompt_arguments):
+    return self._answer(prompt_arguments)
+
+  def _call_model_with_context(self, prompt_arguments):
+    return {'response' : self._answer(prompt_arguments), 'context' : [len(self.prompts)]}
+
+  async def _call_model_async(self, prompt_arguments):
+    return self._answer(prompt_arguments)
+
+  async def _call_model_with_context_async(self, prompt_arguments):
+    return {'response' : self._answer(prompt_arguments), 'context' : [len(self.prompts)]}
+
+
+def test_async_matches_sync():
+  scripts = [['7:30', ConnectionError(), '08:00'], ['x', 'y', 'z'], ['29:00', '06:15']]
+  for responses in scripts:
+    for prefix_validate in (None, hour_minute_time_prefix):
+      models = ScriptedModel(responses), ScriptedModel(responses)
+      arguments = ("When?", [], ["someone"], "07:00", validate_hour_minute_time, "fail safe")
+      expected = models[0].run_inference(*arguments, prefix_validate=prefix_validate)
+      got = asyncio.run(models[1].run_inference_async(*arguments, prefix_validate=prefix_validate))
+      assert got == expected
+      assert models[1].prompts == models[0].prompts
+
+      models = ScriptedModel(responses), ScriptedModel(responses)
+      expected = models[0].run_inference_with_context(*arguments, context=[0])
+      got = asyncio.run(models[1].run_inference_with_context_async(*arguments, context=[0]))
+      assert got == expected
+      assert models[1].prompts == models[0].prompts
+
+
+def test_async_calls_are_accounted():
+  before = tracing.registry.snapshot()['counters'].get('llm.async_test.attempts', 0)
+  with tracing.span('async_test'):
+    asyncio.run(ScriptedModel(['x', '08:00']).run_inference_async("When?", [], ["someone"], "07:00", validate_hour_minute_time, "fail safe"))
+  assert tracing.registry.snapshot()['counters']['llm.async_test.attempts'] - before == 2
@@ -0,0 +1,58 @@
+'''
+A simulation recovered from a checkpoint (snapshot + replayed write ahead log)
+must be the same as the one that was checkpointed.
+'''
+import json
+
+import numpy as np
+
+from conftest import PERSONALITY, concepts_equal
+from reverie.backend_server.simulation.Checkpointer import Checkpointer
+from reverie.backend_server.world.world_objects.Computer import Computer
+
+
+def test_restore_matches_checkpointed_state(tmp_path, build):
+  world, builder = build()
+  agent = builder.initialize_agent(PERSONALITY)
+  checkpointer = Checkpointer(str(tmp_path), world, [agent], compact_every=50)
+  memory = agent._Agent__short_term_memory
+  spatial_memory = agent._Agent__spatial_memory
+  computers = [obj for obj in world._objects().values() if isinstance(obj, Computer)]
+  rng = np.random.default_rng(1)
+  for tick in range(120):
+    world._tick()
+    for i in range(3):
+      memory._add_conceptnode('event', world.current_time, world.current_time, f'e{tick}-{i}', 3, rng.standard_normal(768))
+    # removing out of order leaves holes in the ids
+    if tick % 7 == 0:
+      memory._remove_node(list(memory._id_to_node)[-2])
+    if tick % 11 == 0:
+      memory._remove_node(list(memory._id_to_node)[-1])
+    if tick == 100 and computers:
+      computers[0].interact('poweron')
+      computers[0].interact('mkdir newdir')
+    spatial_memory._SpatialMemory__agent_locations['bob'] = world.get_tile((tick % 5, 3))
+    checkpointer.checkpoint()
+  checkpointer.close()
+  assert checkpointer.generation == 3
+
+  expected_agent = json.loads(json.dumps(agent.state()))
+  expected_world = json.loads(json.dumps(world.state(), default=str))
+  # a record torn by a crash is ignored
+  with open(tmp_path / f'wal_{checkpointer.generation}.jsonl', 'a') as file:
+    file.write('{"time":"20')
+
+  restored_world, restored_builder = build()
+  restored = Checkpointer.restore(str(tmp_path), restored_world, restored_builder)
+  assert json.loads(json.dumps(restored_world.state(), default=str)) == expected_world
+  got_agent = json.loads(json.dumps(restored[0].state()))
+  expected_memory = expected_agent.pop('short_term_memory')
+  got_memory = got_agent.pop('short_term_memory')
+  assert got_agent == expected_agent
+  assert concepts_equal(expected_memory.pop('concepts'), got_memory.pop('concepts'))
+  assert got_memory == expected_memory
+
+  # new concepts do not reuse the id of one that was restored
+  restored_memory = restored[0]._Agent__short_term_memory
+  node = restored_memory._add_conceptnode('event', restored_world.current_time, restored_world.current_time, 'new', 3, rng.standard_normal(768))
+  assert node.id not in memory._id_to_node
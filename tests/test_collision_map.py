@@ -0,0 +1,36 @@
+'''
+The collision map World keeps up to date is the same as one built from the tiles,
+and paths cached before a change are not used after it.
+'''
+import numpy as np
+import pytest
+
+from reverie.backend_server.world.Pathfinder import a_star
+
+
+def from_tiles(world)->np.ndarray:
+  width, length = world.dimentions
+  return np.array([[0 if world.get_tile((x, y)).wall else 1 for y in range(length)] for x in range(width)], dtype=np.int32)
+
+
+def test_collision_map_follows_set_collision(build):
+  world, _ = build()
+  assert np.array_equal(world.collision_map, from_tiles(world))
+  with pytest.raises(ValueError):
+    world.collision_map[0, 0] = 1
+
+  tiles = np.argwhere(from_tiles(world) > 0)
+  rng = np.random.default_rng(0)
+  pairs = [(tuple(map(int, tiles[start])), tuple(map(int, tiles[goal]))) for start, goal in rng.integers(0, len(tiles), (10, 2))]
+  for start, goal in pairs:
+    world.find_path(start, goal)
+
+  for step in range(300):
+    world.set_collision(tuple(map(int, tiles[rng.integers(len(tiles))])), bool(rng.random() < 0.7))
+    if step % 50 == 49:
+      collision_map = from_tiles(world)
+      assert np.array_equal(world.collision_map, collision_map)
+      for start, goal in pairs:
+        path = [tile.x_y_pair for tile in world.find_path(start, goal)]
+        assert len(path) == len(a_star(collision_map, *start, *goal))
+        assert all(collision_map[tile] > 0 for tile in path)
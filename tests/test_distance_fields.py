@@ -0,0 +1,63 @@
+'''
+Distance fields agree with a plain breadth first search, and are only computed when they are used.
+'''
+from collections import deque
+
+import numpy as np
+
+
+def reference_steps(walkable:np.ndarray, sources:list, start:tuple)->int:
+  '''
+  Steps from start to the closest source over 8 neighbours, -1 if there is no way.
+  Sources are reached from their walkable neighbours even if they are walls.
+  '''
+  width, length = walkable.shape
+  goals = {tuple(map(int, source)) for source in sources}
+  seen = {start}
+  queue = deque([(start, 0)])
+  while queue:
+    (x, y), steps = queue.popleft()
+    if (x, y) in goals:
+      return steps
+    for dx in (-1, 0, 1):
+      for dy in (-1, 0, 1):
+        tile = (x + dx, y + dy)
+        if 0 <= tile[0] < width and 0 <= tile[1] < length and tile not in seen:
+          if walkable[tile] or tile in goals:
+            seen.add(tile)
+            queue.append((tile, steps + 1))
+  return -1
+
+
+def test_fields_match_a_breadth_first_search(build):
+  world, _ = build()
+  fields = world.distance_fields
+  walkable = world.collision_map
+  rng = np.random.default_rng(0)
+  open_tiles = np.argwhere(walkable > 0)
+  for key in [fields.keys[i] for i in rng.choice(len(fields.keys), size=8, replace=False)]:
+    sources = fields._DistanceFields__sources[key]
+    for start in open_tiles[rng.choice(len(open_tiles), size=5, replace=False)]:
+      start = tuple(map(int, start))
+      steps = reference_steps(walkable, sources, start)
+      assert fields.travel_time(start, key) == (None if steps < 0 else steps)
+      path = fields.path(start, key)
+      assert len(path) == steps + 1
+      assert all(max(abs(a[0] - b[0]), abs(a[1] - b[1])) == 1 for a, b in zip(path, path[1:]))
+
+
+def test_fields_are_computed_lazily(build):
+  world, _ = build()
+  fields = world.distance_fields
+  assert fields._DistanceFields__fields == {}
+  key = fields.keys[0]
+  fields.field(key)
+  assert list(fields._DistanceFields__fields) == [key]
+
+  x, y = map(int, np.argwhere(world.collision_map > 0)[0])
+  world.set_collision((x, y), True)
+  recomputed = world.distance_fields
+  assert recomputed.version == world.collision_version
+  assert recomputed._DistanceFields__fields == {}
+  # a wall is only reached if it is a source
+  assert recomputed.field(key)[x, y] in (-1, 0)
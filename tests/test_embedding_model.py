@@ -0,0 +1,45 @@
+'''
+EmbeddingModel answers from its memo without asking twice, also while other threads evict it.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import numpy as np
+
+from reverie.backend_server.persona.models.EmbeddingModel import EmbeddingModel
+
+
+class CountingEmbeddingModel(EmbeddingModel):
+  def __init__(self, **kwargs) -> None:
+    super().__init__(**kwargs)
+    self.requested:list[str] = []
+    self.__lock = threading.Lock()
+
+  def _request_batch(self, phrases):
+    with self.__lock:
+      self.requested.extend(phrases)
+    return [self.expected(phrase).tolist() for phrase in phrases]
+
+  @staticmethod
+  def expected(phrase:str)->np.ndarray:
+    return np.random.default_rng(sum(phrase.encode())).standard_normal(8).astype(np.float32)
+
+
+def test_phrases_are_embedded_once():
+  model = CountingEmbeddingModel(max_batch_size=3)
+  phrases = ['a', 'b', 'a', 'c', 'd', 'e', 'b']
+  embeddings = model.embed(phrases)
+  assert model.requested == ['a', 'b', 'c', 'd', 'e']
+  assert all(np.array_equal(row, model.expected(phrase)) for row, phrase in zip(embeddings, phrases))
+  model.embed(['e', 'a', 'f'])
+  assert model.requested == ['a', 'b', 'c', 'd', 'e', 'f']
+
+
+def test_concurrent_eviction():
+  model = CountingEmbeddingModel(max_batch_size=4, max_cached=8)
+  rng = np.random.default_rng(0)
+  batches = [[f'phrase {i}' for i in rng.integers(0, 40, 6)] for _ in range(2000)]
+  def embed(phrases):
+    return all(np.array_equal(row, model.expected(phrase)) for row, phrase in zip(model.embed(phrases), phrases))
+  with ThreadPoolExecutor(max_workers=8) as pool:
+    assert all(pool.map(embed, batches))
@@ -0,0 +1,29 @@
+'''
+Idle time is only skipped while nothing can happen in view of the agent.
+'''
+from datetime import timedelta
+
+from conftest import PERSONALITY
+
+
+def test_skipping_stops_before_another_agent_can_be_seen(build):
+  world, builder = build()
+  agent = builder.initialize_agent(PERSONALITY)
+  other = builder.initialize_agent(PERSONALITY)
+  location = agent._Agent__spatial_memory.current_location
+  vision_radius = agent._Agent__eyes.vision_radius
+  alone = agent.next_event_time()
+  assert alone - world.current_time > timedelta(minutes=30)
+
+  location._add_agent(agent)
+  x, y = location.x_y_pair
+  # the agent itself is no reason to stop
+  assert agent.next_event_time() == alone
+
+  far = world.get_tile((x + vision_radius + 10, y))
+  far._add_agent(other)
+  assert agent.next_event_time() == world.current_time + timedelta(minutes=10)
+
+  far._remove_agent(other)
+  world.get_tile((x + vision_radius, y + vision_radius))._add_agent(other)
+  assert agent.next_event_time() == world.current_time + timedelta(minutes=1)
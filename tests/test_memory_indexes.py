@@ -0,0 +1,31 @@
+'''
+The sequences Memory keeps per concept type stay in the order a list of every
+added concept, minus the removed ones, would be in.
+'''
+import numpy as np
+
+from conftest import PERSONALITY
+
+
+def test_sequences_match_a_list_of_the_concepts(build):
+  world, builder = build()
+  memory = builder.initialize_agent(PERSONALITY)._Agent__short_term_memory
+  expected = {node_type : [concept.id for concept in reversed(memory._sequence(node_type))] for node_type in ('event', 'thought', 'chat')}
+  rng = np.random.default_rng(0)
+  for i in range(600):
+    if rng.random() < 0.6 or not memory._id_to_node:
+      node_type = ('event', 'thought', 'chat')[rng.integers(3)]
+      node = memory._add_conceptnode(node_type, world.current_time, world.current_time, f'c{i}', 3, rng.standard_normal(768))
+      expected[node_type].append(node.id)
+    else:
+      node_id = list(memory._id_to_node)[rng.integers(len(memory._id_to_node))]
+      memory._remove_node(node_id)
+      for ids in expected.values():
+        if node_id in ids:
+          ids.remove(node_id)
+
+  for node_type, ids in expected.items():
+    assert [concept.id for concept in memory._sequence(node_type)] == ids[::-1]
+    assert all(concept.node_type == node_type for concept in memory._sequence(node_type))
+  assert sorted(memory._id_to_node) == sorted(node_id for ids in expected.values() for node_id in ids)
+  assert len(memory._store) == len(memory._id_to_node)
@@ -0,0 +1,42 @@
+'''
+ModelSession trims contexts with the prompt as it is sent, whatever form it was given in.
+'''
+from reverie.backend_server.persona.core.Personality import Personality
+from reverie.backend_server.persona.models.ModelSession import ModelSession
+from reverie.backend_server.persona.models.PromptTemplate import PromptTemplate
+from reverie.backend_server.persona.models.model import Model
+
+
+class ContextModel(Model):
+  def __init__(self) -> None:
+    super().__init__()
+    self.contexts:list = []
+
+  def _format_final_prompt(self, user_prompt, system_prompt):
+    return {'prompt' : user_prompt, 'system' : system_prompt}
+
+  def _call_model(self, prompt_arguments):
+    return ''
+
+  def _call_model_with_context(self, prompt_arguments):
+    self.contexts.append(prompt_arguments['context'])
+    return {'response' : 'ok', 'context' : []}
+
+
+PERSONALITY = Personality({'first_name' : 'Ada', 'last_name' : 'Lane', 'age' : '30',
+                           'innate_traits' : 'calm', 'lifestyle' : 'early riser', 'learned_traits' : 'engineer'})
+
+
+def test_template_and_string_prompts_are_trimmed_the_same():
+  long_input = 'word ' * 600
+  context = list(range(2000))
+  trimmed = []
+  for user_prompt in ('Summarize: !<INPUT 0>!', PromptTemplate('Summarize: !<INPUT 0>!')):
+    model_session = ModelSession(ContextModel(), PERSONALITY, num_ctx=2048, response_tokens=256)
+    model_session.run_inference_with_context(user_prompt, [long_input], [PERSONALITY.get_summarized_identity()],
+                                             'ok', lambda response, _: response, 'fail safe', context=context)
+    trimmed.append(model_session.model.contexts[0])
+  assert trimmed[0] == trimmed[1]
+  # the filled in parameter takes about 1000 tokens of the 2048
+  assert len(trimmed[0]) < 2048 - 1000
+  assert trimmed[0] == context[-len(trimmed[0]):]
@@ -0,0 +1,78 @@
+'''
+Hierarchical paths are valid and close to the shortest ones, and a graph updated
+after the collision map changed is the same as a new one.
+'''
+import math
+
+import numpy as np
+
+from reverie.backend_server.world.NavigationGraph import NavigationGraph
+from reverie.backend_server.world.Pathfinder import a_star
+
+
+def length(path:list)->float:
+  return sum(math.dist(a, b) for a, b in zip(path, path[1:]))
+
+
+def assert_walkable(path:list, walkable:np.ndarray, start:tuple, goal:tuple):
+  assert path[0] == start and path[-1] == goal
+  assert all(walkable[tile] for tile in path)
+  assert all(max(abs(a[0] - b[0]), abs(a[1] - b[1])) == 1 for a, b in zip(path, path[1:]))
+
+
+def random_pairs(walkable:np.ndarray, count:int, seed:int)->list:
+  rng = np.random.default_rng(seed)
+  tiles = np.argwhere(walkable > 0)
+  return [(tuple(map(int, tiles[start])), tuple(map(int, tiles[goal])))
+          for start, goal in rng.integers(0, len(tiles), (count, 2))]
+
+
+def test_paths_are_close_to_the_shortest(build):
+  world, _ = build()
+  walkable = np.asarray(world.collision_map).copy()
+  graph = world.navigation_graph
+  ratios = []
+  for start, goal in random_pairs(walkable, 200, 0):
+    shortest = a_star(walkable, *start, *goal).tolist()
+    path = graph.find_path(start, goal)
+    assert bool(path) == bool(shortest)
+    if path:
+      assert_walkable(path, walkable, start, goal)
+      assert length(path) >= length(shortest) - 1e-9
+      if length(shortest) > 0:
+        ratios.append(length(path) / length(shortest))
+  # short paths can take a detour through a portal, long ones barely do
+  assert np.mean(ratios) < 1.05
+
+
+def test_world_paths_are_the_shortest_unless_asked(build):
+  world, _ = build()
+  walkable = np.asarray(world.collision_map)
+  for start, goal in random_pairs(walkable, 50, 1):
+    shortest = length(a_star(walkable.copy(), *start, *goal).tolist())
+    assert abs(length([tile.x_y_pair for tile in world.find_path(start, goal)]) - shortest) < 1e-9
+
+
+def test_updated_graph_is_the_same_as_a_new_one(build):
+  world, _ = build()
+  keys = world._World__arena_keys
+  graph = world.navigation_graph
+  rng = np.random.default_rng(2)
+  width, length_ = world.dimentions
+  for _ in range(4):
+    for _ in range(6):
+      x, y = int(rng.integers(width)), int(rng.integers(length_))
+      world.set_collision((x, y), bool(world.collision_map[x, y]))
+    updated = world.navigation_graph
+    assert updated is not graph and updated.version == world.collision_version
+    walkable = np.asarray(world.collision_map).copy()
+    fresh = NavigationGraph(walkable, keys, world.collision_version)
+    assert updated.regions == fresh.regions
+    assert (sorted(map(tuple, updated._NavigationGraph__portals.tolist()))
+            == sorted(map(tuple, fresh._NavigationGraph__portals.tolist())))
+    for start, goal in random_pairs(walkable, 100, 3):
+      path = updated.find_path(start, goal)
+      assert abs(length(path) - length(fresh.find_path(start, goal))) < 1e-9
+      if path:
+        assert_walkable(path, walkable, start, goal)
+    graph = updated
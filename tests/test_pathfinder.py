@@ -0,0 +1,38 @@
+'''
+World.find_path finds paths as short as the pathfinding package it replaced, from its cache too.
+'''
+import math
+
+import numpy as np
+import pytest
+
+pathfinding = pytest.importorskip('pathfinding')
+from pathfinding.core.diagonal_movement import DiagonalMovement
+from pathfinding.core.grid import Grid
+from pathfinding.finder.a_star import AStarFinder
+
+
+def length(path:list)->float:
+  return sum(math.dist(a, b) for a, b in zip(path, path[1:]))
+
+
+def test_paths_match_the_pathfinding_package(build):
+  world, _ = build()
+  collision_map = np.asarray(world.collision_map)
+  tiles = np.argwhere(collision_map > 0)
+  rng = np.random.default_rng(0)
+  for start, goal in rng.integers(0, len(tiles), (40, 2)):
+    start, goal = tuple(map(int, tiles[start])), tuple(map(int, tiles[goal]))
+    grid = Grid(matrix=collision_map.T.tolist())
+    nodes, _ = AStarFinder(diagonal_movement=DiagonalMovement.always).find_path(grid.node(*start), grid.node(*goal), grid)
+    expected = [(node.x, node.y) for node in nodes]
+
+    path = [tile.x_y_pair for tile in world.find_path(start, goal)]
+    assert bool(path) == bool(expected)
+    if path:
+      assert path[0] == start and path[-1] == goal
+      assert all(collision_map[tile] > 0 for tile in path)
+      assert all(max(abs(a[0] - b[0]), abs(a[1] - b[1])) == 1 for a, b in zip(path, path[1:]))
+      assert math.isclose(length(path), length(expected))
+    # the second time it comes from the cache
+    assert [tile.x_y_pair for tile in world.find_path(start, goal)] == path
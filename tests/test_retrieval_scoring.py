@@ -0,0 +1,64 @@
+'''
+The compiled scoring kernel scores and ranks concepts the same as scoring them one at a time.
+'''
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+from conftest import PERSONALITY
+from reverie.backend_server.persona.core.Memory import Memory
+from reverie.backend_server.persona.core.Personality import Personality
+from reverie.backend_server.persona.core.ShortTermMemory import ShortTermMemory
+
+
+class Regulator:
+  def determine_emotional_impact(self, type, description):
+    return 3
+
+
+NOW = datetime(2024, 10, 25, 8)
+
+
+def make_memory(size:int)->ShortTermMemory:
+  with open(os.path.join(PERSONALITY, 'short_term_memory.json')) as file:
+    short_term = json.load(file)
+  with open(os.path.join(PERSONALITY, 'personality.json')) as file:
+    personality = Personality(json.load(file))
+  rng = np.random.default_rng(0)
+  short_term['concepts'] = [{'type' : 'event',
+                             'created' : '2024-10-2%d 07:00:10' % (i % 5),
+                             'last_accessed' : '2024-10-2%d 07:%02d:10' % (i % 5, i % 60),
+                             'description' : f'd{i}',
+                             'impact' : int(rng.integers(1, 10)),
+                             'embedding' : rng.standard_normal(16).tolist()} for i in range(size)]
+  return ShortTermMemory(short_term, lambda: NOW, Regulator(), personality)
+
+
+def test_kernel_scores_match_scoring_each_candidate():
+  memory = make_memory(500)
+  query = np.random.default_rng(5).standard_normal(16)
+  for slots in (slice(0, memory._store.used), np.array([3, 0, 499, 17, 17])):
+    kernel = ShortTermMemory._retrieval_scores(memory, query, slots)
+    reference = Memory._retrieval_scores(memory, query, slots)
+    assert len(kernel) == len(reference) == 3
+    for got, expected in zip(kernel, reference):
+      assert np.allclose(got, expected, atol=1e-5)
+
+
+def test_retrieval_ranks_like_scoring_each_candidate():
+  memory = make_memory(500)
+  memory._remove_node('node_10')
+  queries = [np.random.default_rng(5).standard_normal(16), memory._id_to_node['node_3'].embedding]
+  best:dict[str,float] = {}
+  for query in queries:
+    for node_id, concept in memory._id_to_node.items():
+      if np.allclose(concept.embedding, query):
+        continue
+      score = float(np.dot((1, 2, 2), memory._retrieval_score(query, concept)))
+      best[node_id] = max(best.get(node_id, -np.inf), score)
+  expected = sorted(best, key=lambda node_id: -best[node_id])[:memory.attention_span]
+
+  got = [concept.id for concept in memory.retrieve_relevant_concepts(queries)]
+  assert got == expected
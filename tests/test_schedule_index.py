@@ -0,0 +1,63 @@
+'''
+ScheduleIndex answers the same as scanning the schedule, for times that move forward and back.
+'''
+import random
+from datetime import datetime, timedelta
+
+from reverie.backend_server.persona.core.planning.DailyPlanning import ScheduleIndex, Task, TimePeriod
+
+BASE = datetime(2024, 1, 1)
+
+
+def random_schedule(rng:random.Random)->list:
+  schedule = []
+  end = 0
+  for i in range(rng.randint(0, 12)):
+    # mostly back to back, with some overlapping, empty and inverted periods
+    if rng.random() < 0.7:
+      start = end
+      end = start + rng.randint(0, 90)
+      period = (start, end)
+    else:
+      start = rng.randint(0, 600)
+      period = (start, start + rng.randint(-10, 120))
+    schedule.append((TimePeriod(BASE + timedelta(minutes=period[0]), BASE + timedelta(minutes=period[1])), Task(f't{i}')))
+  return schedule
+
+
+def scan(schedule:list, time:datetime):
+  return next(((task, time_period) for time_period, task in schedule if time in time_period), None)
+
+
+def same(expected, got)->bool:
+  if expected is None or got is None:
+    return expected is got
+  return expected[0] is got[0] and expected[1] is got[1]
+
+
+def test_lookups_match_a_scan_of_the_schedule():
+  rng = random.Random(0)
+  for _ in range(300):
+    schedule = random_schedule(rng)
+    index = ScheduleIndex(schedule)
+    minutes = rng.sample(range(-20, 800), 40)
+    if rng.random() < 0.7:
+      minutes.sort()
+    for minute in minutes:
+      time = BASE + timedelta(minutes=minute)
+      current = scan(schedule, time)
+      assert same(current, index.current(time))
+
+      boundaries = [boundary for time_period, _ in schedule for boundary in (time_period.start, time_period.end) if boundary > time]
+      assert index.next_boundary(time) == min(boundaries, default=None)
+
+      # the first entry that is current later on and is not the current one, entries only change at boundaries
+      later = None
+      for boundary in sorted(boundaries):
+        entry = scan(schedule, boundary)
+        if entry is not None and (current is None or entry[0] is not current[0]):
+          later = entry
+          break
+      got = index.next(time)
+      assert (later is None) == (got is None)
+      assert later is None or later[0] is got[0]
@@ -0,0 +1,48 @@
+'''
+An agent loaded from Agent.save (a manifest and memory mapped embeddings) is the same
+as the agent that was saved, and retrieves the same concepts.
+'''
+import json
+
+import numpy as np
+
+from conftest import PERSONALITY, concepts_equal
+
+
+def test_saved_agent_loads_the_same(tmp_path, build):
+  world, builder = build()
+  agent = builder.initialize_agent(PERSONALITY)
+  memory = agent._Agent__short_term_memory
+  rng = np.random.default_rng(0)
+  for i in range(200):
+    memory._add_conceptnode('event', world.current_time, world.current_time, f'e{i}', 3, rng.standard_normal(768))
+  for node_id in list(memory._id_to_node)[5:200:9]:
+    memory._remove_node(node_id)
+  agent.save(str(tmp_path))
+  assert (tmp_path / 'short_term_memory.npy').exists()
+
+  loaded = builder.initialize_agent(str(tmp_path))
+  loaded_memory = loaded._Agent__short_term_memory
+  expected = json.loads(json.dumps(agent.state()))
+  got = json.loads(json.dumps(loaded.state()))
+  assert concepts_equal(expected['short_term_memory'].pop('concepts'), got['short_term_memory'].pop('concepts'))
+  assert got == expected
+
+  queries = [rng.standard_normal(768) for _ in range(3)]
+  assert ([concept.id for concept in loaded_memory.retrieve_relevant_concepts(queries)]
+          == [concept.id for concept in memory.retrieve_relevant_concepts(queries)])
+
+  # the freed slot is a row of the read only memory map
+  saved = np.load(tmp_path / 'short_term_memory.npy')
+  for node_id in list(memory._id_to_node)[3:30:4]:
+    memory._remove_node(node_id)
+    loaded_memory._remove_node(node_id)
+  for i in range(10):
+    embedding = rng.standard_normal(768)
+    memory._add_conceptnode('event', world.current_time, world.current_time, f'after{i}', 3, embedding)
+    loaded_memory._add_conceptnode('event', world.current_time, world.current_time, f'after{i}', 3, embedding)
+  expected = json.loads(json.dumps(agent.state()))
+  got = json.loads(json.dumps(loaded.state()))
+  assert concepts_equal(expected['short_term_memory'].pop('concepts'), got['short_term_memory'].pop('concepts'))
+  assert got == expected
+  assert np.array_equal(np.load(tmp_path / 'short_term_memory.npy'), saved)
@@ -0,0 +1,68 @@
+'''
+SpatialIndex answers the same as scanning every tile of the map.
+'''
+import random
+
+from reverie.backend_server.world.SpatialIndex import SpatialIndex
+from reverie.backend_server.world.world_objects.Computer import Computer
+
+
+class Walker:
+  def __init__(self, name:int) -> None:
+    self.name = name
+
+
+def square(center, radius):
+  '''
+  The tiles of the square Eyes used to slice out of the map.
+  '''
+  x, y = center
+  return lambda tile: abs(tile.x - x) <= radius and abs(tile.y - y) <= radius
+
+
+def test_queries_match_a_scan_of_every_tile(build):
+  world, _ = build()
+  index = world.spatial_index
+  width, length = world.dimentions
+  tiles = [world.get_tile((x, y)) for x in range(width) for y in range(length)]
+  rng = random.Random(0)
+  walkers = [Walker(i) for i in range(200)]
+  for walker in walkers:
+    world.get_tile((rng.randrange(width), rng.randrange(length)))._add_agent(walker)
+  for _ in range(2000):
+    walker = rng.choice(walkers)
+    index.agent_tile(walker)._remove_agent(walker)
+    world.get_tile((rng.randrange(width), rng.randrange(length)))._add_agent(walker)
+
+  for _ in range(50):
+    center = (rng.randrange(width), rng.randrange(length))
+    radius = rng.randrange(1, 40)
+    within = square(center, radius)
+
+    assert ({walker.name for walker, _ in index.agents_within(center, radius)}
+            == {walker.name for tile in tiles if within(tile) for walker in tile.agents})
+    assert set(index.tiles_within(center, radius)) == {tile for tile in tiles if (tile.objects or tile.agents) and within(tile)}
+    expected_objects = {}
+    for tile in tiles:
+      if within(tile):
+        for game_object in tile.objects:
+          distance = SpatialIndex.distance(center, tile.x_y_pair)
+          expected_objects[game_object] = min(expected_objects.get(game_object, distance), distance)
+    found = index.objects_within(center, radius)
+    assert {game_object for game_object, _ in found} == set(expected_objects)
+    assert all(SpatialIndex.distance(center, tile.x_y_pair) == expected_objects[game_object] for game_object, tile in found)
+
+    for kind in ('bed', 'desk', Computer, 'nothing'):
+      matches = lambda game_object: game_object.name == kind if isinstance(kind, str) else isinstance(game_object, kind)
+      candidates = [SpatialIndex.distance(center, tile.x_y_pair) for tile in tiles for game_object in tile.objects if matches(game_object)]
+      nearest = index.nearest_object(center, kind)
+      if not candidates:
+        assert nearest is None
+      else:
+        assert matches(nearest[0]) and SpatialIndex.distance(center, nearest[1].x_y_pair) == min(candidates)
+
+    tile = world.get_tile(center)
+    assert ({walker.name for walker, _ in index.agents_in_arena(tile)}
+            == {walker.name for other in tiles if other.is_in_same_arena(tile) for walker in other.agents})
+    assert ({game_object for game_object, _ in index.objects_in_arena(tile)}
+            == {game_object for other in tiles if other.is_in_same_arena(tile) for game_object in other.objects})
@@ -0,0 +1,74 @@
+'''
+Prefix validators keep working on constrained (structured) responses.
+'''
+import json
+
+from reverie.backend_server.persona.core.helpers import hour_minute_time_prefix, number_prefix
+from reverie.backend_server.persona.models.model import Model
+from reverie.backend_server.persona.models.StructuredOutput import StructuredOutput
+
+
+def test_prefixes_decode_to_prefixes_of_the_answer():
+  cases = [
+      (StructuredOutput.pattern(r'[0-9]{2}:[0-9]{2}'), {'answer' : '07:30'}),
+      (StructuredOutput.integer(1, 10), {'answer' : 7}),
+      (StructuredOutput.enum(['yes', 'no']), {'answer' : 'yes'}),
+      (StructuredOutput.lines(r'.+'), {'answer' : ['1) wake up "early"', '2) café \\ work', '3) sleep']}),
+    ]
+  for structured_output, answer in cases:
+    for response in (json.dumps(answer), json.dumps(answer, indent=2), json.dumps(answer, ensure_ascii=False)):
+      decoded = structured_output.decode(response)
+      for end in range(len(response) + 1):
+        partial = structured_output.decode_prefix(response[:end])
+        assert partial is None or decoded.startswith(partial), (response[:end], partial)
+      assert structured_output.decode_prefix(response) == decoded
+
+
+def test_structured_prefix_validate_aborts_early():
+  time_prefix = StructuredOutput.pattern(r'[0-9]{2}:[0-9]{2}').wrap_prefix(hour_minute_time_prefix)
+  assert time_prefix('')
+  assert time_prefix('{"answer": "07:3')
+  assert not time_prefix('{"answer": "27')
+  number = StructuredOutput.integer(1, 10).wrap_prefix(number_prefix)
+  assert number('{"answer": 1')
+  assert not number('{"answer": "a')
+
+
+class ConstrainedModel(Model):
+  def __init__(self, responses:list[str]) -> None:
+    super().__init__()
+    self.responses = responses
+    self.streamed:list[str] = []
+
+  def _format_final_prompt(self, user_prompt, system_prompt):
+    return {'prompt' : user_prompt, 'system' : system_prompt}
+
+  def _constrain(self, prompt_arguments, structured_output):
+    prompt_arguments['format'] = structured_output.format
+    return True
+
+  def _call_model(self, prompt_arguments):
+    return self.responses.pop(0)
+
+  def _call_model_with_context(self, prompt_arguments):
+    raise NotImplementedError()
+
+  def _stream_model(self, prompt_arguments, prefix_validate):
+    response = self.responses.pop(0)
+    for end in range(1, len(response) + 1):
+      if not prefix_validate(response[:end]):
+        self.streamed.append(response[:end])
+        raise ValueError(response[:end])
+    self.streamed.append(response)
+    return response
+
+
+def test_run_inference_keeps_prefix_validate_with_structured_output():
+  model = ConstrainedModel(['{"answer": "29:00"}', '{"answer": "08:15"}'])
+  response = model.run_inference("When?", [], ["someone"], "07:00",
+                                 lambda response, _: response, "fail safe",
+                                 prefix_validate=hour_minute_time_prefix,
+                                 structured_output=StructuredOutput.pattern(r'[0-9]{2}:[0-9]{2}'))
+  assert response == '08:15'
+  # the first answer was aborted as soon as the hour was too large
+  assert model.streamed[0] == '{"answer": "29'
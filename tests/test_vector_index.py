@@ -0,0 +1,57 @@
+'''
+IVFIndex finds the same neighbours as the exact FlatIndex, whether it trains inside add or in the background.
+'''
+import numpy as np
+
+from reverie.backend_server.persona.core.VectorIndex import FlatIndex, IVFIndex
+
+
+def clustered(rng:np.random.Generator, size:int, dimensions:int=32)->np.ndarray:
+  centers = rng.standard_normal((20, dimensions))
+  vectors = centers[rng.integers(20, size=size)] + 0.3 * rng.standard_normal((size, dimensions))
+  return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def fill(index, flat:FlatIndex, vectors:np.ndarray):
+  # removes interleaved with the adds, some of them while a training is running
+  for key, vector in enumerate(vectors):
+    index.add(key, vector)
+    flat.add(key, vector)
+    if key % 5 == 4:
+      index.remove(key - 2)
+      flat.remove(key - 2)
+
+
+def test_ivf_matches_flat_search():
+  rng = np.random.default_rng(0)
+  vectors = clustered(rng, 6000)
+  queries = clustered(rng, 50)
+  for background in (False, True):
+    flat = FlatIndex()
+    index = IVFIndex(train_threshold=1000, background=background)
+    fill(index, flat, vectors)
+    index.wait_for_training()
+    assert len(index) == len(flat)
+    assert index.n_lists > 1
+
+    recalls = []
+    for query in queries:
+      expected, expected_similarities = flat.search(query, 10)
+      got, similarities = index.search(query, 10)
+      assert np.all(np.diff(similarities) <= 0)
+      assert set(got) <= set(flat.keys)
+      recalls.append(len(set(got) & set(expected)) / 10)
+    assert np.mean(recalls) >= 0.9
+
+
+def test_probing_every_list_is_exact():
+  rng = np.random.default_rng(1)
+  vectors = clustered(rng, 3000)
+  flat = FlatIndex()
+  index = IVFIndex(n_probe=1000, train_threshold=500, background=False)
+  fill(index, flat, vectors)
+  for query in clustered(rng, 20):
+    expected, expected_similarities = flat.search(query, 25)
+    got, similarities = index.search(query, 25)
+    assert np.allclose(similarities, expected_similarities)
+    assert set(got) == set(expected)